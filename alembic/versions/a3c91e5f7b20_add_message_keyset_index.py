@@ -0,0 +1,32 @@
+"""add message (conversation_id, sent_at, id) index for keyset pagination
+
+Revision ID: a3c91e5f7b20
+Revises: 4abfdb0cdf78
+Create Date: 2026-10-18 09:12:41.220318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c91e5f7b20'
+down_revision: Union[str, Sequence[str], None] = '4abfdb0cdf78'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Add composite index serving cursor pagination of conversation history."""
+    op.create_index(
+        'ix_message_conversation_sent_at_id',
+        'message',
+        ['conversation_id', 'sent_at', 'id'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Drop the keyset pagination index."""
+    op.drop_index('ix_message_conversation_sent_at_id', table_name='message')
@@ -0,0 +1,34 @@
+"""drop unused active last_message_at index on conversations
+
+Revision ID: a7c2e5b19d30
+Revises: f3a1c7d9e2b4
+Create Date: 2026-10-18 14:05:27.402918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c2e5b19d30'
+down_revision: Union[str, Sequence[str], None] = 'f3a1c7d9e2b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Drop the partial index; the inbox query is served by the GIN index."""
+    op.drop_index('ix_conversations_last_message_at_active', table_name='conversations')
+
+
+def downgrade() -> None:
+    """Recreate the partial index."""
+    op.create_index(
+        'ix_conversations_last_message_at_active',
+        'conversations',
+        [sa.text('last_message_at DESC')],
+        unique=False,
+        postgresql_where=sa.text('last_message_id IS NOT NULL'),
+    )
@@ -0,0 +1,49 @@
+"""add event_broadcast_job table
+
+Revision ID: b5d8e1f3a924
+Revises: a7c2e5b19d30
+Create Date: 2026-10-18 15:12:48.530617
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d8e1f3a924'
+down_revision: Union[str, Sequence[str], None] = 'a7c2e5b19d30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create the durable queue of new-event broadcasts."""
+    op.create_table(
+        'event_broadcast_job',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('event_id', sa.Uuid(), nullable=False),
+        sa.Column('cursor', sa.Uuid(), nullable=True),
+        sa.Column('notified', sa.Integer(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('available_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['event_id'], ['event.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('event_id'),
+    )
+    op.create_index(
+        op.f('ix_event_broadcast_job_available_at'),
+        'event_broadcast_job',
+        ['available_at'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Drop the event broadcast queue."""
+    op.drop_index(op.f('ix_event_broadcast_job_available_at'), table_name='event_broadcast_job')
+    op.drop_table('event_broadcast_job')
@@ -0,0 +1,69 @@
+"""add conversation_member delivery/read watermarks
+
+Revision ID: c52d8f1a9e43
+Revises: a3c91e5f7b20
+Create Date: 2026-10-18 10:03:27.548112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52d8f1a9e43'
+down_revision: Union[str, Sequence[str], None] = 'a3c91e5f7b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create conversation_member and backfill it from participant_ids and the receipt arrays."""
+    op.create_table(
+        'conversation_member',
+        sa.Column('conversation_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('last_delivered_message_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('last_delivered_at', sa.DateTime(), nullable=True),
+        sa.Column('last_read_message_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('last_read_at', sa.DateTime(), nullable=True),
+        sa.Column('joined_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('conversation_id', 'user_id'),
+    )
+    op.create_index(op.f('ix_conversation_member_user_id'), 'conversation_member', ['user_id'], unique=False)
+
+    # One member row per participant
+    op.execute("""
+        INSERT INTO conversation_member (conversation_id, user_id, joined_at)
+        SELECT c.id, p.user_id, c.created_at
+        FROM conversations c, unnest(c.participant_ids) AS p(user_id)
+        ON CONFLICT DO NOTHING
+    """)
+
+    # Watermarks = newest message each member appears in delivered_to / read_by
+    for array_column, at_column, id_column in (
+        ('delivered_to', 'last_delivered_at', 'last_delivered_message_id'),
+        ('read_by', 'last_read_at', 'last_read_message_id'),
+    ):
+        op.execute(f"""
+            UPDATE conversation_member m
+            SET {at_column} = w.sent_at, {id_column} = w.id
+            FROM (
+                SELECT DISTINCT ON (msg.conversation_id, u.user_id)
+                    msg.conversation_id, u.user_id, msg.sent_at, msg.id
+                FROM message msg, unnest(msg.{array_column}) AS u(user_id)
+                WHERE msg.conversation_id IS NOT NULL
+                ORDER BY msg.conversation_id, u.user_id, msg.sent_at DESC, msg.id DESC
+            ) w
+            WHERE m.conversation_id = w.conversation_id AND m.user_id = w.user_id
+        """)
+
+
+def downgrade() -> None:
+    """Drop conversation_member."""
+    op.drop_index(op.f('ix_conversation_member_user_id'), table_name='conversation_member')
+    op.drop_table('conversation_member')
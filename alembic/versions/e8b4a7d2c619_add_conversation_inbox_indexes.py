@@ -0,0 +1,42 @@
+"""add GIN participant index and active last_message_at index on conversations
+
+Revision ID: e8b4a7d2c619
+Revises: c52d8f1a9e43
+Create Date: 2026-10-18 10:41:09.317554
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b4a7d2c619'
+down_revision: Union[str, Sequence[str], None] = 'c52d8f1a9e43'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Index participant_ids for @> lookups and recent activity ordering."""
+    op.create_index(
+        'ix_conversations_participant_ids_gin',
+        'conversations',
+        ['participant_ids'],
+        unique=False,
+        postgresql_using='gin',
+    )
+    op.create_index(
+        'ix_conversations_last_message_at_active',
+        'conversations',
+        [sa.text('last_message_at DESC')],
+        unique=False,
+        postgresql_where=sa.text('last_message_id IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Drop the inbox indexes."""
+    op.drop_index('ix_conversations_last_message_at_active', table_name='conversations')
+    op.drop_index('ix_conversations_participant_ids_gin', table_name='conversations')
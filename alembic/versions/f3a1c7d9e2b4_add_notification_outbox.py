@@ -0,0 +1,46 @@
+"""add notification_outbox table
+
+Revision ID: f3a1c7d9e2b4
+Revises: e8b4a7d2c619
+Create Date: 2026-10-18 11:20:43.871205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a1c7d9e2b4'
+down_revision: Union[str, Sequence[str], None] = 'e8b4a7d2c619'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create the outbox the notification relay publishes from."""
+    op.create_table(
+        'notification_outbox',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('notification_id', sa.Uuid(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('available_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['notification_id'], ['notification.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(
+        op.f('ix_notification_outbox_available_at'),
+        'notification_outbox',
+        ['available_at'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Drop the notification outbox."""
+    op.drop_index(op.f('ix_notification_outbox_available_at'), table_name='notification_outbox')
+    op.drop_table('notification_outbox')
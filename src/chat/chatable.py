@@ -0,0 +1,104 @@
+from os import getenv
+from uuid import UUID
+from typing import Iterable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.redis import redis
+
+# Safety net: sets are rebuilt from Postgres after this long even without invalidation
+CHATABLE_TTL = int(getenv("CHAT_CHATABLE_TTL", "86400"))
+
+# Marks a complete set, so users with no contacts are still cached and a set
+# created by a bare SADD (see add_pair) is treated as a miss
+_COMPLETE_MEMBER = "_"
+
+# Caches a rebuilt set only if the user wasn't invalidated since the rebuild read
+# their generation: a revoked contact read from Postgres just before must not be
+# marked complete. Merged into whatever is there instead of replacing it: without
+# the marker, the set only holds pairs add_pair added since, which the Postgres
+# read may have missed
+_STORE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return false
+end
+for i = 3, #ARGV do
+    redis.call('SADD', KEYS[1], ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return redis.call('SMEMBERS', KEYS[1])
+"""
+
+
+def _key(user_id: UUID) -> str:
+    return f"chatable:{user_id}"
+
+
+def _generation_key(user_id: UUID) -> str:
+    return f"chatable:{user_id}:gen"
+
+
+class ChatableCache:
+    """
+    Redis set per user of the users they can chat with (brand <-> influencer
+    through an accepted application). Filled lazily from get_chatable_users and
+    kept in sync when application statuses change.
+    """
+
+    def __init__(self):
+        self._store = redis.register_script(_STORE_SCRIPT)
+
+    async def get(self, user_id: UUID, db: Optional[AsyncSession] = None) -> List[UUID]:
+        """Contacts of a user, computing them from Postgres on a miss"""
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.smembers(_key(user_id))
+            pipe.get(_generation_key(user_id))
+            members, generation = await pipe.execute()
+        if _COMPLETE_MEMBER in members:
+            return [UUID(member) for member in members if member != _COMPLETE_MEMBER]
+
+        from src.chat.services import get_chatable_users
+
+        if db is not None:
+            contacts = await get_chatable_users(user_id, db)
+        else:
+            from src.database import AsyncSessionLocal
+            async with AsyncSessionLocal() as session:
+                contacts = await get_chatable_users(user_id, session)
+
+        members = await self._store(
+            keys=[_key(user_id), _generation_key(user_id)],
+            args=[generation or "0", CHATABLE_TTL, _COMPLETE_MEMBER, *[str(contact) for contact in contacts]],
+        )
+        if members is None:
+            # Invalidated meanwhile: answer from Postgres, the next call rebuilds
+            return list(contacts)
+        return [UUID(member) for member in members if member != _COMPLETE_MEMBER]
+
+    async def add_pair(self, brand_user_id: UUID, influencer_user_id: UUID):
+        """An application was accepted: the two users can now chat"""
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.sadd(_key(brand_user_id), str(influencer_user_id))
+            pipe.sadd(_key(influencer_user_id), str(brand_user_id))
+            pipe.expire(_key(brand_user_id), CHATABLE_TTL)
+            pipe.expire(_key(influencer_user_id), CHATABLE_TTL)
+            await pipe.execute()
+
+    async def invalidate(self, user_ids: Iterable[UUID]):
+        """
+        Drop cached sets. Used when a link may have disappeared: the pair could
+        still be connected through another accepted application.
+        """
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+
+        # The generation bump makes rebuilds already reading Postgres skip caching
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.delete(*[_key(user_id) for user_id in user_ids])
+            for user_id in user_ids:
+                pipe.incr(_generation_key(user_id))
+                pipe.expire(_generation_key(user_id), CHATABLE_TTL)
+            await pipe.execute()
+
+
+chatable_cache = ChatableCache()
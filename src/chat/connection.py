@@ -1,96 +1,509 @@
 from fastapi import WebSocket
-from uuid import UUID
-from src.redis import redis, pubsub_redis
+from uuid import UUID, uuid4
+from src.redis import redis
+from src.chat.membership import membership_cache
+from src.chat.presence import presence, PRESENCE_KEY, is_fresh
+from src.chat.chatable import chatable_cache
+from src.subscriber import SupervisedSubscriber
+from src.chat.outbox import SocketOutbox, is_ephemeral
+from src.chat.wire import encode, JSON_PROTOCOL
+from src.codec import dumps, loads
 import asyncio
-import json
-from typing import Dict, Set
+import re
+import socket
+from os import getenv
+from redis.exceptions import ResponseError
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from datetime import datetime, timezone
 
+# "direct": each worker subscribes only to the channels of users it holds sockets for
+# "pattern": each worker pattern-subscribes to every user's channels (legacy behaviour)
+CHAT_ROUTING_MODE = getenv("CHAT_ROUTING_MODE", "direct")
+
+# Always-subscribed channel for worker-wide control events; also keeps the
+# listener alive when no users are connected
+CHAT_CONTROL_CHANNEL = "chat_control"
+
+# Per-user channel prefixes a worker listens on
+USER_CHANNEL_PREFIXES = ("chat", "status", "typing", "receipt")
+
+# "user": messages are published to every recipient's chat:{user_id} channel
+# "conversation": messages are published once to conv:{conversation_id} and each
+# worker fans them out to its local participants
+CHAT_DELIVERY_MODE = getenv("CHAT_DELIVERY_MODE", "user")
+
+# "pubsub": chat events are fire-and-forget PUBLISHes on chat:{user_id}
+# "streams": chat events are appended to a per-user stream (chat_stream:{user_id}) read
+# through a consumer group per worker, so a listener that hits an error resumes where it
+# stopped and reconnecting sockets can replay what they missed (?last_event_id=...).
+# Each append also publishes an empty wake-up on chat:{user_id}; the worker holding the
+# user then reads just that stream
+CHAT_TRANSPORT = getenv("CHAT_TRANSPORT", "pubsub")
+CHAT_STREAM_MAXLEN = int(getenv("CHAT_STREAM_MAXLEN", "1000"))
+CHAT_STREAM_TTL = int(getenv("CHAT_STREAM_TTL", "86400"))
+
+# Replayed events are queued on the socket's outbox a page at a time, waiting for it to
+# drain in between (capped at half the outbox, so live events still fit)
+CHAT_REPLAY_PAGE_SIZE = int(getenv("CHAT_REPLAY_PAGE_SIZE", "100"))
+
+# Wake-ups can be lost (pub/sub), so every local stream is also read this often
+CHAT_STREAM_SWEEP_INTERVAL = float(getenv("CHAT_STREAM_SWEEP_INTERVAL", "5"))
+
+# Streams per XREADGROUP call and entries per stream
+CHAT_STREAM_READ_KEYS = int(getenv("CHAT_STREAM_READ_KEYS", "256"))
+CHAT_STREAM_READ_COUNT = int(getenv("CHAT_STREAM_READ_COUNT", "100"))
+
+# Consumer group (and consumer) name of this worker on every user stream. Unique per
+# process start, so a restarted worker never inherits another one's pending entries
+CHAT_WORKER_ID = f"{socket.gethostname()}-{uuid4().hex[:12]}"
+
+# Conversation-scoped events go to one channel per conversation. A worker subscribes
+# while it holds a socket viewing the conversation (typing) or, in conversation
+# delivery mode, while any local user is a participant (messages, receipts)
+CONVERSATION_CHANNEL_PREFIX = "conv"
+
+# Typing state expires without a refresh after this long; while a user keeps typing,
+# "is_typing: true" is re-published at most once per refresh interval
+TYPING_TIMEOUT = float(getenv("CHAT_TYPING_TIMEOUT", "5"))
+TYPING_REFRESH_INTERVAL = float(getenv("CHAT_TYPING_REFRESH_INTERVAL", "3"))
+
+# A client "stopped typing" is only published if typing doesn't resume within this
+# grace period, so stop/start flaps between keystrokes publish nothing
+TYPING_STOP_GRACE = float(getenv("CHAT_TYPING_STOP_GRACE", "1"))
+
+
 class ConnectionManager:
     def __init__(self):
         # Local connections for this worker
         self.active_connections: Dict[UUID, Set[WebSocket]] = {}
         
-        # Track typing status per user
-        self.typing_status: Dict[UUID, Dict[UUID, bool]] = {}  # {user_id: {other_user_id: is_typing}}
+        # Outbound queue + writer task per local socket
+        self._outboxes: Dict[WebSocket, SocketOutbox] = {}
+        
+        # Local sockets per conversation: {conversation_id: {user_id: sockets}}
+        self.conversation_connections: Dict[UUID, Dict[UUID, Set[WebSocket]]] = {}
         
-        # Redis pub/sub listener task
-        self._listener_task = None
+        # Conversation delivery mode: local users per conversation and the reverse map
+        self.conversation_members: Dict[UUID, Set[UUID]] = {}
+        self.user_conversations: Dict[UUID, Set[UUID]] = {}
+        self._subscribed_conversations: Set[UUID] = set()
+        
+        # Typing state of users connected to this worker
+        self.typing_status: Dict[UUID, Dict[UUID, Tuple[float, float]]] = {}  # {conversation_id: {user_id: (expires_at, last_published_at)}}
+        
+        # Typing expiry sweeper
+        self._typing_task = None
+        
+        # Chat event transport; the stream reader task only runs with "streams"
+        self.transport = CHAT_TRANSPORT
+        self.worker_id = CHAT_WORKER_ID
+        self._stream_task = None
+        
+        # Users whose stream has (or may have) unread entries, and users whose
+        # pending (delivered but unacknowledged) entries must be re-read first
+        self._stream_dirty: Set[UUID] = set()
+        self._stream_recover: Set[UUID] = set()
+        self._stream_wakeup = asyncio.Event()
+        
+        # Routing/delivery modes and the supervised pub/sub subscription
+        self.routing_mode = CHAT_ROUTING_MODE
+        self.delivery_mode = CHAT_DELIVERY_MODE
+        self.subscriber = SupervisedSubscriber(
+            "chat",
+            self._dispatch,
+            # Worker-wide control events (membership changes, ...)
+            channels={CHAT_CONTROL_CHANNEL},
+            patterns=set(self._pattern_subscriptions())
+        )
         
     async def start(self):
         """Start Redis listener when app starts"""
-        if self._listener_task is None:
-            self._listener_task = asyncio.create_task(self._redis_listener())
-            print("✅ Chat Redis listener started")
+        await self.subscriber.start()
+        print(f"✅ Chat Redis listener started ({self.routing_mode} routing, {self.delivery_mode} delivery)")
+        if self._typing_task is None:
+            self._typing_task = asyncio.create_task(self._expire_typing())
+        if self.transport == "streams" and self._stream_task is None:
+            self._stream_task = asyncio.create_task(self._stream_reader())
+            print(f"✅ Chat stream reader started (group {self.worker_id})")
     
     async def stop(self):
         """Stop Redis listener when app shuts down"""
-        if self._listener_task:
-            self._listener_task.cancel()
+        await self.subscriber.stop()
+        print("🛑 Chat Redis listener stopped")
+        if self._typing_task:
+            self._typing_task.cancel()
             try:
-                await self._listener_task
+                await self._typing_task
             except asyncio.CancelledError:
                 pass
-            print("🛑 Chat Redis listener stopped")
+        if self._stream_task:
+            self._stream_task.cancel()
+            try:
+                await self._stream_task
+            except asyncio.CancelledError:
+                pass
+
+    def _pattern_subscriptions(self) -> list:
+        """Patterns for pattern routing mode (every user's channels)"""
+        if self.routing_mode != "pattern":
+            return []
+        return [
+            "chat:*",     # Chat messages (stream wake-ups with the streams transport)
+            "status:*",   # Online/offline status
+            "typing:*",   # Typing indicators
+            "receipt:*",  # Delivery/read receipts
+        ]
+
+    async def _dispatch(self, channel: str, data: str):
+        """Route a pub/sub message to its handler (called by the subscriber, in order)"""
+        if channel == CHAT_CONTROL_CHANNEL:
+            await self._handle_control(data)
+        elif channel.startswith("chat:"):
+            if self.transport == "streams":
+                self._wake_stream(UUID(channel.split(":", 1)[1]))
+            else:
+                await self._handle_chat_message(channel, data)
+        elif channel.startswith("status:"):
+            await self._handle_status_update(channel, data)
+        elif channel.startswith("typing:"):
+            await self._handle_typing_indicator(channel, data)
+        elif channel.startswith("receipt:"):
+            await self._handle_receipt(channel, data)
+        elif channel.startswith(f"{CONVERSATION_CHANNEL_PREFIX}:"):
+            await self._handle_conversation_event(channel, data)
+
+    def _user_channels(self, user_id: UUID) -> list:
+        """Concrete per-user channels this worker listens on in direct routing mode"""
+        return [f"{prefix}:{user_id}" for prefix in USER_CHANNEL_PREFIXES]
+
+    # ============ STREAMS TRANSPORT ============
+
+    def _stream_key(self, user_id: UUID) -> str:
+        return f"chat_stream:{user_id}"
+
+    def _queue_chat_event(self, pipe, user_id: UUID, data: str):
+        """Add a chat event for a user to a pipeline, using the configured transport"""
+        if self.transport == "streams":
+            key = self._stream_key(user_id)
+            pipe.xadd(key, {"data": data}, maxlen=CHAT_STREAM_MAXLEN, approximate=True)
+            pipe.expire(key, CHAT_STREAM_TTL)
+            pipe.publish(f"chat:{user_id}", "")
+        else:
+            pipe.publish(f"chat:{user_id}", data)
+
+    async def _ensure_stream_group(self, user_id: UUID):
+        """Create this worker's consumer group on a user's stream (new events only)"""
+        try:
+            await redis.xgroup_create(self._stream_key(user_id), self.worker_id, id="$", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _drop_stream_group(self, user_id: UUID):
+        """Remove this worker's consumer group once it holds no sockets for the user"""
+        self._stream_recover.discard(user_id)
+        try:
+            await redis.xgroup_destroy(self._stream_key(user_id), self.worker_id)
+        except Exception as e:
+            print(f"⚠️ Could not drop stream group for {user_id}: {e}")
+
+    async def replay(self, user_id: UUID, websocket: WebSocket, last_event_id: str) -> int:
+        """
+        Send a reconnecting socket the chat events after `last_event_id`, in pages
+        so a client far behind doesn't overflow its outbox.
+        Events arriving while the replay runs may also be delivered live; clients
+        dedupe on `stream_id`.
+        """
+        if not re.fullmatch(r"\d+-\d+", last_event_id or ""):
+            return 0
+        
+        outbox = self._outboxes.get(websocket)
+        if outbox is None:
+            return 0
+        page_size = max(1, min(CHAT_REPLAY_PAGE_SIZE, outbox.max_size // 2))
+        
+        replayed = 0
+        while replayed < CHAT_STREAM_MAXLEN and not outbox.closed:
+            entries = await redis.xrange(
+                self._stream_key(user_id), min=f"({last_event_id}", max="+", count=page_size
+            )
+            for entry_id, fields in entries:
+                payload = loads(fields["data"])
+                payload["stream_id"] = entry_id
+                await self.send_to_socket(user_id, websocket, payload)
+            replayed += len(entries)
+            
+            if len(entries) < page_size:
+                break
+            last_event_id = entries[-1][0]
+            await outbox.wait_drained()
+        
+        if replayed:
+            print(f"⏪ Replayed {replayed} chat events to user {user_id}")
+        return replayed
+
+    def _wake_stream(self, user_id: UUID):
+        """A user's stream has new entries: have the reader fetch them"""
+        if user_id in self.active_connections:
+            self._stream_dirty.add(user_id)
+            self._stream_wakeup.set()
+
+    async def _stream_reader(self):
+        """Read the streams of local users that were woken up, plus a periodic sweep of all"""
+        loop = asyncio.get_running_loop()
+        next_sweep = loop.time() + CHAT_STREAM_SWEEP_INTERVAL
+        while True:
+            try:
+                await asyncio.wait_for(self._stream_wakeup.wait(), timeout=max(0, next_sweep - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            self._stream_wakeup.clear()
+            
+            if loop.time() >= next_sweep:
+                self._stream_dirty.update(self.active_connections)
+                next_sweep = loop.time() + CHAT_STREAM_SWEEP_INTERVAL
+            
+            while self._stream_dirty:
+                batch = []
+                while self._stream_dirty and len(batch) < CHAT_STREAM_READ_KEYS:
+                    user_id = self._stream_dirty.pop()
+                    if user_id in self.active_connections:
+                        batch.append(user_id)
+                if not batch:
+                    continue
+                
+                try:
+                    await self._read_streams(batch)
+                except asyncio.CancelledError:
+                    raise
+                except ResponseError as e:
+                    if "NOGROUP" in str(e):
+                        # A stream expired or was trimmed away: recreate the groups
+                        for user_id in batch:
+                            await self._ensure_stream_group(user_id)
+                    else:
+                        print(f"❌ Chat stream reader error: {e}")
+                        await self._retry_streams(batch)
+                        break
+                except Exception as e:
+                    print(f"❌ Chat stream reader error: {e}")
+                    await self._retry_streams(batch)
+                    break
+
+    async def _retry_streams(self, user_ids: List[UUID]):
+        """After a failed read, re-read these streams from their pending entries"""
+        self._stream_recover.update(user_ids)
+        self._stream_dirty.update(user_ids)
+        await asyncio.sleep(1)
+        self._stream_wakeup.set()
+
+    async def _read_streams(self, user_ids: List[UUID]):
+        """One XREADGROUP (no blocking) over a batch of user streams"""
+        response = await redis.xreadgroup(
+            self.worker_id,
+            self.worker_id,
+            {
+                # Pending entries ("0") of recovering streams, otherwise only new ones (">")
+                self._stream_key(user_id): "0" if user_id in self._stream_recover else ">"
+                for user_id in user_ids
+            },
+            count=CHAT_STREAM_READ_COUNT
+        )
+        
+        for key, entries in response or []:
+            user_id = UUID(key.split(":", 1)[1])
+            if len(entries) >= CHAT_STREAM_READ_COUNT:
+                # More may be waiting: read this stream again
+                self._stream_dirty.add(user_id)
+            elif user_id in self._stream_recover:
+                # Pending entries drained: continue with new ones
+                self._stream_recover.discard(user_id)
+                self._stream_dirty.add(user_id)
+            await self._deliver_stream_entries(key, entries)
+
+    async def _deliver_stream_entries(self, key: str, entries: list):
+        user_id = UUID(key.split(":", 1)[1])
+        delivered = []
+        for entry_id, fields in entries:
+            delivered.append(entry_id)
+            if not fields or user_id not in self.active_connections:
+                continue
+            try:
+                payload = loads(fields["data"])
+                payload["stream_id"] = entry_id
+                await self._deliver_chat_payload(user_id, payload)
+            except Exception as e:
+                print(f"❌ Error delivering stream entry {entry_id}: {e}")
+        
+        if delivered:
+            await redis.xack(key, self.worker_id, *delivered)
+
+    async def _subscribe_user(self, user_id: UUID):
+        """Start receiving a user's events on this worker (direct routing only)"""
+        if self.routing_mode == "direct":
+            await self.subscriber.subscribe(*self._user_channels(user_id))
 
-    async def _redis_listener(self):
-        """Listen to Redis pub/sub for chat events across workers"""
+    async def _unsubscribe_user(self, user_id: UUID):
+        """Stop receiving a user's events on this worker (direct routing only)"""
+        if self.routing_mode == "direct":
+            await self.subscriber.unsubscribe(*self._user_channels(user_id))
+            # User reconnected while we were unsubscribing
+            if user_id in self.active_connections:
+                await self.subscriber.subscribe(*self._user_channels(user_id))
+
+    def _conversation_channel(self, conversation_id: UUID) -> str:
+        return f"{CONVERSATION_CHANNEL_PREFIX}:{conversation_id}"
+
+    async def _refresh_conversation_subscription(self, conversation_id: UUID):
+        """Subscribe to / unsubscribe from a conversation channel to match local interest"""
+        wanted = (
+            conversation_id in self.conversation_connections
+            or bool(self.conversation_members.get(conversation_id))
+        )
+        if wanted == (conversation_id in self._subscribed_conversations):
+            return
+        
+        if wanted:
+            self._subscribed_conversations.add(conversation_id)
+            await self.subscriber.subscribe(self._conversation_channel(conversation_id))
+        else:
+            self._subscribed_conversations.discard(conversation_id)
+            await self.subscriber.unsubscribe(self._conversation_channel(conversation_id))
+
+    async def join_conversation(self, conversation_id: UUID, user_id: UUID, websocket: WebSocket):
+        """Register a socket as viewing a conversation (receives its conversation-scoped events)"""
+        self.conversation_connections.setdefault(conversation_id, {}).setdefault(user_id, set()).add(websocket)
+        await self._refresh_conversation_subscription(conversation_id)
+
+    async def leave_conversation(self, conversation_id: UUID, user_id: UUID, websocket: WebSocket):
+        """Unregister a conversation socket; clears the user's typing state when their last one closes"""
+        users = self.conversation_connections.get(conversation_id)
+        if not users or user_id not in users:
+            return
+        
+        users[user_id].discard(websocket)
+        if users[user_id]:
+            return
+        del users[user_id]
+        
+        await self.clear_typing(conversation_id, user_id)
+        
+        if not users:
+            del self.conversation_connections[conversation_id]
+            await self._refresh_conversation_subscription(conversation_id)
+
+    async def _track_member(self, conversation_id: UUID, user_id: UUID, is_member: bool):
+        """Add/remove a local user from a conversation's local participants (conversation delivery)"""
+        if is_member:
+            self.conversation_members.setdefault(conversation_id, set()).add(user_id)
+            self.user_conversations.setdefault(user_id, set()).add(conversation_id)
+        else:
+            members = self.conversation_members.get(conversation_id)
+            if members is not None:
+                members.discard(user_id)
+                if not members:
+                    del self.conversation_members[conversation_id]
+            conversations = self.user_conversations.get(user_id)
+            if conversations is not None:
+                conversations.discard(conversation_id)
+        await self._refresh_conversation_subscription(conversation_id)
+
+    async def _load_user_conversations(self, user_id: UUID):
+        """Start listening to every conversation of a newly connected user"""
+        from src.database import AsyncSessionLocal
+        from src.chat.services import get_user_conversation_ids
+        
+        async with AsyncSessionLocal() as db:
+            conversation_ids = await get_user_conversation_ids(user_id, db)
+        
+        # User may have disconnected while we were loading
+        if user_id not in self.active_connections:
+            return
+        for conversation_id in conversation_ids:
+            await self._track_member(conversation_id, user_id, True)
+
+    async def _forget_user_conversations(self, user_id: UUID):
+        """Stop listening on behalf of a user whose last local socket closed"""
+        for conversation_id in list(self.user_conversations.pop(user_id, ())):
+            await self._track_member(conversation_id, user_id, False)
+
+    async def _sync_membership(self, conversation_id: UUID, participant_ids: Optional[List[UUID]]):
+        """Apply a membership change to local users (conversation delivery)"""
+        if self.delivery_mode != "conversation" or participant_ids is None:
+            return
+        participants = set(participant_ids)
+        for user_id in list(self.active_connections):
+            is_member = user_id in participants
+            if is_member != (conversation_id in self.user_conversations.get(user_id, ())):
+                await self._track_member(conversation_id, user_id, is_member)
+
+    async def _handle_conversation_event(self, channel: str, data: str):
+        """
+        Fan a conversation-scoped event out to this worker: to sockets viewing the
+        conversation ("viewers") or to every local participant ("members")
+        """
+        conversation_id = UUID(channel.split(":", 1)[1])
         try:
-            pubsub = pubsub_redis.pubsub()
-            # Subscribe to multiple event types
-            await pubsub.psubscribe("chat:*")
-            await pubsub.psubscribe("status:*")  # Online/offline status
-            await pubsub.psubscribe("typing:*")  # Typing indicators
-            await pubsub.psubscribe("receipt:*")  # Delivery/read receipts
+            envelope = loads(data)
+            payload = envelope["payload"]
+            sender_id = envelope.get("sender_id")
             
-            print("🎧 Listening to Redis pub/sub for chat events...")
+            if envelope.get("scope") == "members":
+                recipients = list(self.conversation_members.get(conversation_id, ()))
+            else:
+                recipients = list(self.conversation_connections.get(conversation_id, {}))
             
-            async for message in pubsub.listen():
-                if message["type"] == "pmessage":
-                    channel = message["channel"]
-                    
-                    # Handle different event types
-                    if channel.startswith("chat:"):
-                        await self._handle_chat_message(channel, message["data"])
-                    elif channel.startswith("status:"):
-                        await self._handle_status_update(channel, message["data"])
-                    elif channel.startswith("typing:"):
-                        await self._handle_typing_indicator(channel, message["data"])
-                    elif channel.startswith("receipt:"):
-                        await self._handle_receipt(channel, message["data"])
-                        
-        except asyncio.CancelledError:
-            print("Chat listener task cancelled")
-            raise
+            # Encoded once for every local recipient
+            text = None
+            for user_id in recipients:
+                if str(user_id) != sender_id and user_id in self.active_connections:
+                    text = text or dumps(payload)
+                    await self._deliver_chat_payload(user_id, payload, text)
+        except Exception as e:
+            print(f"❌ Error handling conversation event: {e}")
+
+    async def _handle_control(self, data: str):
+        """Handle worker-wide control events"""
+        try:
+            payload = loads(data)
+            if payload.get("type") == "membership":
+                membership_cache.apply_change(payload)
+                participant_ids = payload.get("participant_ids")
+                await self._sync_membership(
+                    UUID(payload["conversation_id"]),
+                    [UUID(pid) for pid in participant_ids] if participant_ids is not None else None
+                )
         except Exception as e:
-            print(f"❌ Chat Redis listener error: {e}")
-            await asyncio.sleep(5)
-            await self._redis_listener()
+            print(f"❌ Error handling chat control event: {e}")
 
     async def _handle_chat_message(self, channel: str, data: str):
         """Handle incoming chat message"""
         user_id = UUID(channel.split(":", 1)[1])
         if user_id in self.active_connections:
             try:
-                payload = json.loads(data)
-                await self._send_to_local_connections(user_id, payload)
-                
-                # Auto-send delivery receipt
-                await self.send_delivery_receipt(
-                    message_id=UUID(payload["id"]),
-                    sender_id=UUID(payload["sender_id"]),
-                    receiver_id=user_id
-                )
-                print(f"📨 Delivered chat message to user {user_id}")
+                # Sockets get the published text as-is; it's only decoded for routing
+                await self._deliver_chat_payload(user_id, loads(data), data)
             except Exception as e:
                 print(f"❌ Error delivering chat message: {e}")
 
+    async def _deliver_chat_payload(self, user_id: UUID, payload: dict, text: Optional[str] = None):
+        """Write a chat payload to a user's local sockets; messages get an automatic delivery receipt"""
+        await self._send_to_local_connections(user_id, payload, text)
+        
+        if payload.get("type") == "message":
+            await self.send_delivery_receipt(
+                message_id=UUID(payload["id"]),
+                sender_id=UUID(payload["sender_id"]),
+                receiver_id=user_id
+            )
+            print(f"📨 Delivered chat message to user {user_id}")
+
     async def _handle_status_update(self, channel: str, data: str):
         """Handle online/offline status updates"""
         user_id = UUID(channel.split(":", 1)[1])
         if user_id in self.active_connections:
             try:
-                payload = json.loads(data)
+                payload = loads(data)
                 await self._send_to_local_connections(user_id, {
                     "type": "status_update",
                     "user_id": payload["user_id"],
@@ -105,7 +518,7 @@ class ConnectionManager:
         user_id = UUID(channel.split(":", 1)[1])
         if user_id in self.active_connections:
             try:
-                payload = json.loads(data)
+                payload = loads(data)
                 await self._send_to_local_connections(user_id, {
                     "type": "typing",
                     "user_id": payload["user_id"],
@@ -119,7 +532,7 @@ class ConnectionManager:
         user_id = UUID(channel.split(":", 1)[1])
         if user_id in self.active_connections:
             try:
-                payload = json.loads(data)
+                payload = loads(data)
                 await self._send_to_local_connections(user_id, {
                     "type": "receipt",
                     "message_id": payload["message_id"],
@@ -129,94 +542,234 @@ class ConnectionManager:
             except Exception as e:
                 print(f"❌ Error handling receipt: {e}")
 
-    async def connect(self, user_id: UUID, websocket: WebSocket):
-        """Connect a user's WebSocket"""
-        await websocket.accept()
+    async def connect(
+        self,
+        user_id: UUID,
+        websocket: WebSocket,
+        last_event_id: Optional[str] = None,
+        subprotocol: Optional[str] = None
+    ):
+        """
+        Connect a user's WebSocket (replaying missed chat events when using streams).
+        `subprotocol` is the negotiated wire protocol (see src/chat/wire.py).
+        """
+        await websocket.accept(subprotocol=subprotocol)
+        is_first_socket = user_id not in self.active_connections
         self.active_connections.setdefault(user_id, set()).add(websocket)
+        self._open_outbox(user_id, websocket, subprotocol)
         
-        # Mark user as online in Redis (expires in 1 hour, refreshed by heartbeat)
-        await redis.setex(f"chat_online:{user_id}", 3600, "1")
+        # First socket for this user on this worker: start listening to their channels
+        if is_first_socket:
+            await self._subscribe_user(user_id)
+            if self.transport == "streams":
+                await self._ensure_stream_group(user_id)
+                self._wake_stream(user_id)
+            if self.delivery_mode == "conversation":
+                await self._load_user_conversations(user_id)
         
-        # Update last_seen in database
-        from src.database import AsyncSessionLocal
-        from src.auth.models import Users
-        from sqlalchemy import select
-        async with AsyncSessionLocal() as db:
-            result = await db.execute(select(Users).where(Users.id == user_id))
-            user = result.scalar_one_or_none()
-            if user:
-                user.last_seen = datetime.utcnow()
-                db.add(user)
-                await db.commit()
+        if self.transport == "streams" and last_event_id:
+            await self.replay(user_id, websocket, last_event_id)
         
-        # Broadcast online status to all users who can chat with this user
-        await self._broadcast_status(user_id, "online")
+        # Mark user as online in Redis (counted once per worker; last_seen is
+        # flushed to Postgres in batches)
+        if is_first_socket:
+            came_online = await presence.connected(user_id)
+            
+            # Broadcast online status to all users who can chat with this user
+            if came_online:
+                await self._broadcast_status(user_id, "online")
         
         print(f"✅ User {user_id} connected to chat")
 
     async def disconnect(self, user_id: UUID, websocket: WebSocket):
         """Disconnect a user's WebSocket"""
+        outbox = self._outboxes.pop(websocket, None)
+        if outbox is not None:
+            await outbox.close()
+        
         if user_id in self.active_connections:
             self.active_connections[user_id].discard(websocket)
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
                 
-                # Remove online status
-                await redis.delete(f"chat_online:{user_id}")
+                # Last socket on this worker: stop listening to their channels
+                await self._unsubscribe_user(user_id)
+                await self._forget_user_conversations(user_id)
+                if self.transport == "streams":
+                    await self._drop_stream_group(user_id)
                 
-                # Update last_seen
-                from src.database import AsyncSessionLocal
-                from src.auth.models import Users
-                from sqlalchemy import select
-                async with AsyncSessionLocal() as db:
-                    result = await db.execute(select(Users).where(Users.id == user_id))
-                    user = result.scalar_one_or_none()
-                    if user:
-                        user.last_seen = datetime.utcnow()
-                        db.add(user)
-                        await db.commit()
+                # Remove online status once no worker holds a socket for them
+                went_offline = await presence.disconnected(user_id)
                 
                 # Broadcast offline status
-                await self._broadcast_status(user_id, "offline")
+                if went_offline:
+                    await self._broadcast_status(user_id, "offline")
                 
         print(f"🔌 User {user_id} disconnected from chat")
     
     async def _broadcast_status(self, user_id: UUID, status: str):
         """Broadcast online/offline status to users who can chat with this user"""
-        from src.database import AsyncSessionLocal
-        from src.chat.services import get_chatable_users
+        # One set read (Postgres only on a cache miss) + one pipelined publish
+        chatable_users = await chatable_cache.get(user_id)
+        if not chatable_users:
+            return
         
-        async with AsyncSessionLocal() as db:
-            chatable_users = await get_chatable_users(user_id, db)
-            
+        data = dumps({
+            "user_id": str(user_id),
+            "status": status,
+            "last_seen": datetime.now(timezone.utc).isoformat() if status == "offline" else None
+        })
+        async with redis.pipeline(transaction=False) as pipe:
             for other_user_id in chatable_users:
-                channel = f"status:{other_user_id}"
-                await redis.publish(channel, json.dumps({
-                    "user_id": str(user_id),
-                    "status": status,
-                    "last_seen": datetime.now(timezone.utc).isoformat() if status == "offline" else None
-                }))
+                pipe.publish(f"status:{other_user_id}", data)
+            await pipe.execute()
 
     async def is_online(self, user_id: UUID) -> bool:
         """Check if user is online (across all workers)"""
-        exists = await redis.exists(f"chat_online:{user_id}")
-        return bool(exists)
+        return await presence.is_online(user_id)
 
     async def send_message(self, user_id: UUID, payload: dict) -> bool:
-        """Send chat message to user via Redis pub/sub. Returns True if user is online."""
+        """Send chat message to user via Redis pub/sub (or their stream). Returns True if user is online."""
         # Check if user is online across all workers via Redis
         is_online = await self.is_online(user_id)
         
-        channel = f"chat:{user_id}"
-        await redis.publish(channel, json.dumps(payload))
-        print(f"📢 Published chat message to Redis channel: {channel} (user online: {is_online})")
+        async with redis.pipeline(transaction=False) as pipe:
+            self._queue_chat_event(pipe, user_id, dumps(payload))
+            await pipe.execute()
+        print(f"📢 Published chat message for user {user_id} via {self.transport} (user online: {is_online})")
         
         return is_online  # Return True if user is connected
 
+    async def send_many(self, user_ids: Iterable[UUID], payload: dict) -> Dict[UUID, bool]:
+        """
+        Send the same payload to many users in one pipelined round trip.
+        Returns {user_id: is_online} for every recipient.
+        """
+        recipients = list(dict.fromkeys(user_ids))
+        if not recipients:
+            return {}
+        
+        data = dumps(payload)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zmscore(PRESENCE_KEY, [str(recipient_id) for recipient_id in recipients])
+            for recipient_id in recipients:
+                self._queue_chat_event(pipe, recipient_id, data)
+            results = await pipe.execute()
+        
+        print(f"📢 Published chat payload to {len(recipients)} users in one batch")
+        return {recipient_id: is_fresh(score) for recipient_id, score in zip(recipients, results[0])}
+
+    async def send_to_conversation(
+        self,
+        conversation_id: UUID,
+        sender_id: UUID,
+        recipient_ids: Iterable[UUID],
+        payload: dict
+    ) -> Dict[UUID, bool]:
+        """
+        Send a payload to a conversation's participants (except the sender).
+        In conversation delivery mode it is published once to conv:{conversation_id};
+        otherwise this is send_many. Returns {user_id: is_online} like send_many.
+        """
+        recipients = [rid for rid in dict.fromkeys(recipient_ids) if rid != sender_id]
+        # Streams are per user, so durable delivery always goes through send_many
+        if self.delivery_mode != "conversation" or self.transport == "streams":
+            return await self.send_many(recipients, payload)
+        
+        envelope = dumps({"scope": "members", "sender_id": str(sender_id), "payload": payload})
+        async with redis.pipeline(transaction=False) as pipe:
+            if recipients:
+                pipe.zmscore(PRESENCE_KEY, [str(recipient_id) for recipient_id in recipients])
+            pipe.publish(self._conversation_channel(conversation_id), envelope)
+            results = await pipe.execute()
+        
+        print(f"📢 Published payload once to conversation {conversation_id} ({len(recipients)} recipients)")
+        if not recipients:
+            return {}
+        return {recipient_id: is_fresh(score) for recipient_id, score in zip(recipients, results[0])}
+
+    async def publish_batch(self, items: Iterable[Tuple[UUID, dict]]):
+        """Publish a different payload per user in one pipelined round trip (no presence lookup)"""
+        items: List[Tuple[UUID, dict]] = list(items)
+        if not items:
+            return
+        
+        async with redis.pipeline(transaction=False) as pipe:
+            for recipient_id, payload in items:
+                self._queue_chat_event(pipe, recipient_id, dumps(payload))
+            await pipe.execute()
+
+    async def set_typing(self, conversation_id: UUID, user_id: UUID, is_typing: bool):
+        """
+        Update a user's typing state from client frames (one per keystroke).
+        Only start/stop transitions and periodic refreshes are published, once per
+        conversation. A stop is held for TYPING_STOP_GRACE and dropped if typing
+        resumes; state expires on its own if the client goes quiet.
+        """
+        now = asyncio.get_running_loop().time()
+        states = self.typing_status.setdefault(conversation_id, {})
+        state = states.get(user_id)
+        
+        if not is_typing:
+            if state is None:
+                if not states:
+                    del self.typing_status[conversation_id]
+                return
+            # Published by the expiry sweeper unless typing resumes first
+            states[user_id] = (min(state[0], now + TYPING_STOP_GRACE), state[1])
+            return
+        
+        if state is not None and now - state[1] < TYPING_REFRESH_INTERVAL:
+            # Still typing (or resumed within the grace period) and recently
+            # announced: just extend the expiry
+            states[user_id] = (now + TYPING_TIMEOUT, state[1])
+            return
+        states[user_id] = (now + TYPING_TIMEOUT, now)
+        await self._publish_typing(conversation_id, user_id, True)
+
+    async def clear_typing(self, conversation_id: UUID, user_id: UUID):
+        """End a user's typing state now (message sent, socket gone, expired)"""
+        states = self.typing_status.get(conversation_id)
+        if not states or user_id not in states:
+            return
+        del states[user_id]
+        if not states:
+            del self.typing_status[conversation_id]
+        await self._publish_typing(conversation_id, user_id, False)
+
+    async def _publish_typing(self, conversation_id: UUID, user_id: UUID, is_typing: bool):
+        await redis.publish(self._conversation_channel(conversation_id), dumps({
+            "scope": "viewers",
+            "sender_id": str(user_id),
+            "payload": {
+                "type": "typing",
+                "conversation_id": str(conversation_id),
+                "user_id": str(user_id),
+                "is_typing": is_typing
+            }
+        }))
+
+    async def _expire_typing(self):
+        """Publish "stopped typing" once a state times out or a stop outlives its grace period"""
+        while True:
+            await asyncio.sleep(max(0.1, min(1.0, TYPING_STOP_GRACE / 2)))
+            now = asyncio.get_running_loop().time()
+            expired = [
+                (conversation_id, user_id)
+                for conversation_id, states in self.typing_status.items()
+                for user_id, (expires_at, _) in states.items()
+                if expires_at <= now
+            ]
+            for conversation_id, user_id in expired:
+                try:
+                    await self.clear_typing(conversation_id, user_id)
+                except Exception as e:
+                    print(f"❌ Error expiring typing state: {e}")
+
     async def send_typing_indicator(self, from_user_id: UUID, to_user_id: UUID, is_typing: bool):
         """Send typing indicator"""
         channel = f"typing:{to_user_id}"
-        await redis.publish(channel, json.dumps({
+        await redis.publish(channel, dumps({
             "user_id": str(from_user_id),
             "is_typing": is_typing
         }))
@@ -224,7 +777,7 @@ class ConnectionManager:
     async def send_delivery_receipt(self, message_id: UUID, sender_id: UUID, receiver_id: UUID):
         """Send delivery receipt back to sender"""
         channel = f"receipt:{sender_id}"
-        await redis.publish(channel, json.dumps({
+        await redis.publish(channel, dumps({
             "message_id": str(message_id),
             "receipt_type": "delivered",
             "timestamp": datetime.now(timezone.utc).isoformat()
@@ -233,29 +786,78 @@ class ConnectionManager:
     async def send_read_receipt(self, message_id: UUID, sender_id: UUID, receiver_id: UUID):
         """Send read receipt back to sender"""
         channel = f"receipt:{sender_id}"
-        await redis.publish(channel, json.dumps({
+        await redis.publish(channel, dumps({
             "message_id": str(message_id),
             "receipt_type": "read",
             "timestamp": datetime.now(timezone.utc).isoformat()
         }))
     
-    async def _send_to_local_connections(self, user_id: UUID, payload: dict):
-        """Send to WebSocket connections on this worker"""
-        disconnected = []
-        for ws in self.active_connections.get(user_id, []):
-            try:
-                await ws.send_json(payload)
-            except Exception as e:
-                print(f"Error sending to websocket: {e}")
-                disconnected.append(ws)
+    async def _send_to_local_connections(self, user_id: UUID, payload: dict, text: Optional[str] = None):
+        """
+        Queue a frame for every WebSocket connection of the user on this worker.
+        `text` is the payload already encoded as plain JSON (e.g. as received from
+        Redis); the payload is encoded at most once per wire protocol.
+        """
+        websockets = self.active_connections.get(user_id)
+        if not websockets:
+            return
+        frames = {}
+        ephemeral = is_ephemeral(payload)
+        for ws in list(websockets):
+            outbox = self._outboxes.get(ws)
+            protocol = outbox.protocol if outbox else None
+            if protocol not in frames:
+                if text is not None and protocol in (None, JSON_PROTOCOL):
+                    frames[protocol] = text
+                else:
+                    frames[protocol] = encode(payload, protocol)
+            await self.send_to_socket(user_id, ws, frames[protocol], ephemeral)
+
+    async def send_to_socket(self, user_id: UUID, websocket: WebSocket, frame, ephemeral: Optional[bool] = None):
+        """Queue a frame (dict, or already encoded for the socket's protocol) on its outbox"""
+        outbox = self._outboxes.get(websocket)
+        if outbox is None:
+            return
+        if not outbox.offer(frame, ephemeral):
+            await self._evict(user_id, websocket, "outbound queue full")
+
+    def _open_outbox(self, user_id: UUID, websocket: WebSocket, protocol: Optional[str] = None):
+        async def on_failure(outbox: SocketOutbox):
+            # Writer task failed to send: the socket is gone
+            asyncio.create_task(self.disconnect(user_id, websocket))
         
-        # Clean up disconnected sockets
-        for ws in disconnected:
-            await self.disconnect(user_id, ws)
+        outbox = SocketOutbox(websocket, on_failure, protocol)
+        self._outboxes[websocket] = outbox
+        outbox.start()
+
+    async def _evict(self, user_id: UUID, websocket: WebSocket, reason: str):
+        """Disconnect a client that can't keep up"""
+        print(f"🐢 Evicting slow WebSocket of user {user_id}: {reason}")
+        await self.disconnect(user_id, websocket)
+        try:
+            await websocket.close(code=1013)  # Try Again Later
+        except Exception:
+            pass
+
+    def socket_metrics(self) -> dict:
+        """Backpressure metrics for every local socket, deepest queues first"""
+        sockets = []
+        for user_id, websockets in self.active_connections.items():
+            for ws in websockets:
+                outbox = self._outboxes.get(ws)
+                if outbox is not None:
+                    sockets.append({"user_id": str(user_id), **outbox.metrics()})
+        sockets.sort(key=lambda m: m["depth"], reverse=True)
+        return {
+            "sockets": len(sockets),
+            "queued": sum(m["depth"] for m in sockets),
+            "dropped": sum(m["dropped"] for m in sockets),
+            "slowest": sockets[:20]
+        }
 
     async def heartbeat(self, user_id: UUID):
         """Refresh online status (called periodically from client)"""
-        await redis.expire(f"chat_online:{user_id}", 3600)
+        await presence.heartbeat(user_id)
 
     async def send_to_user(self, user_id: UUID, payload: dict):
         """Legacy method - use send_message instead"""
@@ -0,0 +1,219 @@
+from os import getenv
+from uuid import UUID
+from typing import Iterable, List, Optional
+import json
+
+from src.redis import redis
+
+# Snapshots are rebuilt from Postgres after this long even without invalidation
+INBOX_TTL = int(getenv("CHAT_INBOX_TTL", "3600"))
+
+# Always-present field so an empty inbox is still a cache hit
+_SENTINEL_FIELD = "_"
+
+# Read/patch/write rounds for entries changed concurrently, before invalidating
+PATCH_ATTEMPTS = 3
+
+# Replaces a field only if it still holds the value the patch was computed from;
+# a snapshot dropped (or expired) in the meantime is not recreated
+_COMPARE_AND_SET_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+return 1
+"""
+
+# Writes the rebuilt snapshot only if no patch or invalidation touched the user since
+# the rebuild started (their generation is unchanged); otherwise the data read from
+# Postgres may predate a write that had no snapshot to land in
+_STORE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def _key(user_id: UUID) -> str:
+    return f"inbox:{user_id}"
+
+
+def _generation_key(user_id: UUID) -> str:
+    return f"inbox:{user_id}:gen"
+
+
+def _bump(pipe, user_ids: Iterable[UUID]):
+    """Queue a generation bump per user so in-flight rebuilds for them are discarded"""
+    for user_id in user_ids:
+        pipe.incr(_generation_key(user_id))
+        pipe.expire(_generation_key(user_id), INBOX_TTL)
+
+
+class InboxCache:
+    """
+    Per-user inbox snapshot in Redis: a hash of conversation_id -> serialized
+    ConversationResponse (already resolved for that user). Writes patch entries in
+    place; anything that can't be patched drops the snapshot so the next read
+    rebuilds it from Postgres.
+    """
+
+    def __init__(self):
+        self._compare_and_set = redis.register_script(_COMPARE_AND_SET_SCRIPT)
+        self._store = redis.register_script(_STORE_SCRIPT)
+
+    async def get(self, user_id: UUID) -> Optional[List[dict]]:
+        """Cached inbox, newest conversation first. None on a cache miss."""
+        entries = await redis.hgetall(_key(user_id))
+        if not entries:
+            return None
+
+        conversations = [
+            json.loads(value) for field, value in entries.items() if field != _SENTINEL_FIELD
+        ]
+        conversations.sort(key=lambda conv: conv["last_message_at"] or "", reverse=True)
+        return conversations
+
+    async def generation(self, user_id: UUID) -> str:
+        """Read before rebuilding from Postgres and hand to store()"""
+        return await redis.get(_generation_key(user_id)) or "0"
+
+    async def store(self, user_id: UUID, conversations: Iterable, generation: str) -> bool:
+        """
+        Replace the snapshot with freshly built ConversationResponse objects.
+        Skipped (returns False) if the user was patched or invalidated since
+        `generation` was read: the next read rebuilds again.
+        """
+        args = [generation, INBOX_TTL, _SENTINEL_FIELD, "1"]
+        for conv in conversations:
+            args += [str(conv.id), conv.model_dump_json()]
+
+        return bool(await self._store(keys=[_key(user_id), _generation_key(user_id)], args=args))
+
+    async def invalidate(self, user_ids: Iterable[UUID]):
+        """Drop snapshots (membership changes, new conversations, ...)"""
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.delete(*[_key(user_id) for user_id in user_ids])
+            _bump(pipe, user_ids)
+            await pipe.execute()
+
+    async def _patch(self, conversation_id: UUID, user_ids: List[UUID], patch):
+        """
+        Read the conversation's entry from every user's snapshot in one round trip,
+        apply `patch(user_id, entry)` and write the results back in another.
+        Each write only lands if the entry is unchanged since it was read (and the
+        snapshot still exists); users that lost the race are re-read and patched
+        again, and invalidated after PATCH_ATTEMPTS. Users with a snapshot that
+        lacks this conversation are invalidated.
+        Every user's generation is bumped first, so a snapshot being rebuilt from
+        Postgres concurrently (possibly without this write) is not stored.
+        """
+        field = str(conversation_id)
+        pending = list(user_ids)
+
+        for attempt in range(PATCH_ATTEMPTS):
+            if not pending:
+                return
+
+            async with redis.pipeline(transaction=False) as pipe:
+                if attempt == 0:
+                    _bump(pipe, pending)
+                for user_id in pending:
+                    pipe.hget(_key(user_id), field)
+                    pipe.exists(_key(user_id))
+                results = await pipe.execute()
+            if attempt == 0:
+                results = results[2 * len(pending):]
+
+            # User id per queued compare-and-set, None per DELETE
+            writes: List[Optional[UUID]] = []
+            async with redis.pipeline(transaction=False) as pipe:
+                for i, user_id in enumerate(pending):
+                    raw, has_snapshot = results[2 * i], results[2 * i + 1]
+                    if raw is not None:
+                        entry = json.loads(raw)
+                        patch(user_id, entry)
+                        await self._compare_and_set(
+                            keys=[_key(user_id)], args=[field, raw, json.dumps(entry)], client=pipe
+                        )
+                        writes.append(user_id)
+                    elif has_snapshot:
+                        pipe.delete(_key(user_id))
+                        writes.append(None)
+                written = await pipe.execute()
+
+            pending = [user_id for user_id, ok in zip(writes, written) if user_id is not None and not ok]
+
+        if pending:
+            await self.invalidate(pending)
+
+    async def apply_message(self, conversation_id: UUID, participant_ids: List[UUID], message: dict):
+        """A new message: becomes last_message and bumps everyone else's unread count"""
+        sender_id = message["sender_id"]
+
+        def patch(user_id: UUID, entry: dict):
+            is_own = str(user_id) == sender_id
+            # A newer message may already have been patched in (ISO timestamps sort as text)
+            if (entry.get("last_message_at") or "") <= message["sent_at"]:
+                entry["last_message"] = {
+                    **message,
+                    "is_read": is_own or str(user_id) in message["read_by"],
+                    "is_delivered": is_own or str(user_id) in message["delivered_to"],
+                }
+                entry["last_message_id"] = message["id"]
+                entry["last_message_at"] = message["sent_at"]
+
+            unread_counts = entry.get("unread_counts") or {}
+            for pid in participant_ids:
+                if str(pid) != sender_id:
+                    unread_counts[str(pid)] = unread_counts.get(str(pid), 0) + 1
+            entry["unread_counts"] = unread_counts
+            entry["unread_count"] = unread_counts.get(str(user_id), 0)
+
+        await self._patch(conversation_id, list(participant_ids), patch)
+
+    async def apply_receipt(
+        self,
+        conversation_id: UUID,
+        participant_ids: List[UUID],
+        user_id: UUID,
+        read: bool,
+        message_id: Optional[UUID] = None
+    ):
+        """
+        `user_id` received (or read) messages up to `message_id` (None = everything).
+        Reading the whole conversation also clears their unread count.
+        """
+        reader = str(user_id)
+
+        def patch(viewer_id: UUID, entry: dict):
+            last = entry.get("last_message")
+            if last and last["sender_id"] != reader and (message_id is None or last["id"] == str(message_id)):
+                if reader not in last["delivered_to"]:
+                    last["delivered_to"].append(reader)
+                if read and reader not in last["read_by"]:
+                    last["read_by"].append(reader)
+                if viewer_id == user_id:
+                    last["is_delivered"] = True
+                    last["is_read"] = last["is_read"] or read
+
+            if read and message_id is None:
+                unread_counts = entry.get("unread_counts") or {}
+                unread_counts[reader] = 0
+                entry["unread_counts"] = unread_counts
+                if viewer_id == user_id:
+                    entry["unread_count"] = 0
+
+        await self._patch(conversation_id, list(participant_ids), patch)
+
+
+inbox_cache = InboxCache()
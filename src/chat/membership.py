@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from os import getenv
+from uuid import UUID
+from typing import List, Optional, Tuple
+import json
+import time
+
+from sqlalchemy import select
+from src.redis import redis
+
+MEMBERSHIP_CACHE_TTL = float(getenv("CHAT_MEMBERSHIP_CACHE_TTL", "300"))
+MEMBERSHIP_CACHE_SIZE = int(getenv("CHAT_MEMBERSHIP_CACHE_SIZE", "10000"))
+
+
+class ConversationMembershipCache:
+    """
+    Per-worker TTL/LRU cache of conversation participant ids.
+    Membership changes are pushed to every worker over the chat control channel.
+    """
+
+    def __init__(self, ttl: float = MEMBERSHIP_CACHE_TTL, max_size: int = MEMBERSHIP_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # {conversation_id: (expires_at, participant_ids)}
+        self._entries: "OrderedDict[UUID, Tuple[float, List[UUID]]]" = OrderedDict()
+
+    def peek(self, conversation_id: UUID) -> Optional[List[UUID]]:
+        """Return cached participants without touching the database"""
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+
+        expires_at, participant_ids = entry
+        if expires_at < time.monotonic():
+            del self._entries[conversation_id]
+            return None
+
+        self._entries.move_to_end(conversation_id)
+        return participant_ids
+
+    def put(self, conversation_id: UUID, participant_ids: List[UUID]):
+        """Cache participants for a conversation, evicting the least recently used entry"""
+        self._entries[conversation_id] = (time.monotonic() + self.ttl, list(participant_ids))
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, conversation_id: UUID):
+        """Drop a conversation from this worker's cache"""
+        self._entries.pop(conversation_id, None)
+
+    async def get(self, conversation_id: UUID) -> Optional[List[UUID]]:
+        """Return participants, loading from Postgres on a miss. None if the conversation doesn't exist."""
+        participant_ids = self.peek(conversation_id)
+        if participant_ids is not None:
+            return participant_ids
+
+        from src.database import AsyncSessionLocal
+        from src.chat.models import Conversation
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Conversation.participant_ids).where(Conversation.id == conversation_id)
+            )
+            participant_ids = result.scalar_one_or_none()
+
+        if participant_ids is None:
+            return None
+
+        self.put(conversation_id, participant_ids)
+        return participant_ids
+
+    async def publish_change(self, conversation_id: UUID, participant_ids: List[UUID]):
+        """Update this worker and tell every other worker that membership changed"""
+        from src.chat.connection import CHAT_CONTROL_CHANNEL
+
+        self.put(conversation_id, participant_ids)
+        await redis.publish(CHAT_CONTROL_CHANNEL, json.dumps({
+            "type": "membership",
+            "conversation_id": str(conversation_id),
+            "participant_ids": [str(pid) for pid in participant_ids]
+        }))
+
+    def apply_change(self, payload: dict):
+        """Apply a membership change received from another worker"""
+        conversation_id = UUID(payload["conversation_id"])
+        participant_ids = payload.get("participant_ids")
+        if participant_ids is None:
+            self.discard(conversation_id)
+        else:
+            self.put(conversation_id, [UUID(pid) for pid in participant_ids])
+
+
+membership_cache = ConversationMembershipCache()
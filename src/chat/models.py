@@ -1,7 +1,7 @@
 from typing import Optional, TYPE_CHECKING, List
 from datetime import datetime
 from sqlmodel import SQLModel, Field, Relationship, Column, ForeignKey
-from sqlalchemy import ARRAY, Text
+from sqlalchemy import ARRAY, Text, Index
 from sqlalchemy.dialects.postgresql import UUID as PostgresUUID, JSONB
 from uuid import UUID, uuid4
 from sqlalchemy.orm import Mapped
@@ -14,6 +14,10 @@ if TYPE_CHECKING:
 # Conversation Model for Group Chat Support
 class Conversation(SQLModel, table=True):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Inbox lookup: participant_ids @> ARRAY[user_id]
+        Index("ix_conversations_participant_ids_gin", "participant_ids", postgresql_using="gin"),
+    )
     
     id: Optional[UUID] = Field(default_factory=uuid4, primary_key=True, index=True)
     type: str = Field(default="DIRECT")  # DIRECT or GROUP
@@ -66,8 +70,32 @@ class Conversation(SQLModel, table=True):
     )
 
 
+# Per-member delivery/read state. A member has received (read) every message in the
+# conversation up to and including the (sent_at, id) watermark.
+class ConversationMember(SQLModel, table=True):
+    __tablename__ = "conversation_member"
+    
+    conversation_id: UUID = Field(
+        sa_column=Column(ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True)
+    )
+    user_id: UUID = Field(
+        sa_column=Column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True)
+    )
+    
+    last_delivered_message_id: Optional[UUID] = Field(default=None)
+    last_delivered_at: Optional[datetime] = Field(default=None)
+    last_read_message_id: Optional[UUID] = Field(default=None)
+    last_read_at: Optional[datetime] = Field(default=None)
+    
+    joined_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 class Message(SQLModel, table=True):
     __tablename__ = "message"
+    __table_args__ = (
+        # Keyset pagination of conversation history: WHERE conversation_id = ? AND (sent_at, id) < (?, ?)
+        Index("ix_message_conversation_sent_at_id", "conversation_id", "sent_at", "id"),
+    )
 
     id: Optional[UUID] = Field(default_factory=uuid4, primary_key=True)
     
@@ -104,7 +132,8 @@ class Message(SQLModel, table=True):
     content: str
     type: str = Field(default="TEXT")  # TEXT, IMAGE, or SYSTEM
     
-    # Arrays for read receipts (for group chats)
+    # Legacy read receipt arrays, no longer written: receipts are derived from
+    # ConversationMember watermarks
     read_by: List[UUID] = Field(
         default_factory=list,
         sa_column=Column(ARRAY(PostgresUUID(as_uuid=True)), nullable=False, server_default='{}')
@@ -147,4 +176,5 @@ from src.auth.models import Users
 from src.event.models import EventApplication
 
 Conversation.update_forward_refs()
+ConversationMember.update_forward_refs()
 Message.update_forward_refs()
\ No newline at end of file
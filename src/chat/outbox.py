@@ -0,0 +1,159 @@
+from collections import deque
+from os import getenv
+from typing import Awaitable, Callable, Deque, Optional, Tuple, Union
+import asyncio
+import time
+
+from fastapi import WebSocket
+from src.chat.wire import encode
+
+# Frames buffered per socket before the overflow policy kicks in
+CHAT_OUTBOX_SIZE = int(getenv("CHAT_OUTBOX_SIZE", "256"))
+
+# "drop_ephemeral": shed typing/presence frames first, disconnect only when the queue
+#                   is full of frames that must not be lost
+# "disconnect":     disconnect as soon as the queue is full
+CHAT_OUTBOX_OVERFLOW = getenv("CHAT_OUTBOX_OVERFLOW", "drop_ephemeral")
+
+# Frames that are safe to lose: the next one supersedes them
+EPHEMERAL_TYPES = {"typing", "status_update"}
+
+Frame = Union[dict, str, bytes]
+
+
+def is_ephemeral(payload: dict) -> bool:
+    return payload.get("type") in EPHEMERAL_TYPES
+
+
+class SocketOutbox:
+    """
+    Bounded outbound queue and writer task for one WebSocket, so a slow client
+    only ever delays itself. Frames are dicts (encoded on send for the socket's
+    wire protocol) or frames already encoded for it, which are written as-is.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        on_failure: Callable[["SocketOutbox"], Awaitable[None]],
+        protocol: Optional[str] = None,
+        max_size: int = CHAT_OUTBOX_SIZE,
+        overflow_policy: str = CHAT_OUTBOX_OVERFLOW
+    ):
+        self.websocket = websocket
+        self.protocol = protocol
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self._on_failure = on_failure
+        # (frame, is_ephemeral)
+        self._frames: Deque[Tuple[Frame, bool]] = deque()
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        # Backpressure metrics
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.last_send_seconds = 0.0
+        self.max_send_seconds = 0.0
+        self.created_at = time.time()
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    async def close(self):
+        """Stop the writer; unsent frames are discarded"""
+        self.closed = True
+        self._frames.clear()
+        self._drained.set()
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def offer(self, frame: Frame, ephemeral: Optional[bool] = None) -> bool:
+        """
+        Queue a frame without waiting. Returns False when the socket can't keep up
+        and should be disconnected. Text frames are only shed when `ephemeral` is set.
+        """
+        if self.closed:
+            return True
+
+        if ephemeral is None:
+            ephemeral = isinstance(frame, dict) and is_ephemeral(frame)
+
+        if len(self._frames) >= self.max_size:
+            if self.overflow_policy != "drop_ephemeral":
+                return False
+            if ephemeral:
+                self.dropped += 1
+                return True
+            if not self._drop_oldest_ephemeral():
+                return False
+
+        self._frames.append((frame, ephemeral))
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self._frames))
+        self._wakeup.set()
+        return True
+
+    async def wait_drained(self):
+        """Wait until every queued frame has been written (or the outbox is closed)"""
+        while self._frames and not self.closed:
+            self._drained.clear()
+            await self._drained.wait()
+
+    def _drop_oldest_ephemeral(self) -> bool:
+        for index, (_, ephemeral) in enumerate(self._frames):
+            if ephemeral:
+                del self._frames[index]
+                self.dropped += 1
+                return True
+        return False
+
+    async def _writer(self):
+        while not self.closed:
+            if not self._frames:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            frame, _ = self._frames.popleft()
+            started = time.monotonic()
+            try:
+                if isinstance(frame, dict):
+                    frame = encode(frame, self.protocol)
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+            except Exception as e:
+                print(f"Error sending to websocket: {e}")
+                self.closed = True
+                self._drained.set()
+                await self._on_failure(self)
+                return
+
+            self.sent += 1
+            self.last_send_seconds = time.monotonic() - started
+            self.max_send_seconds = max(self.max_send_seconds, self.last_send_seconds)
+            if not self._frames:
+                self._drained.set()
+
+    def metrics(self) -> dict:
+        return {
+            "protocol": self.protocol,
+            "depth": len(self._frames),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "last_send_seconds": round(self.last_send_seconds, 4),
+            "max_send_seconds": round(self.max_send_seconds, 4),
+            "age_seconds": round(time.time() - self.created_at, 1)
+        }
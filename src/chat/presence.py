@@ -0,0 +1,166 @@
+from os import getenv
+from uuid import UUID
+from typing import Dict, Optional
+from datetime import datetime
+import asyncio
+import time
+
+from src.redis import redis
+
+# Sorted set of user_id -> last heartbeat (unix seconds), and hash of user_id -> open sockets (all workers)
+PRESENCE_KEY = "chat_presence"
+PRESENCE_CONNECTIONS_KEY = "chat_presence_connections"
+
+# A user without a heartbeat for this long counts as offline
+PRESENCE_TIMEOUT = float(getenv("CHAT_PRESENCE_TIMEOUT", "3600"))
+
+# How often buffered last_seen values are written to Postgres
+LAST_SEEN_FLUSH_INTERVAL = float(getenv("CHAT_LAST_SEEN_FLUSH_INTERVAL", "30"))
+
+# Returns the previous heartbeat (nil if the user was not present)
+_CONNECT_SCRIPT = """
+local previous = redis.call('ZSCORE', KEYS[2], ARGV[1])
+redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+return previous
+"""
+
+# Returns the sockets the user still has open; presence is removed at zero
+_DISCONNECT_SCRIPT = """
+local remaining = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if remaining <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    redis.call('ZREM', KEYS[2], ARGV[1])
+end
+return remaining
+"""
+
+# Drops users whose heartbeat expired (e.g. their worker died without disconnecting them)
+_PRUNE_SCRIPT = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, 1000)
+for _, user_id in ipairs(stale) do
+    redis.call('HDEL', KEYS[1], user_id)
+end
+if #stale > 0 then
+    redis.call('ZREM', KEYS[2], unpack(stale))
+end
+return #stale
+"""
+
+
+def is_fresh(score: Optional[float], now: Optional[float] = None) -> bool:
+    """Whether a heartbeat score from the presence set still counts as online"""
+    if score is None:
+        return False
+    return float(score) >= (now or time.time()) - PRESENCE_TIMEOUT
+
+
+class PresenceService:
+    """
+    Cross-worker presence backed by Redis, with last_seen buffered in memory
+    and written to Postgres in periodic batches.
+    """
+
+    def __init__(self):
+        self._connect = redis.register_script(_CONNECT_SCRIPT)
+        self._disconnect = redis.register_script(_DISCONNECT_SCRIPT)
+        self._prune = redis.register_script(_PRUNE_SCRIPT)
+
+        # {user_id: last_seen} waiting to be flushed
+        self._last_seen: Dict[UUID, datetime] = {}
+        self._flush_task = None
+
+    async def start(self):
+        """Start the periodic last_seen flush when app starts"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            print("✅ Presence flush task started")
+
+    async def stop(self):
+        """Stop the flush task and write whatever is still buffered"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush_last_seen()
+        print("🛑 Presence flush task stopped")
+
+    async def connected(self, user_id: UUID) -> bool:
+        """Register a new socket. Returns True if the user just came online."""
+        self.touch(user_id)
+        previous = await self._connect(
+            keys=[PRESENCE_CONNECTIONS_KEY, PRESENCE_KEY],
+            args=[str(user_id), time.time()]
+        )
+        return not is_fresh(previous)
+
+    async def disconnected(self, user_id: UUID) -> bool:
+        """Unregister a socket. Returns True if the user has no sockets left on any worker."""
+        self.touch(user_id)
+        remaining = await self._disconnect(
+            keys=[PRESENCE_CONNECTIONS_KEY, PRESENCE_KEY],
+            args=[str(user_id)]
+        )
+        return int(remaining) <= 0
+
+    async def heartbeat(self, user_id: UUID):
+        """Refresh the user's heartbeat"""
+        await redis.zadd(PRESENCE_KEY, {str(user_id): time.time()})
+
+    async def is_online(self, user_id: UUID) -> bool:
+        """Check if user is online (across all workers)"""
+        return is_fresh(await redis.zscore(PRESENCE_KEY, str(user_id)))
+
+    def touch(self, user_id: UUID):
+        """Record activity; written to users.last_seen on the next flush"""
+        self._last_seen[user_id] = datetime.utcnow()
+
+    async def flush_last_seen(self):
+        """Write buffered last_seen values with a single batched UPDATE"""
+        if not self._last_seen:
+            return
+
+        pending, self._last_seen = self._last_seen, {}
+
+        from src.database import AsyncSessionLocal
+        from src.auth.models import Users
+        from sqlalchemy import update, bindparam
+
+        table = Users.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("b_user_id"))
+            .values(last_seen=bindparam("b_last_seen"))
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(stmt, [
+                    {"b_user_id": user_id, "b_last_seen": last_seen}
+                    for user_id, last_seen in pending.items()
+                ])
+                await db.commit()
+        except Exception as e:
+            # Keep the values (unless newer ones arrived) for the next attempt
+            for user_id, last_seen in pending.items():
+                self._last_seen.setdefault(user_id, last_seen)
+            print(f"❌ Failed to flush last_seen for {len(pending)} users: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(LAST_SEEN_FLUSH_INTERVAL)
+            await self.flush_last_seen()
+            try:
+                pruned = await self._prune(
+                    keys=[PRESENCE_CONNECTIONS_KEY, PRESENCE_KEY],
+                    args=[time.time() - PRESENCE_TIMEOUT]
+                )
+                if pruned:
+                    print(f"🧹 Pruned {pruned} stale presence entries")
+            except Exception as e:
+                print(f"❌ Presence prune failed: {e}")
+
+
+presence = PresenceService()
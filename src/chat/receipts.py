@@ -0,0 +1,148 @@
+from os import getenv
+from uuid import UUID
+from typing import Dict, List, Set
+import asyncio
+
+from src.chat.models import Message
+from src.chat.connection import manager
+from src.chat.membership import membership_cache
+from src.chat.inbox import inbox_cache
+
+# How long to collect requests before writing, and the most users per write
+RECEIPT_FLUSH_INTERVAL = float(getenv("CHAT_RECEIPT_FLUSH_INTERVAL", "0.05"))
+RECEIPT_BATCH_SIZE = int(getenv("CHAT_RECEIPT_BATCH_SIZE", "200"))
+
+
+def delivery_receipts_by_sender(messages: List[Message], delivered_to_user_id: UUID) -> List[tuple]:
+    """
+    Group delivered messages into one receipt per (sender, conversation).
+    `message_id` carries the latest message for clients that read a single id.
+    """
+    grouped: Dict[tuple, List[Message]] = {}
+    for msg in messages:
+        grouped.setdefault((msg.sender_id, msg.conversation_id), []).append(msg)
+
+    receipts = []
+    for (sender_id, conv_id), msgs in grouped.items():
+        receipts.append((sender_id, {
+            "type": "delivery_receipt",
+            "message_id": str(msgs[-1].id),
+            "message_ids": [str(m.id) for m in msgs],
+            "delivered_to_user_id": str(delivered_to_user_id),
+            "conversation_id": str(conv_id)
+        }))
+    return receipts
+
+
+async def sync_inbox_deliveries(messages: List[Message], delivered_to_user_id: UUID):
+    """Patch inbox snapshots after `delivered_to_user_id` received `messages`"""
+    from src.chat.services import latest_per_conversation
+
+    for conv_id, latest in latest_per_conversation(messages).items():
+        participant_ids = await membership_cache.get(conv_id)
+        if participant_ids:
+            await inbox_cache.apply_receipt(
+                conv_id, participant_ids, delivered_to_user_id, read=False, message_id=latest.id
+            )
+
+
+class DeliveryReceiptWorker:
+    """
+    Background delivery acknowledgement. Request handlers enqueue user ids; the
+    worker coalesces repeats, advances delivered watermarks for a whole batch of
+    users in one transaction and publishes one receipt per (sender, conversation).
+    """
+
+    def __init__(self):
+        self._queue: "asyncio.Queue[UUID]" = asyncio.Queue()
+        self._queued: Set[UUID] = set()
+        # Callers waiting for their user's batch to be written
+        self._waiters: Dict[UUID, List[asyncio.Future]] = {}
+        self._task = None
+
+    async def start(self):
+        """Start the worker when app starts"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            print("✅ Delivery receipt worker started")
+
+    async def stop(self):
+        """Stop the worker when app shuts down"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            print("🛑 Delivery receipt worker stopped")
+
+    def enqueue(self, user_id: UUID):
+        """Acknowledge the user's pending messages soon (fire and forget)"""
+        if user_id not in self._queued:
+            self._queued.add(user_id)
+            self._queue.put_nowait(user_id)
+
+    async def acknowledge(self, user_id: UUID) -> int:
+        """Enqueue the user and wait for the write; returns how many messages were delivered"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_id, []).append(future)
+        self.enqueue(user_id)
+        return await future
+
+    async def _run(self):
+        while True:
+            user_ids = [await self._queue.get()]
+
+            # Let concurrent requests pile up, then take a batch
+            await asyncio.sleep(RECEIPT_FLUSH_INTERVAL)
+            while len(user_ids) < RECEIPT_BATCH_SIZE and not self._queue.empty():
+                user_ids.append(self._queue.get_nowait())
+            self._queued.difference_update(user_ids)
+
+            try:
+                delivered = await self._flush(user_ids)
+            except Exception as e:
+                print(f"❌ Delivery receipt batch failed for {len(user_ids)} users: {e}")
+                delivered = None
+
+            for user_id in user_ids:
+                for future in self._waiters.pop(user_id, []):
+                    if future.done():
+                        continue
+                    if delivered is None:
+                        future.set_exception(RuntimeError("Delivery acknowledgement failed"))
+                    else:
+                        future.set_result(len(delivered.get(user_id, [])))
+
+    async def _flush(self, user_ids: List[UUID]) -> Dict[UUID, List[Message]]:
+        from src.database import AsyncSessionLocal
+        from src.chat.services import mark_messages_delivered_bulk
+
+        async with AsyncSessionLocal() as db:
+            delivered = await mark_messages_delivered_bulk(user_ids, db)
+
+        if not delivered:
+            return {}
+
+        # The watermarks are committed: from here on failures are logged, not
+        # reported to waiters, who would otherwise retry an acknowledgement that succeeded
+        receipts = []
+        for user_id, messages in delivered.items():
+            receipts.extend(delivery_receipts_by_sender(messages, user_id))
+        try:
+            await manager.publish_batch(receipts)
+        except Exception as e:
+            print(f"❌ Failed to publish {len(receipts)} delivery receipts: {e}")
+
+        for user_id, messages in delivered.items():
+            try:
+                await sync_inbox_deliveries(messages, user_id)
+            except Exception as e:
+                print(f"❌ Failed to sync inbox deliveries for user {user_id}: {e}")
+
+        print(f"✅ Marked {sum(len(m) for m in delivered.values())} messages as delivered for {len(delivered)} users")
+        return delivered
+
+
+receipt_worker = DeliveryReceiptWorker()
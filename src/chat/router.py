@@ -2,32 +2,80 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
 from src.auth.models import Users
 from src.chat.connection import manager
+from src.chat.membership import membership_cache
+from src.chat.inbox import inbox_cache
+from src.chat.receipts import receipt_worker
+from src.chat.chatable import chatable_cache
+from src.chat import wire
 from src.auth.dependencies import get_current_user,get_current_user_ws
 from src.database import get_session, AsyncSessionLocal
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.chat.services import (
-    get_chatable_users, create_message, get_undeliverd_messages,
+    create_message, get_undeliverd_messages,
     get_or_create_direct_conversation, create_group_conversation,
     get_user_conversations, get_conversation_messages,
     create_message_in_conversation, mark_conversation_as_read,
-    add_participants_to_conversation, remove_participant_from_conversation
+    add_participants_to_conversation, remove_participant_from_conversation,
+    encode_message_cursor, get_conversation_members, receipt_arrays,
+    advance_watermarks
 )
 from src.chat.schema import (
     DirectConversationCreate, GroupConversationCreate, ConversationResponse,
-    MessageCreate, MessageResponse, AddParticipantsRequest, ParticipantInfo
+    MessageCreate, MessageResponse, MessagePageResponse, AddParticipantsRequest, ParticipantInfo
 )
 from uuid import UUID
 from src.database import get_session as get_db
-from typing import List
-from sqlalchemy import select, and_, not_, func, any_, update
-from src.chat.models import Conversation, Message
-import json
+from typing import Dict, List, Optional
+from sqlalchemy import select
+from src.chat.models import Conversation, ConversationMember, Message
+import os
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
+# History replayed on WebSocket connect, and how many messages go in each frame
+CHAT_HISTORY_LIMIT = int(os.getenv("CHAT_HISTORY_LIMIT", "50"))
+CHAT_HISTORY_CHUNK_SIZE = max(1, int(os.getenv("CHAT_HISTORY_CHUNK_SIZE", "50")))
+
 
 # ==================== HELPER FUNCTION ====================
 
+def message_frame(msg: Message, members: List[ConversationMember]) -> dict:
+    """WebSocket representation of a stored message (receipts from member watermarks)"""
+    delivered_to, read_by = receipt_arrays(msg, members)
+    return {
+        "type": "message",
+        "id": str(msg.id),
+        "conversation_id": str(msg.conversation_id),
+        "sender_id": str(msg.sender_id),
+        "content": msg.content,
+        "sent_at": msg.sent_at.isoformat(),
+        "message_type": msg.type,
+        "read_by": [str(uid) for uid in read_by],
+        "delivered_to": [str(uid) for uid in delivered_to]
+    }
+
+
+def message_response(msg: Message, members: List[ConversationMember], viewer_id: UUID) -> MessageResponse:
+    """MessageResponse with receipts derived from member watermarks"""
+    delivered_to, read_by = receipt_arrays(msg, members)
+    is_own = msg.sender_id == viewer_id
+    return MessageResponse(
+        id=msg.id,
+        conversation_id=msg.conversation_id,
+        sender_id=msg.sender_id,
+        receiver_id=msg.receiver_id,
+        content=msg.content,
+        type=msg.type,
+        sent_at=msg.sent_at,
+        edited_at=msg.edited_at,
+        deleted_at=msg.deleted_at,
+        read_by=read_by,
+        delivered_to=delivered_to,
+        is_read=True if is_own else viewer_id in read_by,
+        is_delivered=True if is_own else viewer_id in delivered_to
+    )
+
+
 async def build_conversation_response(
     conv: Conversation,
     current_user_id: UUID,
@@ -51,6 +99,8 @@ async def build_conversation_response(
         )
         last_msg = msg_result.scalar_one_or_none()
     
+    members = (await get_conversation_members([conv.id], db))[conv.id] if last_msg else []
+    
     # Resolve conversation name dynamically for DIRECT chats
     display_name = conv.name
     display_avatar = conv.avatar_url
@@ -109,7 +159,7 @@ async def build_conversation_response(
         'participants': [
             ParticipantInfo.model_validate(p).model_dump() for p in participants
         ],
-        'last_message': MessageResponse.model_validate(last_msg).model_dump() if last_msg else None,
+        'last_message': message_response(last_msg, members, current_user_id).model_dump() if last_msg else None,
         'unread_count': conv.unread_counts.get(str(current_user_id), 0)
     }
     return ConversationResponse(**conv_dict)
@@ -125,7 +175,7 @@ async def create_direct_conversation(
 ):
     """Create or get existing direct conversation"""
     # Verify users can chat
-    chatable_users = await get_chatable_users(current_user.id, db)
+    chatable_users = await chatable_cache.get(current_user.id, db)
     if data.other_user_id not in chatable_users:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -149,7 +199,7 @@ async def create_group_chat(
 ):
     """Create a group conversation"""
     # Verify all participants are chatable
-    chatable_users = await get_chatable_users(current_user.id, db)
+    chatable_users = await chatable_cache.get(current_user.id, db)
     for participant_id in data.participant_ids:
         if participant_id not in chatable_users and participant_id != current_user.id:
             raise HTTPException(
@@ -174,10 +224,19 @@ async def list_conversations(
     current_user: Users = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get all conversations - OPTIMIZED to prevent duplicate queries"""
+    """Get all conversations - served from the Redis inbox snapshot when present"""
+    cached = await inbox_cache.get(current_user.id)
+    if cached is not None:
+        receipt_worker.enqueue(current_user.id)
+        return cached
+    
+    # Writes landing during the rebuild make store() skip the (possibly stale) snapshot
+    generation = await inbox_cache.generation(current_user.id)
     conversations = await get_user_conversations(current_user.id, db)
     
     if not conversations:
+        await inbox_cache.store(current_user.id, [], generation)
+        receipt_worker.enqueue(current_user.id)
         return []
     
     # ============ BATCH FETCH ALL PARTICIPANTS (Single Query) ============
@@ -196,26 +255,13 @@ async def list_conversations(
         messages_result = await db.execute(
             select(Message).where(Message.id.in_(last_message_ids))
         )
-        # Force load all fields immediately to prevent lazy loading
-        all_messages = {}
-        for msg in messages_result.scalars().all():
-            # Access all fields to force load them
-            all_messages[msg.id] = {
-                'id': msg.id,
-                'conversation_id': msg.conversation_id,
-                'sender_id': msg.sender_id,
-                'receiver_id': msg.receiver_id,
-                'content': msg.content,
-                'type': msg.type,
-                'sent_at': msg.sent_at,
-                'edited_at': msg.edited_at,
-                'deleted_at': msg.deleted_at,
-                'read_by': msg.read_by or [],
-                'delivered_to': msg.delivered_to or []
-            }
+        all_messages = {msg.id: msg for msg in messages_result.scalars().all()}
     else:
         all_messages = {}
     
+    # Receipt watermarks for every conversation (Single Query)
+    all_members = await get_conversation_members([conv.id for conv in conversations], db)
+    
     # ============ BATCH FETCH PROFILE NAMES (Optimized) ============
     brand_user_ids = [p.id for p in all_participants.values() if p.role == "brand"]
     influencer_user_ids = [p.id for p in all_participants.values() if p.role == "influencer"]
@@ -238,49 +284,14 @@ async def list_conversations(
         for user_id, name in influencer_result.all():
             profile_names[user_id] = name
     
-    # ============ MARK UNDELIVERED MESSAGES (Single Update Query) ============
-    undelivered_result = await db.execute(
-        select(Message)
-        .join(Conversation, Message.conversation_id == Conversation.id)
-        .where(
-            and_(
-                current_user.id == any_(Conversation.participant_ids),
-                Message.sender_id != current_user.id,
-                not_(current_user.id == any_(Message.delivered_to))
-            )
-        )
-    )
-    undelivered_messages = undelivered_result.scalars().all()
-    
-    if undelivered_messages:
-        undelivered_ids = [msg.id for msg in undelivered_messages]
-        await db.execute(
-            update(Message)
-            .where(Message.id.in_(undelivered_ids))
-            .values(delivered_to=func.array_append(Message.delivered_to, current_user.id))
-        )
-        await db.commit()
-        
-        # Send delivery receipts
-        for msg in undelivered_messages:
-            delivery_payload = {
-                "type": "delivery_receipt",
-                "message_id": str(msg.id),
-                "delivered_to_user_id": str(current_user.id),
-                "conversation_id": str(msg.conversation_id)
-            }
-            await manager.send_message(msg.sender_id, delivery_payload)
-        
-        print(f"✅ Marked {len(undelivered_messages)} messages as delivered")
-    
     # ============ BUILD RESPONSES (No More DB Queries) ============
     enriched = []
     for conv in conversations:
         # Get participants from cache
         conv_participants = [all_participants[pid] for pid in conv.participant_ids if pid in all_participants]
         
-        # Get last message from cache (now it's a dict, not a model)
-        last_msg_dict = all_messages.get(conv.last_message_id) if conv.last_message_id else None
+        # Get last message from cache
+        last_msg = all_messages.get(conv.last_message_id) if conv.last_message_id else None
         
         # Resolve display name
         display_name = conv.name
@@ -306,24 +317,17 @@ async def list_conversations(
             created_at=conv.created_at,
             updated_at=conv.updated_at,
             participants=[ParticipantInfo.model_validate(p) for p in conv_participants],
-            last_message=MessageResponse(
-                id=last_msg_dict['id'],
-                conversation_id=last_msg_dict['conversation_id'],
-                sender_id=last_msg_dict['sender_id'],
-                receiver_id=last_msg_dict['receiver_id'],
-                content=last_msg_dict['content'],
-                type=last_msg_dict['type'],
-                sent_at=last_msg_dict['sent_at'],
-                edited_at=last_msg_dict['edited_at'],
-                deleted_at=last_msg_dict['deleted_at'],
-                read_by=last_msg_dict['read_by'],
-                delivered_to=last_msg_dict['delivered_to'],
-                is_read=current_user.id in last_msg_dict['read_by'] if last_msg_dict['sender_id'] != current_user.id else True,
-                is_delivered=current_user.id in last_msg_dict['delivered_to'] if last_msg_dict['sender_id'] != current_user.id else True
-            ) if last_msg_dict else None,
+            last_message=message_response(
+                last_msg, all_members.get(conv.id, []), current_user.id
+            ) if last_msg else None,
             unread_count=conv.unread_counts.get(str(current_user.id), 0)
         ))
     
+    await inbox_cache.store(current_user.id, enriched, generation)
+    
+    # Delivery marking is a write; keep it off the read path
+    receipt_worker.enqueue(current_user.id)
+    
     return enriched
 
 
@@ -336,62 +340,40 @@ async def mark_all_messages_delivered(
     Mark all undelivered messages as delivered when user comes online/logs in.
     This endpoint should be called immediately after successful login.
     """
-    # Find all undelivered messages for this user across ALL conversations
-    undelivered_result = await db.execute(
-        select(Message)
-        .join(Conversation, Message.conversation_id == Conversation.id)
-        .where(
-            and_(
-                current_user.id == any_(Conversation.participant_ids),  # User is participant
-                Message.sender_id != current_user.id,  # Not sent by user
-                not_(current_user.id == any_(Message.delivered_to))  # Not yet delivered
-            )
-        )
-    )
-    undelivered_messages = undelivered_result.scalars().all()
+    # Handled by the receipt worker, batched with other users' logins
+    try:
+        count = await receipt_worker.acknowledge(current_user.id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     
-    if not undelivered_messages:
+    if not count:
         return {
             "message": "No undelivered messages",
             "count": 0
         }
     
-    # Batch update all messages as delivered
-    undelivered_ids = [msg.id for msg in undelivered_messages]
-    await db.execute(
-        update(Message)
-        .where(Message.id.in_(undelivered_ids))
-        .values(delivered_to=func.array_append(Message.delivered_to, current_user.id))
-    )
-    await db.commit()
-    
-    # Send delivery receipts to all senders via WebSocket
-    for msg in undelivered_messages:
-        delivery_payload = {
-            "type": "delivery_receipt",
-            "message_id": str(msg.id),
-            "delivered_to_user_id": str(current_user.id),
-            "conversation_id": str(msg.conversation_id)
-        }
-        await manager.send_message(msg.sender_id, delivery_payload)
-    
-    print(f"✅ Marked {len(undelivered_messages)} messages as delivered for {current_user.username} on login")
+    print(f"✅ Marked {count} messages as delivered for {current_user.username} on login")
     
     return {
         "message": "Messages marked as delivered",
-        "count": len(undelivered_messages)
+        "count": count
     }
 
 
-@router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
+@router.get("/conversations/{conversation_id}/messages", response_model=MessagePageResponse)
 async def get_messages(
     conversation_id: UUID,
     limit: int = 50,
-    offset: int = 0,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
     current_user: Users = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get messages from a conversation"""
+    """
+    Get messages from a conversation using cursor pagination.
+    Omit both cursors for the latest page; pass `next_cursor` back as `before`
+    to scroll to older messages, or as `after` when paging forward.
+    """
     from src.chat.models import Conversation
     from sqlalchemy import select
     
@@ -407,8 +389,27 @@ async def get_messages(
     if current_user.id not in conversation.participant_ids:
         raise HTTPException(status_code=403, detail="Not a participant")
     
-    messages = await get_conversation_messages(conversation_id, db, limit, offset)
-    return messages
+    limit = max(1, min(limit, 100))
+    try:
+        messages, has_more = await get_conversation_messages(
+            conversation_id, db, limit=limit, before=before, after=after
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    members = (await get_conversation_members([conversation_id], db))[conversation_id]
+    
+    # Older pages only continue while more exist; forward paging always returns the
+    # newest cursor so the client can poll for new messages
+    next_cursor = None
+    if messages and (after or has_more):
+        next_cursor = encode_message_cursor(messages[-1] if after else messages[0])
+    
+    return MessagePageResponse(
+        messages=[message_response(m, members, current_user.id) for m in messages],
+        next_cursor=next_cursor,
+        has_more=has_more
+    )
 
 
 @router.post("/conversations/{conversation_id}/messages", response_model=MessageResponse)
@@ -428,60 +429,34 @@ async def send_message_to_conversation(
             db=db
         )
         
-        # Broadcast to all participants via WebSocket
-        from src.chat.models import Conversation
-        from sqlalchemy import select
+        # Broadcast to all participants via WebSocket (membership primed by the insert)
+        participant_ids = await membership_cache.get(conversation_id)
         
-        result = await db.execute(
-            select(Conversation).where(Conversation.id == conversation_id)
-        )
-        conversation = result.scalar_one_or_none()
-        
-        if conversation:
-            payload = {
-                "type": "message",
-                "id": str(message.id),
-                "conversation_id": str(conversation_id),
-                "sender_id": str(message.sender_id),
-                "content": message.content,
-                "sent_at": message.sent_at.isoformat(),
-                "message_type": message.type,
-                "read_by": [str(uid) for uid in message.read_by],
-                "delivered_to": [str(uid) for uid in message.delivered_to]
-            }
+        if participant_ids:
+            # A fresh message has only been read by its sender
+            payload = message_frame(message, [])
             
             print(f"📤 Broadcasting message {message.id} to conversation {conversation_id}")
             
-            # Send to all participants except sender
-            for participant_id in conversation.participant_ids:
-                if participant_id != current_user.id:
-                    await manager.send_message(participant_id, payload)
-                    print(f"📨 Sent to participant {participant_id}")
+            # Send to all participants except sender (one publish per recipient or per conversation)
+            await manager.send_to_conversation(conversation_id, current_user.id, participant_ids, payload)
+        
+        response = message_response(message, [], current_user.id)
+        if participant_ids:
+            await inbox_cache.apply_message(conversation_id, participant_ids, response.model_dump(mode="json"))
         
-        return message
+        return response
         
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-# ==================== WEBSOCKET ENDPOINT====================
+# ==================== WEBSOCKET SUB-HANDLERS ====================
+# Shared by the per-conversation socket and the multiplexed per-user socket.
+# Conversation handlers take (user, websocket, conversation_id, participant_ids, data).
 
-@router.websocket("/ws/conversation/{conversation_id}")
-async def conversation_websocket(
-    websocket: WebSocket,
-    conversation_id: UUID,
-):
-    """
-    WebSocket endpoint for real-time chat in a conversation.
-    
-    This handles:
-    - Step 3: Authenticate → Verify participant → Connect → Send history
-    - Step 4: Receive messages → Save → Broadcast → Echo
-    """
-    
-    print(f"🔗 WebSocket connection attempt to conversation {conversation_id}")
-    
-    # ============ STEP 3.1: AUTHENTICATE ============
+async def authenticate_websocket(websocket: WebSocket) -> Optional[Users]:
+    """Authenticate a WebSocket (cookie, then ?token=); closes it with 1008 on failure"""
     async with AsyncSessionLocal() as db:
         try:
             # Try cookie authentication first
@@ -497,369 +472,492 @@ async def conversation_websocket(
             if not user:
                 print("❌ Authentication failed")
                 await websocket.close(code=1008)  # Policy Violation
-                return
+                return None
             
             print(f"✅ User authenticated: {user.username} ({user.id})")
-            
+            return user
+        
         except Exception as e:
             print(f"❌ Authentication error: {e}")
             await websocket.close(code=1008)
-            return
-    
-    # ============ STEP 3.2: VERIFY PARTICIPANT ============
+            return None
+
+
+async def send_history(user: Users, websocket: WebSocket, conversation_id: UUID):
+    """Send the latest page of a conversation in chunked history frames"""
     async with AsyncSessionLocal() as db:
-        from src.chat.models import Conversation
-        from sqlalchemy import select
-        
-        result = await db.execute(
-            select(Conversation).where(Conversation.id == conversation_id)
-        )
-        conversation = result.scalar_one_or_none()
+        # Get latest page of messages (keyset pagination)
+        messages, has_more = await get_conversation_messages(conversation_id, db, limit=CHAT_HISTORY_LIMIT)
         
-        if not conversation:
-            print(f"❌ Conversation {conversation_id} not found")
-            await websocket.close(code=1003)  # Unsupported Data
-            return
+        print(f"📤 Sending {len(messages)} historical messages to {user.username}")
         
-        if user.id not in conversation.participant_ids:
-            print(f"❌ User {user.id} is not a participant in conversation {conversation_id}")
-            await websocket.close(code=1003)
-            return
+        # Pending deliveries were already acknowledged on connect via the member watermark
+        members = (await get_conversation_members([conversation_id], db))[conversation_id]
         
-        print(f"✅ User {user.username} is a participant in conversation {conversation_id}")
+        # Each chunk is encoded once (for the socket's wire protocol) and sent as a single frame
+        next_cursor = encode_message_cursor(messages[0]) if messages and has_more else None
+        chunks = [
+            messages[i:i + CHAT_HISTORY_CHUNK_SIZE]
+            for i in range(0, len(messages), CHAT_HISTORY_CHUNK_SIZE)
+        ] or [[]]
+        for index, chunk in enumerate(chunks):
+            is_final = index == len(chunks) - 1
+            await manager.send_to_socket(user.id, websocket, {
+                "type": "history",
+                "conversation_id": str(conversation_id),
+                "messages": [message_frame(msg, members) for msg in chunk],
+                "final": is_final,
+                # Cursor for loading older messages over REST (before=<next_cursor>)
+                "next_cursor": next_cursor if is_final else None,
+                "has_more": has_more if is_final else True
+            })
     
-    # ============ STEP 3.3: CONNECT ============
-    await manager.connect(user.id, websocket)
-    print(f"✅ WebSocket connected: {user.username} → conversation {conversation_id}")
+    print(f"✅ History sent to {user.username}")
+
+
+async def handle_ws_message(
+    user: Users, websocket: WebSocket, conversation_id: UUID, participant_ids: List[UUID], data: dict
+):
+    """Save a new message, fan it out and echo it to the sender"""
+    # ============ STEP 4.1: EXTRACT CONTENT ============
+    content = data.get("content")
+    if not content:
+        print("⚠️ Empty content, skipping")
+        return
     
-    # ============ STEP 3.3.5: MARK ALL PENDING MESSAGES AS DELIVERED ============
-    async with AsyncSessionLocal() as db_delivery:
-        # Get all undelivered messages for this user across ALL conversations
-        undelivered_result = await db_delivery.execute(
-            select(Message)
-            .join(Conversation, Message.conversation_id == Conversation.id)
-            .where(
-                and_(
-                    user.id == any_(Conversation.participant_ids),  # User is participant
-                    Message.sender_id != user.id,  # Not sent by user
-                    not_(user.id == any_(Message.delivered_to))  # Not yet delivered to user
-                )
-            )
+    msg_type = data.get("message_type", "TEXT")
+    
+    # ============ STEP 4.2: SAVE TO DATABASE ============
+    async with AsyncSessionLocal() as db:
+        new_msg = await create_message_in_conversation(
+            conversation_id=conversation_id,
+            sender_id=user.id,
+            content=content,
+            message_type=msg_type,
+            db=db
         )
-        undelivered_messages = undelivered_result.scalars().all()
         
-        if undelivered_messages:
-            print(f"📬 Found {len(undelivered_messages)} undelivered messages for {user.username}")
+        print(f"✅ Message saved to DB: {new_msg.id}")
+        
+        # ============ STEP 4.3: GET PARTICIPANTS ============
+        participant_ids = await membership_cache.get(conversation_id) or participant_ids
+        
+        # ============ STEP 4.4: PREPARE INITIAL PAYLOAD ============
+        # Note: read_by and delivered_to will be updated as we broadcast
+        payload = message_frame(new_msg, [])
+        
+        # ============ STEP 4.5: BROADCAST TO PARTICIPANTS ============
+        if participant_ids:
+            recipients = [pid for pid in participant_ids if pid != user.id]
+            print(f"📢 Broadcasting message to {len(recipients)} participants in conversation {conversation_id}")
             
-            # Batch update all messages
-            undelivered_ids = [msg.id for msg in undelivered_messages]
-            await db_delivery.execute(
-                update(Message)
-                .where(Message.id.in_(undelivered_ids))
-                .values(delivered_to=func.array_append(Message.delivered_to, user.id))
+            # One pipelined batch for presence lookups + publish(es)
+            online_status = await manager.send_to_conversation(
+                conversation_id, user.id, recipients, payload
             )
-            await db_delivery.commit()
+            online_ids = [pid for pid, online in online_status.items() if online]
             
-            # Send delivery receipts to senders
-            for msg in undelivered_messages:
-                delivery_payload = {
-                    "type": "delivery_receipt",
-                    "message_id": str(msg.id),
-                    "delivered_to_user_id": str(user.id),
-                    "conversation_id": str(msg.conversation_id)
-                }
-                await manager.send_message(msg.sender_id, delivery_payload)
+            if online_ids:
+                # Mark as delivered AND read immediately for every online participant
+                async with AsyncSessionLocal() as db2:
+                    await advance_watermarks(
+                        db2,
+                        [(conversation_id, pid, new_msg) for pid in online_ids],
+                        read=True
+                    )
+                    await db2.commit()
+                
+                # Update payload arrays for echo to sender
+                payload["delivered_to"] = [str(uid) for uid in online_ids]
+                payload["read_by"] = [str(user.id)] + [str(uid) for uid in online_ids]
+                
+                # Delivery + read receipts to sender in one batch
+                receipts = []
+                for participant_id in online_ids:
+                    receipts.append((user.id, {
+                        "type": "delivery_receipt",
+                        "message_id": str(new_msg.id),
+                        "delivered_to_user_id": str(participant_id),
+                        "conversation_id": str(conversation_id)
+                    }))
+                    receipts.append((user.id, {
+                        "type": "read_receipt",
+                        "message_id": str(new_msg.id),
+                        "user_id": str(participant_id),
+                        "conversation_id": str(conversation_id)
+                    }))
+                await manager.publish_batch(receipts)
+                print(f"✅ Message delivered AND read by {len(online_ids)} online participants")
             
-            print(f"✅ Marked {len(undelivered_messages)} messages as delivered on reconnect")
+            # Patch every participant's inbox snapshot with the final receipts
+            inbox_message = message_response(new_msg, [], user.id).model_dump(mode="json")
+            inbox_message["delivered_to"] = payload["delivered_to"]
+            inbox_message["read_by"] = payload["read_by"]
+            await inbox_cache.apply_message(conversation_id, participant_ids, inbox_message)
+        
+        # ============ STEP 4.6: ECHO TO SENDER ============
+        await manager.send_to_socket(user.id, websocket, payload)
+        print(f"✅ Echo sent to sender {user.username}")
+        
+        # Sending a message ends the typing indicator
+        await manager.clear_typing(conversation_id, user.id)
+
+
+async def handle_ws_typing(
+    user: Users, websocket: WebSocket, conversation_id: UUID, participant_ids: List[UUID], data: dict
+):
+    """Typing indicator (not saved, no DB access)"""
+    # Debounced per (user, conversation); only transitions reach the
+    # conversation channel, and the state expires if the client goes quiet
+    await manager.set_typing(conversation_id, user.id, bool(data.get("is_typing", False)))
+
+
+async def handle_ws_delivered(
+    user: Users, websocket: WebSocket, conversation_id: UUID, participant_ids: List[UUID], data: dict
+):
+    """Mark a message as delivered and notify its sender"""
+    message_id = data.get("message_id")
+    if not message_id:
+        return
     
-    try:
-        # ============ STEP 3.4: SEND HISTORY ============
-        async with AsyncSessionLocal() as db:
-            # Get last 50 messages
-            messages = await get_conversation_messages(conversation_id, db, limit=50)
+    async with AsyncSessionLocal() as db:
+        msg_uuid = UUID(message_id)
+        
+        # sender_id/sent_at are needed for the watermark and the receipt
+        result = await db.execute(
+            select(Message).where(
+                Message.id == msg_uuid,
+                Message.conversation_id == conversation_id
+            )
+        )
+        msg = result.scalar_one_or_none()
+        
+        if msg and msg.sender_id != user.id:
+            # Advance the delivered watermark (never moves backwards)
+            await advance_watermarks(db, [(conversation_id, user.id, msg)])
+            await db.commit()
             
-            print(f"📤 Sending {len(messages)} historical messages to {user.username}")
+            print(f"✅ Message {message_id} marked as delivered by {user.username}")
             
-            # Track undelivered messages
-            undelivered_message_ids = []
+            delivery_payload = {
+                "type": "delivery_receipt",
+                "message_id": str(message_id),
+                "delivered_to_user_id": str(user.id),
+                "conversation_id": str(conversation_id)
+            }
             
-            for msg in messages:
-                # Mark as delivered if not already delivered to this user
-                if user.id != msg.sender_id and user.id not in msg.delivered_to:
-                    undelivered_message_ids.append(msg.id)
-                
-                await websocket.send_json({
-                    "type": "message",
-                    "id": str(msg.id),
-                    "conversation_id": str(msg.conversation_id),
-                    "sender_id": str(msg.sender_id),
-                    "content": msg.content,
-                    "sent_at": msg.sent_at.isoformat(),
-                    "message_type": msg.type,
-                    "read_by": [str(uid) for uid in msg.read_by],
-                    "delivered_to": [str(uid) for uid in msg.delivered_to]
-                })
+            await manager.send_message(msg.sender_id, delivery_payload)
+            print(f"📢 Delivery receipt sent to sender {msg.sender_id}")
             
-            # Batch update delivered_to for all undelivered messages
-            if undelivered_message_ids:
-                await db.execute(
-                    update(Message)
-                    .where(Message.id.in_(undelivered_message_ids))
-                    .values(delivered_to=func.array_append(Message.delivered_to, user.id))
+            await inbox_cache.apply_receipt(
+                conversation_id, participant_ids, user.id, read=False, message_id=msg.id
+            )
+
+
+async def handle_ws_read(
+    user: Users, websocket: WebSocket, conversation_id: UUID, participant_ids: List[UUID], data: dict
+):
+    """Mark specific messages (or the whole conversation) as read and broadcast a read receipt"""
+    message_ids = data.get("message_ids", [])  # Optional: specific message IDs
+    read_up_to = None
+    
+    async with AsyncSessionLocal() as db:
+        if message_ids:
+            # Mark specific messages as read
+            msg_uuids = [UUID(mid) for mid in message_ids]
+            
+            # Reading the newest of them moves the read watermark past all of them
+            result = await db.execute(
+                select(Message)
+                .where(
+                    Message.id.in_(msg_uuids),
+                    Message.conversation_id == conversation_id,
+                    Message.sender_id != user.id
                 )
+                .order_by(Message.sent_at.desc(), Message.id.desc())
+                .limit(1)
+            )
+            newest = result.scalar_one_or_none()
+            if newest:
+                await advance_watermarks(db, [(conversation_id, user.id, newest)], read=True)
                 await db.commit()
-                
-                print(f"✅ Marked {len(undelivered_message_ids)} messages as delivered to {user.username}")
-                
-                # Send delivery receipts to senders
-                for msg_id in undelivered_message_ids:
-                    msg_result = await db.execute(
-                        select(Message).where(Message.id == msg_id)
-                    )
-                    msg = msg_result.scalar_one_or_none()
-                    if msg and msg.sender_id != user.id:
-                        delivery_payload = {
-                            "type": "delivery_receipt",
-                            "message_id": str(msg_id),
-                            "delivered_to_user_id": str(user.id),
-                            "conversation_id": str(conversation_id)
-                        }
-                        await manager.send_message(msg.sender_id, delivery_payload)
-        
-        print(f"✅ History sent to {user.username}")
+                read_up_to = newest.id
+            
+            print(f"✅ Marked {len(message_ids)} specific messages as read by {user.username}")
+        else:
+            # Mark entire conversation as read (existing behavior)
+            await mark_conversation_as_read(
+                conversation_id=conversation_id,
+                user_id=user.id,
+                db=db
+            )
+            
+            print(f"✅ Entire conversation marked as read by {user.username}")
+    
+    # Broadcast read receipt
+    participant_ids = await membership_cache.get(conversation_id) or participant_ids
+    
+    read_payload = {
+        "type": "read_receipt",
+        "conversation_id": str(conversation_id),
+        "user_id": str(user.id)
+    }
+    
+    await manager.send_to_conversation(conversation_id, user.id, participant_ids, read_payload)
+    
+    if read_up_to or not message_ids:
+        await inbox_cache.apply_receipt(
+            conversation_id, participant_ids, user.id, read=True, message_id=read_up_to
+        )
+    
+    print(f"📢 Read receipt broadcast from {user.username}")
+
+
+# Client message type -> conversation sub-handler
+CONVERSATION_HANDLERS = {
+    "message": handle_ws_message,
+    "typing": handle_ws_typing,
+    "delivered": handle_ws_delivered,
+    "read": handle_ws_read,
+}
+
+
+async def current_participants(message_type: str, conversation_id: UUID, known: List[UUID]) -> List[UUID]:
+    """
+    Participants to use for a client frame. Typing frames only peek at the
+    membership cache and fall back to the list the socket already has, so they
+    never touch Postgres; frames that persist something use the loaded list.
+    """
+    if message_type == "typing":
+        return membership_cache.peek(conversation_id) or known
+    return await membership_cache.get(conversation_id) or known
+
+
+# ==================== WEBSOCKET ENDPOINTS ====================
+
+@router.websocket("/ws/conversation/{conversation_id}")
+async def conversation_websocket(
+    websocket: WebSocket,
+    conversation_id: UUID,
+    last_event_id: Optional[str] = None,
+):
+    """
+    WebSocket endpoint for real-time chat in a conversation.
+    
+    This handles:
+    - Step 3: Authenticate → Verify participant → Connect → Send history
+    - Step 4: Receive messages → Route to the conversation sub-handlers
+    
+    With CHAT_TRANSPORT=streams, pass the last received `stream_id` as
+    `last_event_id` when reconnecting to receive the chat events missed meanwhile.
+    
+    Clients on slow networks can request a compact wire protocol through
+    Sec-WebSocket-Protocol: "collab.compact.v1" (short keys, receipt counts
+    instead of arrays) or "collab.msgpack.v1" (the same as MessagePack).
+    
+    Clients with several open chats should prefer the multiplexed /chat/ws socket.
+    """
+    
+    print(f"🔗 WebSocket connection attempt to conversation {conversation_id}")
+    
+    # ============ STEP 3.1: AUTHENTICATE ============
+    user = await authenticate_websocket(websocket)
+    if not user:
+        return
+    
+    # ============ STEP 3.2: VERIFY PARTICIPANT ============
+    # Membership comes from the per-worker cache (loaded from Postgres on a miss)
+    participant_ids = await membership_cache.get(conversation_id)
+    
+    if participant_ids is None:
+        print(f"❌ Conversation {conversation_id} not found")
+        await websocket.close(code=1003)  # Unsupported Data
+        return
+    
+    if user.id not in participant_ids:
+        print(f"❌ User {user.id} is not a participant in conversation {conversation_id}")
+        await websocket.close(code=1003)
+        return
+    
+    print(f"✅ User {user.username} is a participant in conversation {conversation_id}")
+    
+    # ============ STEP 3.3: CONNECT ============
+    await manager.connect(
+        user.id, websocket, last_event_id=last_event_id, subprotocol=wire.negotiate(websocket)
+    )
+    await manager.join_conversation(conversation_id, user.id, websocket)
+    print(f"✅ WebSocket connected: {user.username} → conversation {conversation_id}")
+    
+    # ============ STEP 3.3.5: MARK ALL PENDING MESSAGES AS DELIVERED ============
+    # Advances the delivered watermark across ALL of the user's conversations in the background
+    receipt_worker.enqueue(user.id)
+    
+    try:
+        # ============ STEP 3.4: SEND HISTORY ============
+        await send_history(user, websocket, conversation_id)
         
         # ============ STEP 3.5: ENTER MESSAGE LOOP ============
         while True:
             # Wait for incoming message from client
-            data = await websocket.receive_json()
+            data = await wire.receive(websocket)
             message_type = data.get("type", "message")
             
             print(f"📨 Received {message_type} from {user.username}: {data}")
             
             # ============ STEP 4: HANDLE MESSAGE TYPES ============
+            if message_type == "heartbeat":
+                # ============ KEEP ALIVE ============
+                await manager.heartbeat(user.id)
+                continue
             
-            if message_type == "message":
-                # ============ STEP 4.1: EXTRACT CONTENT ============
-                content = data.get("content")
-                if not content:
-                    print("⚠️ Empty content, skipping")
-                    continue
-                
-                msg_type = data.get("message_type", "TEXT")
+            handler = CONVERSATION_HANDLERS.get(message_type)
+            if handler:
+                participant_ids = await current_participants(message_type, conversation_id, participant_ids)
+                await handler(user, websocket, conversation_id, participant_ids, data)
+    
+    except WebSocketDisconnect:
+        print(f"🔌 User {user.username} disconnected from conversation {conversation_id}")
+    
+    except Exception as e:
+        print(f"❌ WebSocket error for user {user.username}: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    finally:
+        # ============ CLEANUP ============
+        await manager.leave_conversation(conversation_id, user.id, websocket)
+        await manager.disconnect(user.id, websocket)
+        print(f"🧹 Cleaned up connection for {user.username}")
+
+
+@router.websocket("/ws")
+async def chat_websocket(
+    websocket: WebSocket,
+    last_event_id: Optional[str] = None,
+):
+    """
+    Multiplexed WebSocket: one socket per user for all of their open conversations.
+    
+    Client messages:
+    - {"type": "subscribe", "conversation_id": ..., "history": true}
+      → "subscribed" followed by the conversation's history frames
+    - {"type": "unsubscribe", "conversation_id": ...} → "unsubscribed"
+    - "message" / "typing" / "delivered" / "read" with a "conversation_id" of a
+      subscribed conversation, same fields as on /ws/conversation/{id}
+    - {"type": "heartbeat"}
+    
+    Problems with a single request are answered with an "error" frame instead
+    of closing the socket. Every server frame carries its conversation_id.
+    Supports the same last_event_id replay and wire protocols as the
+    per-conversation socket.
+    """
+    user = await authenticate_websocket(websocket)
+    if not user:
+        return
+    
+    await manager.connect(
+        user.id, websocket, last_event_id=last_event_id, subprotocol=wire.negotiate(websocket)
+    )
+    print(f"✅ Multiplexed WebSocket connected: {user.username}")
+    
+    # Advances the delivered watermark across ALL of the user's conversations in the background
+    receipt_worker.enqueue(user.id)
+    
+    # {conversation_id: participant_ids} for the conversations this socket is subscribed to
+    subscriptions: Dict[UUID, List[UUID]] = {}
+    
+    async def send_error(conversation_id, detail: str):
+        await manager.send_to_socket(user.id, websocket, {
+            "type": "error",
+            "conversation_id": str(conversation_id) if conversation_id else None,
+            "detail": detail
+        })
+    
+    async def handle_frame(data: dict, message_type: str, conversation_id: UUID):
+        if message_type == "subscribe":
+            if conversation_id not in subscriptions:
+                participant_ids = await membership_cache.get(conversation_id)
+                if participant_ids is None or user.id not in participant_ids:
+                    await send_error(conversation_id, "Conversation not found")
+                    return
                 
-                # ============ STEP 4.2: SAVE TO DATABASE ============
-                async with AsyncSessionLocal() as db:
-                    new_msg = await create_message_in_conversation(
-                        conversation_id=conversation_id,
-                        sender_id=user.id,
-                        content=content,
-                        message_type=msg_type,
-                        db=db
-                    )
-                    
-                    print(f"✅ Message saved to DB: {new_msg.id}")
-                    
-                    # ============ STEP 4.3: GET PARTICIPANTS ============
-                    result = await db.execute(
-                        select(Conversation).where(Conversation.id == conversation_id)
-                    )
-                    conversation = result.scalar_one_or_none()
-                    
-                    # ============ STEP 4.4: PREPARE INITIAL PAYLOAD ============
-                    # Note: read_by and delivered_to will be updated as we broadcast
-                    current_read_by = list(new_msg.read_by) if new_msg.read_by else []
-                    current_delivered_to = list(new_msg.delivered_to) if new_msg.delivered_to else []
-                    
-                    payload = {
-                        "type": "message",
-                        "id": str(new_msg.id),
-                        "conversation_id": str(conversation_id),
-                        "sender_id": str(new_msg.sender_id),
-                        "content": new_msg.content,
-                        "sent_at": new_msg.sent_at.isoformat(),
-                        "message_type": new_msg.type,
-                        "read_by": [str(uid) for uid in current_read_by],
-                        "delivered_to": [str(uid) for uid in current_delivered_to]
-                    }
-                    
-                    # ============ STEP 4.5: BROADCAST TO PARTICIPANTS ============
-                    if conversation:
-                        print(f"📢 Broadcasting message to {len(conversation.participant_ids)} participants in conversation {conversation_id}")
-                        for participant_id in conversation.participant_ids:
-                            if participant_id != user.id:
-                                delivered = await manager.send_message(participant_id, payload)
-                                print(f"📨 Message for conversation {conversation_id} sent to user {participant_id} (online: {delivered})")
-                                
-                                if delivered:
-                                    # Mark as delivered AND read immediately if user is online in this conversation
-                                    async with AsyncSessionLocal() as db2:
-                                        await db2.execute(
-                                            update(Message)
-                                            .where(Message.id == new_msg.id)
-                                            .values(
-                                                delivered_to=func.array_append(Message.delivered_to, participant_id),
-                                                read_by=func.array_append(Message.read_by, participant_id)
-                                            )
-                                        )
-                                        await db2.commit()
-                                        
-                                        # Update payload arrays for echo to sender
-                                        current_delivered_to.append(participant_id)
-                                        current_read_by.append(participant_id)
-                                        payload["delivered_to"] = [str(uid) for uid in current_delivered_to]
-                                        payload["read_by"] = [str(uid) for uid in current_read_by]
-                                        
-                                        # Send delivery receipt to sender
-                                        delivery_payload = {
-                                            "type": "delivery_receipt",
-                                            "message_id": str(new_msg.id),
-                                            "delivered_to_user_id": str(participant_id),
-                                            "conversation_id": str(conversation_id)
-                                        }
-                                        await manager.send_message(user.id, delivery_payload)
-                                        
-                                        # Send read receipt to sender
-                                        read_payload = {
-                                            "type": "read_receipt",
-                                            "message_id": str(new_msg.id),
-                                            "user_id": str(participant_id),
-                                            "conversation_id": str(conversation_id)
-                                        }
-                                        await manager.send_message(user.id, read_payload)
-                                        print(f"✅ Message delivered AND read by online user {participant_id}")
-                                
-                                print(f"📤 Broadcast to participant {participant_id}")
-                    
-                    # ============ STEP 4.6: ECHO TO SENDER ============
-                    await websocket.send_json(payload)
-                    print(f"✅ Echo sent to sender {user.username}")
+                subscriptions[conversation_id] = participant_ids
+                await manager.join_conversation(conversation_id, user.id, websocket)
+                print(f"✅ {user.username} subscribed to conversation {conversation_id}")
             
-            elif message_type == "typing":
-                # ============ TYPING INDICATOR (NOT SAVED) ============
-                async with AsyncSessionLocal() as db:
-                    result = await db.execute(
-                        select(Conversation).where(Conversation.id == conversation_id)
-                    )
-                    conversation = result.scalar_one_or_none()
-                    
-                    if conversation:
-                        typing_payload = {
-                            "type": "typing",
-                            "conversation_id": str(conversation_id),
-                            "user_id": str(user.id),
-                            "is_typing": data.get("is_typing", False)
-                        }
-                        
-                        # Broadcast to all except sender
-                        for participant_id in conversation.participant_ids:
-                            if participant_id != user.id:
-                                await manager.send_message(participant_id, typing_payload)
-                        
-                        print(f"📢 Typing indicator broadcast from {user.username}")
+            await manager.send_to_socket(user.id, websocket, {
+                "type": "subscribed", "conversation_id": str(conversation_id)
+            })
+            if data.get("history", True):
+                await send_history(user, websocket, conversation_id)
+        
+        elif message_type == "unsubscribe":
+            if subscriptions.pop(conversation_id, None) is not None:
+                await manager.leave_conversation(conversation_id, user.id, websocket)
+                print(f"👋 {user.username} unsubscribed from conversation {conversation_id}")
+            await manager.send_to_socket(user.id, websocket, {
+                "type": "unsubscribed", "conversation_id": str(conversation_id)
+            })
+        
+        elif message_type in CONVERSATION_HANDLERS:
+            if conversation_id not in subscriptions:
+                await send_error(conversation_id, "Not subscribed to this conversation")
+                return
             
-            elif message_type == "delivered":
-                # ============ MARK MESSAGE AS DELIVERED ============
-                message_id = data.get("message_id")
-                if message_id:
-                    async with AsyncSessionLocal() as db:
-                        from uuid import UUID as PyUUID
-                        
-                        msg_uuid = PyUUID(message_id)
-                        
-                        # Mark as delivered if not already
-                        await db.execute(
-                            update(Message)
-                            .where(
-                                and_(
-                                    Message.id == msg_uuid,
-                                    not_(user.id == any_(Message.delivered_to))
-                                )
-                            )
-                            .values(delivered_to=func.array_append(Message.delivered_to, user.id))
-                        )
-                        await db.commit()
-                        
-                        print(f"✅ Message {message_id} marked as delivered by {user.username}")
-                        
-                        # Send delivery receipt to sender
-                        result = await db.execute(
-                            select(Message).where(Message.id == msg_uuid)
-                        )
-                        msg = result.scalar_one_or_none()
-                        
-                        if msg and msg.sender_id != user.id:
-                            delivery_payload = {
-                                "type": "delivery_receipt",
-                                "message_id": str(message_id),
-                                "delivered_to_user_id": str(user.id),
-                                "conversation_id": str(conversation_id)
-                            }
-                            
-                            await manager.send_message(msg.sender_id, delivery_payload)
-                            print(f"📢 Delivery receipt sent to sender {msg.sender_id}")
+            participant_ids = await current_participants(
+                message_type, conversation_id, subscriptions[conversation_id]
+            )
+            if user.id not in participant_ids:
+                # Removed from the conversation while subscribed
+                subscriptions.pop(conversation_id)
+                await manager.leave_conversation(conversation_id, user.id, websocket)
+                await send_error(conversation_id, "No longer a participant")
+                return
             
-            elif message_type == "read":
-                # ============ MARK AS READ ============
-                message_ids = data.get("message_ids", [])  # Optional: specific message IDs
-                
-                async with AsyncSessionLocal() as db:
-                    if message_ids:
-                        # Mark specific messages as read
-                        from uuid import UUID as PyUUID
-                        
-                        msg_uuids = [PyUUID(mid) for mid in message_ids]
-                        
-                        # Only mark messages not already read by this user
-                        await db.execute(
-                            update(Message)
-                            .where(
-                                and_(
-                                    Message.id.in_(msg_uuids),
-                                    Message.sender_id != user.id,
-                                    not_(user.id == any_(Message.read_by))
-                                )
-                            )
-                            .values(read_by=func.array_append(Message.read_by, user.id))
-                        )
-                        await db.commit()
-                        
-                        print(f"✅ Marked {len(message_ids)} specific messages as read by {user.username}")
-                    else:
-                        # Mark entire conversation as read (existing behavior)
-                        await mark_conversation_as_read(
-                            conversation_id=conversation_id,
-                            user_id=user.id,
-                            db=db
-                        )
-                        
-                        print(f"✅ Entire conversation marked as read by {user.username}")
-                    
-                    # Broadcast read receipt
-                    result = await db.execute(
-                        select(Conversation).where(Conversation.id == conversation_id)
-                    )
-                    conversation = result.scalar_one_or_none()
-                    
-                    if conversation:
-                        read_payload = {
-                            "type": "read_receipt",
-                            "conversation_id": str(conversation_id),
-                            "user_id": str(user.id)
-                        }
-                        
-                        for participant_id in conversation.participant_ids:
-                            if participant_id != user.id:
-                                await manager.send_message(participant_id, read_payload)
-                        
-                        print(f"📢 Read receipt broadcast from {user.username}")
+            subscriptions[conversation_id] = participant_ids
+            await CONVERSATION_HANDLERS[message_type](user, websocket, conversation_id, participant_ids, data)
+        
+        else:
+            await send_error(conversation_id, f"Unknown message type: {message_type}")
+    
+    try:
+        while True:
+            try:
+                data = await wire.receive(websocket)
+            except ValueError as e:
+                await send_error(None, str(e))
+                continue
+            if not isinstance(data, dict):
+                await send_error(None, "Messages must be objects")
+                continue
             
-            elif message_type == "heartbeat":
-                # ============ KEEP ALIVE ============
+            message_type = data.get("type", "message")
+            
+            if message_type == "heartbeat":
                 await manager.heartbeat(user.id)
-                # print(f"💓 Heartbeat from {user.username}")
+                continue
+            
+            try:
+                conversation_id = UUID(str(data.get("conversation_id")))
+            except ValueError:
+                await send_error(None, "conversation_id is required")
+                continue
+            
+            # A bad frame only fails itself, never the other subscribed conversations
+            try:
+                await handle_frame(data, message_type, conversation_id)
+            except WebSocketDisconnect:
+                raise
+            except ValueError as e:
+                await send_error(conversation_id, str(e))
+            except Exception as e:
+                print(f"❌ Error handling {message_type} from {user.username}: {e}")
+                import traceback
+                traceback.print_exc()
+                await send_error(conversation_id, f"Could not process {message_type}")
     
     except WebSocketDisconnect:
-        print(f"🔌 User {user.username} disconnected from conversation {conversation_id}")
+        print(f"🔌 User {user.username} disconnected from multiplexed socket")
     
     except Exception as e:
         print(f"❌ WebSocket error for user {user.username}: {e}")
@@ -867,9 +965,10 @@ async def conversation_websocket(
         traceback.print_exc()
     
     finally:
-        # ============ CLEANUP ============
+        for conversation_id in list(subscriptions):
+            await manager.leave_conversation(conversation_id, user.id, websocket)
         await manager.disconnect(user.id, websocket)
-        print(f"🧹 Cleaned up connection for {user.username}")
+        print(f"🧹 Cleaned up multiplexed connection for {user.username}")
 
 
 @router.patch("/conversations/{conversation_id}/read", response_model=ConversationResponse)
@@ -893,9 +992,13 @@ async def mark_as_read(
             "user_id": str(current_user.id)
         }
         
-        for participant_id in conversation.participant_ids:
-            if participant_id != current_user.id:
-                await manager.send_message(participant_id, read_payload)
+        await manager.send_to_conversation(
+            conversation_id, current_user.id, conversation.participant_ids, read_payload
+        )
+        
+        await inbox_cache.apply_receipt(
+            conversation_id, conversation.participant_ids, current_user.id, read=True
+        )
         
         print(f"📢 Read receipt sent for conversation {conversation_id} by {current_user.username}")
         
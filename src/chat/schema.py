@@ -30,6 +30,12 @@ class MessageResponse(BaseModel):
         from_attributes = True
 
 
+class MessagePageResponse(BaseModel):
+    messages: List[MessageResponse]
+    next_cursor: Optional[str] = None  # Opaque; pass as before=/after= to continue in the same direction
+    has_more: bool = False
+
+
 # ==================== CONVERSATION SCHEMAS ====================
 
 class ConversationCreate(BaseModel):
@@ -1,10 +1,15 @@
-from src.chat.models import Message, Conversation
+from src.chat.models import Message, Conversation, ConversationMember
+from src.chat.membership import membership_cache
+from src.chat.inbox import inbox_cache
 from src.event.models import EventApplication, Event
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import distinct, select, or_, and_, func, any_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import distinct, select, update, delete, or_, and_, func, tuple_, cast, text, bindparam, ARRAY, DateTime, String
+from sqlalchemy.dialects.postgresql import UUID as PostgresUUID, insert as pg_insert
 from uuid import UUID
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 from datetime import datetime
+import base64
 
 
 async def create_message(
@@ -115,6 +120,32 @@ async def get_chatable_users(user_id: UUID, db: AsyncSession) -> List[UUID]:
 
 # ==================== CONVERSATION SERVICES ====================
 
+# Sets the last message and increments every other participant's unread count in a
+# single statement. Postgres re-evaluates the SET against the latest row version when
+# it waits on a concurrent sender, so no increments are lost.
+_BUMP_CONVERSATION_ON_MESSAGE = text("""
+    UPDATE conversations
+    SET last_message_id = :message_id,
+        last_message_at = :sent_at,
+        unread_counts = unread_counts || COALESCE((
+            SELECT jsonb_object_agg(p::text, COALESCE((unread_counts ->> p::text)::int, 0) + 1)
+            FROM unnest(participant_ids) AS p
+            WHERE p <> :sender_id
+        ), '{}'::jsonb)
+    WHERE id = :conversation_id
+      AND :sender_id = ANY(participant_ids)
+    RETURNING type, participant_ids
+""").bindparams(
+    bindparam("conversation_id", type_=PostgresUUID(as_uuid=True)),
+    bindparam("sender_id", type_=PostgresUUID(as_uuid=True)),
+    bindparam("message_id", type_=PostgresUUID(as_uuid=True)),
+    bindparam("sent_at", type_=DateTime()),
+).columns(
+    type=String(),
+    participant_ids=ARRAY(PostgresUUID(as_uuid=True)),
+)
+
+
 async def get_or_create_direct_conversation(
     user1_id: UUID,
     user2_id: UUID,
@@ -147,8 +178,15 @@ async def get_or_create_direct_conversation(
     )
     
     db.add(conversation)
+    await db.flush()
+    await add_conversation_members(db, conversation.id, participant_ids)
     await db.commit()
     await db.refresh(conversation)
+    
+    # Participants' inbox snapshots don't know about the new conversation yet, and
+    # workers delivering per conversation need to start listening to it
+    await inbox_cache.invalidate(conversation.participant_ids)
+    await membership_cache.publish_change(conversation.id, conversation.participant_ids)
     return conversation
 
 
@@ -177,8 +215,15 @@ async def create_group_conversation(
     )
     
     db.add(conversation)
+    await db.flush()
+    await add_conversation_members(db, conversation.id, participant_ids)
     await db.commit()
     await db.refresh(conversation)
+    
+    # Participants' inbox snapshots don't know about the new conversation yet, and
+    # workers delivering per conversation need to start listening to it
+    await inbox_cache.invalidate(conversation.participant_ids)
+    await membership_cache.publish_change(conversation.id, conversation.participant_ids)
     return conversation
 
 
@@ -201,8 +246,19 @@ async def add_participants_to_conversation(
     current_participants.update(user_ids)
     conversation.participant_ids = list(current_participants)
     
+    # New members start with everything sent so far counted as delivered and read
+    await add_conversation_members(
+        db, conversation.id, user_ids,
+        watermark_at=conversation.last_message_at if conversation.last_message_id else None,
+        watermark_message_id=conversation.last_message_id
+    )
+    
     await db.commit()
     await db.refresh(conversation)
+    
+    # Refresh every worker's membership cache and the members' inbox snapshots
+    await membership_cache.publish_change(conversation.id, conversation.participant_ids)
+    await inbox_cache.invalidate(conversation.participant_ids)
     return conversation
 
 
@@ -231,8 +287,19 @@ async def remove_participant_from_conversation(
             aid for aid in conversation.admin_ids if aid != user_id
         ]
     
+    await db.execute(
+        delete(ConversationMember).where(
+            ConversationMember.conversation_id == conversation_id,
+            ConversationMember.user_id == user_id
+        )
+    )
+    
     await db.commit()
     await db.refresh(conversation)
+    
+    # Refresh every worker's membership cache and the members' inbox snapshots
+    await membership_cache.publish_change(conversation.id, conversation.participant_ids)
+    await inbox_cache.invalidate([*conversation.participant_ids, user_id])
     return conversation
 
 
@@ -243,56 +310,60 @@ async def create_message_in_conversation(
     db: AsyncSession,
     message_type: str = "TEXT"
 ) -> Message:
-    """Create a message in a conversation"""
-    # Verify conversation exists and user is participant
-    result = await db.execute(
-        select(Conversation).where(Conversation.id == conversation_id)
-    )
-    conversation = result.scalar_one_or_none()
-    
-    if not conversation:
-        raise ValueError("Conversation not found")
-    
-    if sender_id not in conversation.participant_ids:
-        raise ValueError("User is not a participant in this conversation")
-    
-    # For direct chats, set receiver_id for backward compatibility
-    receiver_id = None
-    if conversation.type == "DIRECT":
-        receiver_id = next(
-            (uid for uid in conversation.participant_ids if uid != sender_id),
-            None
-        )
-    
+    """
+    Create a message in a conversation.
+    The message is inserted first (conversations.last_message_id references it), then
+    the conversation's last message and every other participant's unread count are
+    bumped in one atomic UPDATE (no read-modify-write of the JSONB dict).
+    """
     message = Message(
         conversation_id=conversation_id,
         sender_id=sender_id,
-        receiver_id=receiver_id,  # For backward compatibility
         content=content,
         type=message_type,
-        delivered_to=[],
-        read_by=[sender_id]  # Sender auto-reads their own message
+        sent_at=datetime.utcnow()
     )
     
     db.add(message)
-    await db.flush()  # Flush to generate message.id before using it
+    try:
+        await db.flush()  # Flush so the message row exists before it is referenced
+    except IntegrityError:
+        await db.rollback()
+        raise ValueError("Conversation not found")
     
-    # Update conversation's last message (now that message.id exists)
-    conversation.last_message_id = message.id
-    conversation.last_message_at = datetime.utcnow()
+    result = await db.execute(
+        _BUMP_CONVERSATION_ON_MESSAGE,
+        {
+            "conversation_id": conversation_id,
+            "sender_id": sender_id,
+            "message_id": message.id,
+            "sent_at": message.sent_at,
+        }
+    )
+    row = result.first()
     
-    # Increment unread counts for all participants except sender
-    unread_counts = conversation.unread_counts or {}
-    for participant_id in conversation.participant_ids:
-        if participant_id != sender_id:
-            current_count = unread_counts.get(str(participant_id), 0)
-            unread_counts[str(participant_id)] = current_count + 1
+    if row is None:
+        # Only on the failure path: tell "missing" apart from "not a participant".
+        # The rollback also discards the flushed message.
+        await db.rollback()
+        exists = await db.execute(
+            select(Conversation.id).where(Conversation.id == conversation_id)
+        )
+        if exists.scalar_one_or_none() is None:
+            raise ValueError("Conversation not found")
+        raise ValueError("User is not a participant in this conversation")
     
-    conversation.unread_counts = unread_counts
+    conversation_type, participant_ids = row
+    membership_cache.put(conversation_id, participant_ids)
+    
+    # For direct chats, set receiver_id for backward compatibility
+    if conversation_type == "DIRECT":
+        message.receiver_id = next(
+            (uid for uid in participant_ids if uid != sender_id),
+            None
+        )
     
     await db.commit()
-    await db.refresh(message)
-    await db.refresh(conversation)
     
     return message
 
@@ -314,46 +385,88 @@ async def mark_conversation_as_read(
     if user_id not in conversation.participant_ids:
         raise ValueError("User is not a participant")
     
-    # Reset unread count for this user
-    unread_counts = conversation.unread_counts or {}
-    unread_counts[str(user_id)] = 0
-    conversation.unread_counts = unread_counts
-    
-    # Update read_by arrays (PostgreSQL array append) only for messages not already read
-    from sqlalchemy import update, not_
+    # Reset unread count for this user (atomic JSONB merge, other users' counts untouched)
     await db.execute(
-        update(Message)
-        .where(
-            and_(
-                Message.conversation_id == conversation_id,
-                Message.sender_id != user_id,
-                not_(user_id == any_(Message.read_by))
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(
+            unread_counts=Conversation.unread_counts.op("||")(
+                func.jsonb_build_object(str(user_id), 0)
             )
         )
-        .values(read_by=func.array_append(Message.read_by, user_id))
     )
     
+    # Move this member's read (and delivered) watermark to the latest message
+    latest_result = await db.execute(
+        select(Message)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.sent_at.desc(), Message.id.desc())
+        .limit(1)
+    )
+    latest = latest_result.scalar_one_or_none()
+    if latest:
+        await advance_watermarks(db, [(conversation_id, user_id, latest)], read=True)
+    
     await db.commit()
     await db.refresh(conversation)
     return conversation
 
 
+def encode_message_cursor(message: Message) -> str:
+    """Opaque keyset cursor for a message: (sent_at, id)"""
+    raw = f"{message.sent_at.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_message_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """Decode a cursor produced by encode_message_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sent_at, message_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(sent_at), UUID(message_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
 async def get_conversation_messages(
     conversation_id: UUID,
     db: AsyncSession,
     limit: int = 50,
-    offset: int = 0
-) -> List[Message]:
-    """Get messages from a conversation with pagination"""
-    result = await db.execute(
-        select(Message)
-        .where(Message.conversation_id == conversation_id)
-        .order_by(Message.sent_at.desc())
-        .limit(limit)
-        .offset(offset)
-    )
-    messages = result.scalars().all()
-    return list(reversed(messages))  # Return in chronological order
+    before: Optional[str] = None,
+    after: Optional[str] = None
+) -> Tuple[List[Message], bool]:
+    """
+    Get messages from a conversation with keyset pagination on (sent_at, id).
+    `before` pages towards older messages, `after` towards newer ones; with neither
+    the latest page is returned. Returns (messages in chronological order, has_more).
+    """
+    if before and after:
+        raise ValueError("Use either 'before' or 'after', not both")
+    
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    
+    if after:
+        sent_at, message_id = decode_message_cursor(after)
+        query = (
+            query.where(tuple_(Message.sent_at, Message.id) > tuple_(sent_at, message_id))
+            .order_by(Message.sent_at.asc(), Message.id.asc())
+        )
+    else:
+        if before:
+            sent_at, message_id = decode_message_cursor(before)
+            query = query.where(tuple_(Message.sent_at, Message.id) < tuple_(sent_at, message_id))
+        query = query.order_by(Message.sent_at.desc(), Message.id.desc())
+    
+    # Fetch one extra row to know whether another page exists
+    result = await db.execute(query.limit(limit + 1))
+    messages = list(result.scalars().all())
+    
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    
+    if not after:
+        messages.reverse()  # Return in chronological order
+    return messages, has_more
 
 
 async def get_user_conversations(
@@ -361,11 +474,248 @@ async def get_user_conversations(
     db: AsyncSession
 ) -> List[Conversation]:
     """Get all conversations for a user"""
+    # participant_ids @> ARRAY[user_id] can use the GIN index (= ANY(...) cannot)
     result = await db.execute(
         select(Conversation)
-        .where(user_id == any_(Conversation.participant_ids))
+        .where(Conversation.participant_ids.op("@>")(cast([user_id], ARRAY(PostgresUUID(as_uuid=True)))))
         .order_by(Conversation.last_message_at.desc())
     )
     conversations = result.scalars().all()
     return list(conversations)
 
+
+async def get_user_conversation_ids(
+    user_id: UUID,
+    db: AsyncSession
+) -> List[UUID]:
+    """Ids of every conversation a user belongs to (member table, indexed by user_id)"""
+    result = await db.execute(
+        select(ConversationMember.conversation_id).where(ConversationMember.user_id == user_id)
+    )
+    return list(result.scalars().all())
+
+
+# ==================== DELIVERY / READ WATERMARKS ====================
+
+_WATERMARK_COLUMNS = {
+    "delivered": ("last_delivered_at", "last_delivered_message_id"),
+    "read": ("last_read_at", "last_read_message_id"),
+}
+
+
+async def add_conversation_members(
+    db: AsyncSession,
+    conversation_id: UUID,
+    user_ids: Iterable[UUID],
+    watermark_at: Optional[datetime] = None,
+    watermark_message_id: Optional[UUID] = None
+):
+    """Insert member rows (existing members are left untouched)"""
+    rows = [
+        {
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "last_delivered_at": watermark_at,
+            "last_delivered_message_id": watermark_message_id,
+            "last_read_at": watermark_at,
+            "last_read_message_id": watermark_message_id,
+            "joined_at": datetime.utcnow(),
+        }
+        for user_id in dict.fromkeys(user_ids)
+    ]
+    if not rows:
+        return
+    
+    await db.execute(
+        pg_insert(ConversationMember)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["conversation_id", "user_id"])
+    )
+
+
+async def get_conversation_members(
+    conversation_ids: Iterable[UUID],
+    db: AsyncSession
+) -> Dict[UUID, List[ConversationMember]]:
+    """Member watermark rows grouped by conversation"""
+    conversation_ids = list(set(conversation_ids))
+    members: Dict[UUID, List[ConversationMember]] = {cid: [] for cid in conversation_ids}
+    if not conversation_ids:
+        return members
+    
+    result = await db.execute(
+        select(ConversationMember).where(ConversationMember.conversation_id.in_(conversation_ids))
+    )
+    for member in result.scalars().all():
+        members[member.conversation_id].append(member)
+    return members
+
+
+def receipt_arrays(
+    message: Message,
+    members: List[ConversationMember]
+) -> Tuple[List[UUID], List[UUID]]:
+    """Derive (delivered_to, read_by) for a message from member watermarks"""
+    position = (message.sent_at, message.id)
+    delivered_to: List[UUID] = []
+    read_by: List[UUID] = [message.sender_id]  # Sender has always read their own message
+    
+    for member in members:
+        if member.user_id == message.sender_id:
+            continue
+        if member.last_read_at is not None and (member.last_read_at, member.last_read_message_id) >= position:
+            read_by.append(member.user_id)
+            delivered_to.append(member.user_id)
+        elif member.last_delivered_at is not None and (member.last_delivered_at, member.last_delivered_message_id) >= position:
+            delivered_to.append(member.user_id)
+    
+    return delivered_to, read_by
+
+
+async def get_undelivered_messages(
+    user_id: UUID,
+    db: AsyncSession,
+    conversation_id: Optional[UUID] = None
+) -> List[Message]:
+    """
+    Messages past the user's delivered watermark, across all their conversations
+    (or one). Served by the member primary key + (conversation_id, sent_at, id).
+    """
+    query = (
+        select(Message)
+        .join(ConversationMember, ConversationMember.conversation_id == Message.conversation_id)
+        .where(
+            ConversationMember.user_id == user_id,
+            Message.sender_id != user_id,
+            or_(
+                ConversationMember.last_delivered_at.is_(None),
+                tuple_(Message.sent_at, Message.id) > tuple_(
+                    ConversationMember.last_delivered_at,
+                    ConversationMember.last_delivered_message_id
+                )
+            )
+        )
+        .order_by(Message.conversation_id, Message.sent_at, Message.id)
+    )
+    if conversation_id is not None:
+        query = query.where(Message.conversation_id == conversation_id)
+    
+    result = await db.execute(query)
+    return list(result.scalars().all())
+
+
+async def advance_watermarks(
+    db: AsyncSession,
+    targets: Iterable[Tuple[UUID, UUID, Message]],
+    read: bool = False
+):
+    """
+    Move (conversation_id, user_id) watermarks forward to the given message, never
+    backwards. One UPDATE per watermark kind, executed for all targets.
+    Reading a message also marks it delivered.
+    """
+    params = [
+        {
+            "b_conversation_id": conversation_id,
+            "b_user_id": user_id,
+            "b_sent_at": message.sent_at,
+            "b_message_id": message.id,
+        }
+        for conversation_id, user_id, message in targets
+    ]
+    if not params:
+        return
+    
+    table = ConversationMember.__table__
+    for kind in (("delivered", "read") if read else ("delivered",)):
+        at_name, id_name = _WATERMARK_COLUMNS[kind]
+        at_col, id_col = table.c[at_name], table.c[id_name]
+        sent_at = bindparam("b_sent_at", type_=DateTime())
+        message_id = bindparam("b_message_id", type_=PostgresUUID(as_uuid=True))
+        
+        stmt = (
+            update(table)
+            .where(
+                table.c.conversation_id == bindparam("b_conversation_id", type_=PostgresUUID(as_uuid=True)),
+                table.c.user_id == bindparam("b_user_id", type_=PostgresUUID(as_uuid=True)),
+                or_(at_col.is_(None), tuple_(at_col, id_col) < tuple_(sent_at, message_id))
+            )
+            .values({at_name: sent_at, id_name: message_id})
+        )
+        await db.execute(stmt, params)
+
+
+def latest_per_conversation(messages: Iterable[Message]) -> Dict[UUID, Message]:
+    """Newest message of each conversation in `messages`"""
+    latest: Dict[UUID, Message] = {}
+    for message in messages:
+        current = latest.get(message.conversation_id)
+        if current is None or (message.sent_at, message.id) > (current.sent_at, current.id):
+            latest[message.conversation_id] = message
+    return latest
+
+
+async def mark_messages_delivered(
+    user_id: UUID,
+    db: AsyncSession,
+    conversation_id: Optional[UUID] = None
+) -> List[Message]:
+    """
+    Advance the user's delivered watermark past every pending message.
+    Returns the newly delivered messages (for receipts).
+    """
+    undelivered = await get_undelivered_messages(user_id, db, conversation_id)
+    if not undelivered:
+        return []
+    
+    await advance_watermarks(
+        db,
+        [(conv_id, user_id, msg) for conv_id, msg in latest_per_conversation(undelivered).items()]
+    )
+    await db.commit()
+    return undelivered
+
+
+async def mark_messages_delivered_bulk(
+    user_ids: Iterable[UUID],
+    db: AsyncSession
+) -> Dict[UUID, List[Message]]:
+    """
+    mark_messages_delivered for many users at once: one SELECT for everything
+    pending, one watermark UPDATE batch and one commit.
+    Returns {user_id: newly delivered messages} for users that had any.
+    """
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    
+    result = await db.execute(
+        select(ConversationMember.user_id, Message)
+        .join(ConversationMember, ConversationMember.conversation_id == Message.conversation_id)
+        .where(
+            ConversationMember.user_id.in_(user_ids),
+            Message.sender_id != ConversationMember.user_id,
+            or_(
+                ConversationMember.last_delivered_at.is_(None),
+                tuple_(Message.sent_at, Message.id) > tuple_(
+                    ConversationMember.last_delivered_at,
+                    ConversationMember.last_delivered_message_id
+                )
+            )
+        )
+        .order_by(ConversationMember.user_id, Message.conversation_id, Message.sent_at, Message.id)
+    )
+    
+    delivered: Dict[UUID, List[Message]] = {}
+    for user_id, message in result.all():
+        delivered.setdefault(user_id, []).append(message)
+    if not delivered:
+        return {}
+    
+    await advance_watermarks(db, [
+        (conv_id, user_id, msg)
+        for user_id, messages in delivered.items()
+        for conv_id, msg in latest_per_conversation(messages).items()
+    ])
+    await db.commit()
+    return delivered
@@ -0,0 +1,110 @@
+# Chat WebSocket wire protocols, negotiated through Sec-WebSocket-Protocol.
+#
+# "collab.json.v1"     verbose JSON (default when the client asks for nothing)
+# "collab.compact.v1"  JSON with short keys; read_by/delivered_to become counts
+# "collab.msgpack.v1"  the compact frames as MessagePack binary frames (needs msgpack)
+#
+# Only server -> client frames change. Clients keep sending the regular JSON
+# messages (as text, or as MessagePack binary frames on collab.msgpack.v1).
+
+from typing import List, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+from src.codec import dumps, loads
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_PROTOCOL = "collab.json.v1"
+COMPACT_PROTOCOL = "collab.compact.v1"
+MSGPACK_PROTOCOL = "collab.msgpack.v1"
+
+SUPPORTED_PROTOCOLS = [JSON_PROTOCOL, COMPACT_PROTOCOL] + ([MSGPACK_PROTOCOL] if msgpack else [])
+
+COMPACT_KEYS = {
+    "type": "t",
+    "id": "i",
+    "conversation_id": "c",
+    "sender_id": "s",
+    "user_id": "u",
+    "content": "b",
+    "sent_at": "at",
+    "message_type": "mt",
+    "message_id": "mi",
+    "message_ids": "ms",
+    "delivered_to_user_id": "du",
+    "receipt_type": "rt",
+    "timestamp": "ts",
+    "is_typing": "ty",
+    "status": "st",
+    "last_seen": "ls",
+    "messages": "m",
+    "final": "f",
+    "next_cursor": "nc",
+    "has_more": "hm",
+    "stream_id": "sid",
+}
+
+# Receipt arrays sent as counts: a client only needs "seen by N"
+COMPACT_COUNTS = {
+    "read_by": "r",
+    "delivered_to": "d",
+}
+
+Frame = Union[str, bytes]
+
+
+def negotiate(websocket: WebSocket) -> Optional[str]:
+    """First protocol offered by the client that we support (None: plain JSON, no header)"""
+    offered: List[str] = websocket.scope.get("subprotocols") or []
+    for protocol in offered:
+        if protocol in SUPPORTED_PROTOCOLS:
+            return protocol
+    return None
+
+
+def compact(payload):
+    """Shorten the keys of a frame (recursively) and replace receipt arrays with counts"""
+    if isinstance(payload, list):
+        return [compact(item) for item in payload]
+    if not isinstance(payload, dict):
+        return payload
+
+    frame = {}
+    for key, value in payload.items():
+        if key in COMPACT_COUNTS:
+            frame[COMPACT_COUNTS[key]] = len(value or ())
+        else:
+            frame[COMPACT_KEYS.get(key, key)] = compact(value)
+    return frame
+
+
+def encode(payload: dict, protocol: Optional[str] = None) -> Frame:
+    """Encode a frame for a socket speaking `protocol`"""
+    if protocol == COMPACT_PROTOCOL:
+        return dumps(compact(payload))
+    if protocol == MSGPACK_PROTOCOL:
+        return msgpack.packb(compact(payload))
+    return dumps(payload)
+
+
+async def receive(websocket: WebSocket) -> dict:
+    """
+    Next client message, from a text (JSON) or binary (MessagePack) frame.
+    Raises ValueError for a frame that can't be decoded.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+
+    if message.get("text") is None and msgpack is None:
+        raise ValueError("Binary frames are not supported")
+    try:
+        if message.get("text") is not None:
+            return loads(message["text"])
+        return msgpack.unpackb(message["bytes"])
+    except Exception as e:
+        # Decoders raise their own error types; callers only need to know the frame was bad
+        raise ValueError(f"Malformed frame: {e}") from e
@@ -0,0 +1,48 @@
+# JSON encoding for realtime payloads: orjson or msgspec when installed, stdlib otherwise.
+# Payloads are encoded once and the resulting text is passed through Redis and
+# written to every socket as-is.
+
+from datetime import date, datetime
+from uuid import UUID
+import json
+
+
+def _default(obj):
+    # Match what orjson/msgspec encode natively
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+try:
+    import orjson
+
+    JSON_BACKEND = "orjson"
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj, default=_default).decode()
+
+    loads = orjson.loads
+
+except ImportError:
+    try:
+        import msgspec
+
+        JSON_BACKEND = "msgspec"
+        _encoder = msgspec.json.Encoder(enc_hook=_default)
+        _decoder = msgspec.json.Decoder()
+
+        def dumps(obj) -> str:
+            return _encoder.encode(obj).decode()
+
+        loads = _decoder.decode
+
+    except ImportError:
+        JSON_BACKEND = "json"
+
+        def dumps(obj) -> str:
+            return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_default)
+
+        loads = json.loads
@@ -0,0 +1,236 @@
+from os import getenv
+from typing import Optional
+from uuid import UUID
+from datetime import datetime, timedelta
+import asyncio
+
+from sqlalchemy import and_, delete, event as sa_event, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.event.models import Event, EventBroadcastJob
+from src.brand.models import BrandProfile
+from src.influencer.models import InfluencerProfile
+from src.myenums import NotificationType
+
+# Influencers read from the database (and notified) per chunk; one transaction each
+EVENT_BROADCAST_CHUNK_SIZE = int(getenv("EVENT_BROADCAST_CHUNK_SIZE", "1000"))
+
+# Poll interval for jobs (the worker is also woken right after a local commit)
+EVENT_BROADCAST_INTERVAL = float(getenv("EVENT_BROADCAST_INTERVAL", "5"))
+
+# A running job is hidden from other workers for this long, renewed per chunk; a job
+# whose worker died is picked up again once its lease runs out
+EVENT_BROADCAST_LEASE = float(getenv("EVENT_BROADCAST_LEASE", "60"))
+
+# Retry delay after a failed chunk: doubles per attempt up to the max
+EVENT_BROADCAST_MIN_BACKOFF = float(getenv("EVENT_BROADCAST_MIN_BACKOFF", "1"))
+EVENT_BROADCAST_MAX_BACKOFF = float(getenv("EVENT_BROADCAST_MAX_BACKOFF", "300"))
+
+
+def matching_influencers_query(event: Event, after: Optional[UUID] = None):
+    """
+    (profile id, user id) of influencers matching the event on niche (category),
+    location or audience, using the same case-insensitive rules as the event
+    recommendations, in profile id order starting after `after`.
+    None when the event has nothing to match on.
+    """
+    criteria = []
+    if event.category:
+        criteria.append(func.lower(InfluencerProfile.niche) == event.category.lower())
+    if event.location:
+        criteria.append(func.lower(InfluencerProfile.location) == event.location.lower())
+    if event.target_audience:
+        # e.g. niche "fitness" matches target audience "Fitness enthusiasts, 18-30"
+        criteria.append(and_(
+            InfluencerProfile.niche != "",
+            func.strpos(event.target_audience.lower(), func.lower(InfluencerProfile.niche)) > 0
+        ))
+    if not criteria:
+        return None
+
+    query = (
+        select(InfluencerProfile.id, InfluencerProfile.user_id)
+        .where(or_(*criteria), InfluencerProfile.user_id != event.user_id)
+        .order_by(InfluencerProfile.id)
+    )
+    if after is not None:
+        query = query.where(InfluencerProfile.id > after)
+    return query
+
+
+class EventBroadcastWorker:
+    """
+    Background "new event" fan-out. create_event stages an EventBroadcastJob in
+    its own transaction and returns; the worker notifies matching influencers a
+    chunk at a time, so no request is held open however many influencers match.
+
+    Jobs live in Postgres, so a restart loses nothing: each chunk's
+    notifications commit together with the job's cursor, and a failed chunk is
+    retried with exponential backoff from the last committed one. Jobs are
+    claimed with FOR UPDATE SKIP LOCKED plus a lease, so every worker can run one.
+    """
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        """Start the worker when app starts"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            print("✅ Event broadcast worker started")
+
+    async def stop(self):
+        """Stop the worker when app shuts down"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            print("🛑 Event broadcast worker stopped")
+
+    def wake(self):
+        """Look for jobs now instead of on the next poll"""
+        self._wakeup.set()
+
+    def schedule(self, db: AsyncSession, event: Event):
+        """
+        Stage the broadcast of a new event in the caller's transaction (nothing
+        is committed here); it starts once the caller commits.
+        """
+        db.add(EventBroadcastJob(event=event))
+        sa_event.listen(db.sync_session, "after_commit", lambda session: self.wake(), once=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=EVENT_BROADCAST_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                while (job_id := await self.claim_job()) is not None:
+                    await self.run_job(job_id)
+            except Exception as e:
+                print(f"❌ Event broadcast worker error: {e}")
+
+    async def claim_job(self) -> Optional[UUID]:
+        """Take the lease on one due job; returns its id"""
+        from src.database import AsyncSessionLocal
+
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(EventBroadcastJob)
+                .where(EventBroadcastJob.available_at <= now)
+                .order_by(EventBroadcastJob.available_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            job = result.scalars().first()
+            if job is None:
+                return None
+            job.available_at = now + timedelta(seconds=EVENT_BROADCAST_LEASE)
+            db.add(job)
+            await db.commit()
+            return job.id
+
+    async def run_job(self, job_id: UUID) -> int:
+        """Run a claimed job chunk by chunk; returns how many influencers were notified"""
+        from src.database import AsyncSessionLocal
+
+        notified = 0
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    done, count = await self._run_chunk(db, job_id)
+                notified += count
+                if done:
+                    return notified
+            except Exception as e:
+                await self._retry_later(job_id, e)
+                return notified
+
+    async def _run_chunk(self, db: AsyncSession, job_id: UUID):
+        """Notify the next chunk and move the cursor, in one transaction. Returns (done, notified)."""
+        from src.notification.services import create_notifications_bulk
+
+        result = await db.execute(
+            select(EventBroadcastJob).where(EventBroadcastJob.id == job_id).with_for_update()
+        )
+        job = result.scalars().first()
+        if job is None:
+            # Event deleted meanwhile
+            return True, 0
+
+        result = await db.execute(
+            select(Event, BrandProfile.name)
+            .join(BrandProfile, BrandProfile.id == Event.brand_id)
+            .where(Event.id == job.event_id)
+        )
+        row = result.first()
+        query = matching_influencers_query(row[0], after=job.cursor) if row else None
+        if row is None or row[0].status != "active" or query is None:
+            await self._finish(db, job)
+            return True, 0
+        event, brand_name = row
+
+        chunk = (await db.execute(query.limit(EVENT_BROADCAST_CHUNK_SIZE))).all()
+        if not chunk:
+            await self._finish(db, job)
+            return True, 0
+
+        notifications = await create_notifications_bulk(
+            db,
+            [user_id for _, user_id in chunk],
+            NotificationType.new_event,
+            context={"brand_name": brand_name},
+            data={"event_id": str(event.id), "brand_id": str(event.brand_id)}
+        )
+        job.cursor = chunk[-1][0]
+        job.notified += len(notifications)
+        job.attempts = 0
+        job.last_error = None
+        job.available_at = datetime.utcnow() + timedelta(seconds=EVENT_BROADCAST_LEASE)
+        db.add(job)
+        # Notifications, their outbox entries and the cursor commit together
+        await db.commit()
+
+        if len(chunk) < EVENT_BROADCAST_CHUNK_SIZE:
+            await self._finish(db, job)
+            return True, len(notifications)
+        return False, len(notifications)
+
+    async def _finish(self, db: AsyncSession, job: EventBroadcastJob):
+        await db.execute(delete(EventBroadcastJob).where(EventBroadcastJob.id == job.id))
+        await db.commit()
+        print(f"📣 Event {job.event_id} broadcast to {job.notified} influencers")
+
+    async def _retry_later(self, job_id: UUID, error: Exception):
+        """Release a failed job with exponential backoff; it resumes from its cursor"""
+        from src.database import AsyncSessionLocal
+
+        try:
+            async with AsyncSessionLocal() as db:
+                job = await db.get(EventBroadcastJob, job_id)
+                if job is None:
+                    return
+                job.attempts += 1
+                delay = min(
+                    EVENT_BROADCAST_MIN_BACKOFF * 2 ** (job.attempts - 1),
+                    EVENT_BROADCAST_MAX_BACKOFF
+                )
+                job.available_at = datetime.utcnow() + timedelta(seconds=delay)
+                job.last_error = str(error)[:500]
+                db.add(job)
+                await db.commit()
+                print(f"❌ New event broadcast for event {job.event_id} failed, retrying in {delay:.0f}s: {error}")
+        except Exception as e:
+            # The lease runs out and another attempt picks the job up
+            print(f"❌ Could not reschedule event broadcast job {job_id}: {e}")
+
+
+event_broadcaster = EventBroadcastWorker()
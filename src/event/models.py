@@ -49,6 +49,30 @@ class EventApplication(SQLModel, table=True):
     messages: Mapped[List["Message"]] = Relationship(back_populates="application", sa_relationship_kwargs={"cascade": "all, delete-orphan"})
     
 
+class EventBroadcastJob(SQLModel, table=True):
+    """
+    Pending "new event" fan-out, written in the same transaction as the event.
+    The broadcast worker notifies matching influencers chunk by chunk, in
+    influencer id order, moving `cursor` forward in the same transaction as
+    each chunk's notifications; the row is deleted once every chunk is done.
+    """
+    __tablename__ = "event_broadcast_job"
+
+    id: Optional[UUID] = Field(default_factory=uuid4, primary_key=True)
+    event_id: UUID = Field(sa_column=Column(ForeignKey("event.id", ondelete="CASCADE"), nullable=False, unique=True))
+    # Last influencer profile id notified (None: not started)
+    cursor: Optional[UUID] = None
+    notified: int = 0
+    attempts: int = 0
+    # Not picked up before this time: the lease of the worker running it, or the retry delay
+    available_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    # Lets the unit of work insert the event before its job
+    event: Mapped["Event"] = Relationship()
+
+
 # Resolve forward references
 from src.auth.models import Users  
 from src.influencer.models import InfluencerProfile
@@ -1,17 +1,12 @@
 
 from typing import Optional
-from fastapi import APIRouter,Depends, HTTPException
-from sqlalchemy import select
+from fastapi import APIRouter,Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.auth.dependencies import get_current_user
 from src.auth.models import Users
-from src.influencer.models import InfluencerProfile
-from src.event.models import Event
 from src.event.schema import EventApplicationCreate, EventApplicationRead,EventApplicationInfo, EventApplicationStatusUpdate, EventCreate, EventRead, EventUpdate, UserPreference
 from src.event.services import create_event, delete_event, get_all_events, get_event, get_events_by_brand, apply_to_event, get_event_appplications, update_event, update_application_status, all_events,all_fuck_events, get_influencer_applications,get_applied_events
 from src.database import get_session
-from src.notification.services import create_notification
-from src.myenums import NotificationType
 from uuid import UUID
 
 router = APIRouter()
@@ -68,44 +63,8 @@ async def update_event_endpoint(event_id: UUID, event_in: EventUpdate, current_u
 
 @router.post ("/apply_event", response_model=EventApplicationRead)
 async def apply_to_event_endpoint(application_in: EventApplicationCreate, user: Users = Depends(get_current_user), db : AsyncSession = Depends(get_session)):
+    # The brand's notification is written in the same transaction (see add_notification)
     application = await apply_to_event(user,application_in, db)
-     # Get the event to find the brand owner's user_id
-    event_result = await db.execute(
-        select(Event).where(Event.id == application_in.event_id)
-    )
-    event = event_result.scalar_one_or_none()
-    if not event:
-        raise HTTPException(status_code=404, detail="Event not found")
-    
-    # Get influencer profile for the name
-    influencer_result = await db.execute(
-        select(InfluencerProfile).where(InfluencerProfile.id == application_in.influencer_id)
-    )
-    influencer = influencer_result.scalar_one_or_none()
-    if not influencer:
-        raise HTTPException(status_code=404, detail="Influencer profile not found")
-    
-
-    # create notification for brand
-    try:
-        await create_notification(
-            db=db,
-            user_id=event.user_id,
-            type=NotificationType.application_update,
-            context={
-                "status": "applied",
-                "influencer_name": influencer.name,
-                "event_name": event.title
-            },
-            data ={
-                "application_id": str(application.id),
-                "influencer_id": str(influencer.id),
-                "event_id": str(event.id)
-            }
-        )
-    except Exception as e:
-        print(f"Failed to create notification: {e}")
-
     return application
 
 @router.get ("/event_applications/{event_id}", response_model= list[EventApplicationInfo])
@@ -116,35 +75,8 @@ async def get_event_applications_endpoint(event_id: UUID, current_user: Users =
 
 @router.patch ("/update_application_status/{application_id}", response_model= EventApplicationRead)
 async def update_application_status_endpoint(application_id: UUID, status_in: EventApplicationStatusUpdate, current_user: Users = Depends(get_current_user), db: AsyncSession = Depends(get_session)):
+    # The influencer's notification is written in the same transaction (see add_notification)
     updated_application = await update_application_status(application_id, status_in.status, current_user, db)
-    # create notification for influencer
-    event_result = await db.execute(select(Event).where(Event.id == updated_application.event_id))
-    event = event_result.scalar_one_or_none()
-    if not event:
-        raise HTTPException(status_code=404, detail="Event not found")
-    
-    influencer_result = await db.execute(select(InfluencerProfile).where(InfluencerProfile.id == updated_application.influencer_id))    
-    influencer = influencer_result.scalar_one_or_none()
-    if not influencer:
-        raise HTTPException(status_code=404, detail="Influencer profile not found") 
-
-    try:
-        await create_notification(
-            db=db,
-            user_id=influencer.user_id,
-            type=NotificationType.application_update,
-            context={
-                "status": status_in.status,
-                "event_name": event.title
-            },
-            data ={
-                "application_id": str(updated_application.id),
-                "event_id": str(updated_application.event_id)
-            }
-        )
-    except Exception as e:
-        print(f"Failed to create notification: {e}")
-    
     return updated_application
 
 # @router.post("/accept_reject_application/{application_id}", response_model= EventApplicationRead)
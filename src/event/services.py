@@ -8,7 +8,9 @@ from src.brand.models import BrandProfile
 from src.influencer.models import InfluencerProfile
 from src.event.models import Event, EventApplication
 from src.event.schema import EventCreate, EventUpdate, EventApplicationCreate, UserPreference, EventApplicationRead, EventApplicationInfo, EventApplicationStatusUpdate
-from src.notification.services import create_notification
+from src.notification.services import add_notification
+from src.myenums import NotificationType
+from src.event.broadcast import event_broadcaster
 from uuid import UUID, uuid4
 from sqlmodel import select
 from typing import Optional
@@ -153,13 +155,16 @@ async def create_event(current_users: Users,current_brand_id: UUID, event_in:Eve
     )
     try:
         db.add(new_event)
+        # Notify matching influencers in the background (job committed with the event)
+        event_broadcaster.schedule(db, new_event)
         await db.commit()
         await db.refresh(new_event)
-        return new_event
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     
+    return new_event
+    
 
 async def delete_event(current_user: Users, event_id: UUID, db: AsyncSession):
 
@@ -170,14 +175,28 @@ async def delete_event(current_user: Users, event_id: UUID, db: AsyncSession):
     if event.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this event.")
     
+    # Accepted applications are deleted with the event; their chat contacts may go too
+    result2 = await db.execute(
+        select(InfluencerProfile.user_id)
+        .join(EventApplication, EventApplication.influencer_id == InfluencerProfile.id)
+        .where(EventApplication.event_id == event_id, EventApplication.status == "accepted")
+    )
+    affected_user_ids = list(result2.scalars().all())
+    brand_id = event.brand_id
+    
     try:
         await db.delete(event)
         await db.commit()
-        return {"message": "Event deleted successfully"}
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     
+    if affected_user_ids:
+        from src.chat.chatable import chatable_cache
+        brand_result = await db.execute(select(BrandProfile.user_id).where(BrandProfile.id == brand_id))
+        await chatable_cache.invalidate([*affected_user_ids, *brand_result.scalars().all()])
+    return {"message": "Event deleted successfully"}
+    
 async def update_event(current_user: Users, event_id: UUID, event_in: EventUpdate, db: AsyncSession) -> Event:
     result = await db.execute(select(Event).where(Event.id == event_id))
     event = result.scalars().first()
@@ -250,8 +269,31 @@ async def apply_to_event(current_user: Users, application_in: EventApplicationCr
         influencer_id= application_in.influencer_id,
         status= "pending"
     )
+    if application_in.influencer_id == current_influencer_profile.id:
+        influencer = current_influencer_profile
+    else:
+        influencer_result = await db.execute(select(InfluencerProfile).where(InfluencerProfile.id == application_in.influencer_id))
+        influencer = influencer_result.scalars().first()
+        if not influencer:
+            raise HTTPException(status_code=404, detail="Influencer profile not found")
     try:
         db.add(new_application)
+        # Notify the brand in the same transaction (published by the notification relay)
+        add_notification(
+            db,
+            event.user_id,
+            NotificationType.application_update,
+            context={
+                "status": "applied",
+                "influencer_name": influencer.name,
+                "event_name": event.title
+            },
+            data={
+                "application_id": str(new_application.id),
+                "influencer_id": str(influencer.id),
+                "event_id": str(event.id)
+            }
+        )
         await db.commit()
         await db.refresh(new_application)
         return new_application
@@ -286,15 +328,45 @@ async def update_application_status(application_id: UUID, new_status: str,curren
     if event.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to update this application.")           
     
+    pair = await db.execute(
+        select(BrandProfile.user_id, InfluencerProfile.user_id)
+        .where(BrandProfile.id == event.brand_id, InfluencerProfile.id == application.influencer_id)
+    )
+    users = pair.first()
+    
     application.status = new_status
     try:
         db.add(application)
+        if users:
+            # Notify the influencer in the same transaction (published by the notification relay)
+            add_notification(
+                db,
+                users[1],
+                NotificationType.application_update,
+                context={
+                    "status": new_status,
+                    "event_name": event.title
+                },
+                data={
+                    "application_id": str(application.id),
+                    "event_id": str(application.event_id)
+                }
+            )
         await db.commit()
         await db.refresh(application)
-        return application
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    
+    # Keep the cached chat contact graph in sync
+    from src.chat.chatable import chatable_cache
+    if users:
+        brand_user_id, influencer_user_id = users
+        if application.status == "accepted":
+            await chatable_cache.add_pair(brand_user_id, influencer_user_id)
+        else:
+            await chatable_cache.invalidate([brand_user_id, influencer_user_id])
+    return application
 
 
 
@@ -2,14 +2,19 @@
 
 from sqlmodel import SQLModel
 from src.database import engine
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from src.middleware.logging import logging_middleware
 from src.redis import redis
 from src.notification.sse_manger import sse_manager
 from src.chat.connection import manager as chat_manager
+from src.chat.receipts import receipt_worker
+from src.chat.presence import presence
+from src.event.broadcast import event_broadcaster
+from src.notification.relay import notification_relay
+from src.auth.dependencies import role_required
 
 app=FastAPI()
 
@@ -35,6 +40,34 @@ async def startup_event():
         print("Failed to start chat manager:", e)
         raise e
     
+    # Start delivery receipt worker
+    try:
+        await receipt_worker.start()
+    except Exception as e:
+        print("Failed to start delivery receipt worker:", e)
+        raise e
+    
+    # Start presence last_seen flush
+    try:
+        await presence.start()
+    except Exception as e:
+        print("Failed to start presence service:", e)
+        raise e
+    
+    # Start new-event notification fan-out
+    try:
+        await event_broadcaster.start()
+    except Exception as e:
+        print("Failed to start event broadcast worker:", e)
+        raise e
+    
+    # Start notification outbox relay
+    try:
+        await notification_relay.start()
+    except Exception as e:
+        print("Failed to start notification relay:", e)
+        raise e
+    
 @app.on_event("shutdown")
 async def shutdown_event():
     # Stop SSE manager
@@ -42,6 +75,18 @@ async def shutdown_event():
     
     # Stop chat manager
     await chat_manager.stop()
+    
+    # Stop delivery receipt worker
+    await receipt_worker.stop()
+    
+    # Flush buffered last_seen values
+    await presence.stop()
+    
+    # Stop new-event notification fan-out
+    await event_broadcaster.stop()
+    
+    # Stop notification outbox relay
+    await notification_relay.stop()
 
     await redis.close()
     print("Redis connection closed")
@@ -136,5 +181,25 @@ async def read_root():
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
+
+
+# Pub/sub listener health (503 while any subscriber is disconnected from Redis)
+@app.get("/health/subscribers")
+async def subscribers_health():
+    subscribers = [chat_manager.subscriber.health(), sse_manager.subscriber.health()]
+    healthy = all(sub["connected"] for sub in subscribers)
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={"status": "ok" if healthy else "degraded", "subscribers": subscribers}
+    )
+
+
+# Outbound queue depth per chat WebSocket on this worker (slowest clients first).
+# Lists the user ids of connected users, so admins only
+@app.get("/health/sockets", dependencies=[Depends(role_required("admin"))])
+async def sockets_health():
+    return chat_manager.socket_metrics()
+
+
 # SQLModel.metadata.create_all(engine) #because async engine, we cant use this method to create tables
 
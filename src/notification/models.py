@@ -23,6 +23,27 @@ class Notification(SQLModel, table=True):
     # Relationship using forward reference
     user: Mapped["Users"] = Relationship(back_populates="notifications")
 
+
+class NotificationOutbox(SQLModel, table=True):
+    """
+    Notifications waiting to be published to Redis. Written in the same
+    transaction as the notification (and the change that caused it), then
+    published and deleted by the notification relay.
+    """
+    __tablename__ = "notification_outbox"
+
+    id: Optional[UUID] = Field(default_factory=uuid4, primary_key=True)
+    notification_id: UUID = Field(sa_column=Column(ForeignKey("notification.id", ondelete="CASCADE"), nullable=False))
+    attempts: int = 0
+    # Not published before this time (pushed back after failed attempts)
+    available_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    # Lets the unit of work insert the notification before its outbox row
+    notification: Mapped["Notification"] = Relationship()
+
+
 # Resolve forward references at the end
 from src.auth.models import Users
 Notification.update_forward_refs()
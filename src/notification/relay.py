@@ -0,0 +1,115 @@
+from os import getenv
+from datetime import datetime, timedelta
+import asyncio
+
+from sqlalchemy import delete, select
+
+from src.notification.models import Notification, NotificationOutbox
+from src.notification.sse_manger import sse_manager
+
+# Poll interval (the relay is also woken right after a local commit), rows per batch
+NOTIFICATION_RELAY_INTERVAL = float(getenv("NOTIFICATION_RELAY_INTERVAL", "1"))
+NOTIFICATION_RELAY_BATCH_SIZE = int(getenv("NOTIFICATION_RELAY_BATCH_SIZE", "500"))
+
+# Retry delay after a failed publish: doubles per attempt up to the max
+NOTIFICATION_RELAY_MIN_BACKOFF = float(getenv("NOTIFICATION_RELAY_MIN_BACKOFF", "1"))
+NOTIFICATION_RELAY_MAX_BACKOFF = float(getenv("NOTIFICATION_RELAY_MAX_BACKOFF", "300"))
+
+
+class NotificationRelay:
+    """
+    Publishes committed notifications from the notification_outbox table to
+    Redis in batches. Rows are claimed with FOR UPDATE SKIP LOCKED, so every
+    worker can run a relay. Delivery is at-least-once: a notification can be
+    published again if the delete fails after a successful publish (clients
+    dedupe on id).
+    """
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        """Start the relay when app starts"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            print("✅ Notification relay started")
+
+    async def stop(self):
+        """Stop the relay when app shuts down"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            print("🛑 Notification relay stopped")
+
+    def wake(self):
+        """Publish soon instead of waiting for the next poll"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=NOTIFICATION_RELAY_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                # Drain full batches back to back
+                while await self.relay_batch() >= NOTIFICATION_RELAY_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print(f"❌ Notification relay error: {e}")
+
+    async def relay_batch(self) -> int:
+        """Publish one batch of due outbox rows; returns how many were published"""
+        from src.database import AsyncSessionLocal
+        from src.notification.services import notification_payload
+
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(NotificationOutbox, Notification)
+                .join(Notification, Notification.id == NotificationOutbox.notification_id)
+                .where(NotificationOutbox.available_at <= now)
+                .order_by(NotificationOutbox.available_at)
+                .limit(NOTIFICATION_RELAY_BATCH_SIZE)
+                .with_for_update(skip_locked=True, of=NotificationOutbox)
+            )
+            rows = result.all()
+            if not rows:
+                return 0
+
+            try:
+                await sse_manager.push_many(
+                    (notification.user_id, notification_payload(notification)) for _, notification in rows
+                )
+            except Exception as e:
+                # Keep the rows and retry them later with exponential backoff
+                for entry, _ in rows:
+                    entry.attempts += 1
+                    delay = min(
+                        NOTIFICATION_RELAY_MIN_BACKOFF * 2 ** (entry.attempts - 1),
+                        NOTIFICATION_RELAY_MAX_BACKOFF
+                    )
+                    entry.available_at = now + timedelta(seconds=delay)
+                    entry.last_error = str(e)[:500]
+                    db.add(entry)
+                await db.commit()
+                print(f"❌ Failed to publish {len(rows)} notifications, will retry: {e}")
+                return 0
+
+            await db.execute(
+                delete(NotificationOutbox).where(NotificationOutbox.id.in_([entry.id for entry, _ in rows]))
+            )
+            await db.commit()
+
+        print(f"📤 Relayed {len(rows)} notifications from the outbox")
+        return len(rows)
+
+
+notification_relay = NotificationRelay()
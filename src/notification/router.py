@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Header, Request
 from sqlalchemy import select
 from sse_starlette import EventSourceResponse
 from src.auth.models import Users
@@ -9,8 +9,8 @@ from src.notification.sse_manger import sse_manager
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.database import get_session
 import asyncio, json
+from typing import Optional
 from uuid import UUID
-from src.redis import redis
 
 router = APIRouter()
 
@@ -19,13 +19,20 @@ router = APIRouter()
 async def notification_stream(
     request: Request,
     current_user: Users = Depends(get_current_user),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
 ):
     """
     Server-Sent Events endpoint for real-time notifications.
     Frontend should connect to: GET /notification/stream
+    
+    Every notification carries an event id. EventSource sends the last one back
+    in the Last-Event-ID header when it reconnects, and only the notifications
+    after it are replayed (clients that can't set headers may pass ?last_event_id=).
     """
-    # Connect user to SSE manager
-    queue = await sse_manager.connect(current_user.id)
+    last_event_id = last_event_id or request.query_params.get("last_event_id")
+    
+    # Connect this stream to the SSE manager (each tab gets its own queue)
+    connection_id, queue = await sse_manager.connect(current_user.id, last_event_id)
 
     async def event_generator():
         try:
@@ -37,13 +44,15 @@ async def notification_stream(
                 
                 try:
                     # Wait for notification with timeout (heartbeat every 30s)
-                    data = await asyncio.wait_for(queue.get(), timeout=30.0)
+                    event_id, data = await asyncio.wait_for(queue.get(), timeout=30.0)
                     yield {
+                        "id": event_id,
                         "event": "notification",
                         "data": json.dumps(data),
                     }
                 except asyncio.TimeoutError:
                     # Send heartbeat to keep connection alive
+                    await sse_manager.heartbeat(current_user.id)
                     yield {
                         "event": "heartbeat",
                         "data": json.dumps({"status": "alive"}),
@@ -52,7 +61,7 @@ async def notification_stream(
             print(f"Stream cancelled for user {current_user.id}")
         finally:
             # Clean up when connection closes
-            await sse_manager.disconnect(current_user.id)
+            await sse_manager.disconnect(current_user.id, connection_id)
 
     return EventSourceResponse(event_generator())
 
@@ -159,7 +168,8 @@ async def get_notification_stats(
     
     return {
         "total_connected_users": total_connected,
-        "connections_on_this_worker": len(sse_manager.connections)
+        "connections_on_this_worker": sse_manager.connection_count(),
+        "users_on_this_worker": len(sse_manager.connections)
     }
 
 @router.delete("/{notification_id}")
@@ -183,12 +193,8 @@ async def delete_notification(
     
     await db.delete(notification)
     await db.commit()
-    cache_key = f"notification_cache:{current_user.id}"
-    cached = await redis.lrange(cache_key, 0, -1)
-
-    for notification_json in cached:
-        data = json.loads(notification_json)
-        if data.get("id") == str(notification_id):
-            await redis.lrem(cache_key, 0, notification_json)  # Remove from cache
+    
+    # Don't replay it to reconnecting streams
+    await sse_manager.forget(current_user.id, notification_id)
     
     return {"message": "Notification deleted"}
\ No newline at end of file
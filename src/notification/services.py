@@ -1,24 +1,68 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from uuid import UUID
-from src.notification.models import Notification
+from sqlalchemy import insert, event
+from uuid import UUID, uuid4
+from typing import Iterable, List, Optional, Tuple
+from datetime import datetime
+from os import getenv
+from src.notification.models import Notification, NotificationOutbox
 from src.myenums import NotificationType
 from src.notification.templates import NOTIFICATION_TEMPLATES
-from src.notification.sse_manger import NotificationSSEManager
+from src.notification.relay import notification_relay
 
-async def create_notification(
+# Rows per INSERT ... RETURNING in create_notifications_bulk
+NOTIFICATION_BULK_BATCH_SIZE = int(getenv("NOTIFICATION_BULK_BATCH_SIZE", "1000"))
+
+
+def render_notification(type: NotificationType, context: dict) -> Tuple[str, str]:
+    """Title and message for a notification type from its template"""
+    template = NOTIFICATION_TEMPLATES[type]
+    if isinstance(template, dict) and "status" in context:
+        template = template[context["status"]]
+
+    return template["title"], template["message"].format(**context)
+
+
+def notification_payload(notification: Notification) -> dict:
+    """SSE representation of a notification"""
+    return {
+        "id": str(notification.id),
+        "type": notification.type.value,
+        "title": notification.title,
+        "message": notification.message,
+        "data": notification.data,
+        "is_read": notification.is_read,
+        "created_at": notification.created_at.isoformat(),
+    }
+
+
+def _wake_relay(session):
+    notification_relay.wake()
+
+
+def _wake_relay_after_commit(db: AsyncSession):
+    """Publish right after the caller commits instead of on the relay's next poll"""
+    event.listen(db.sync_session, "after_commit", _wake_relay, once=True)
+
+
+def add_notification(
     db: AsyncSession,
     user_id: UUID,
     type: NotificationType,
     context: dict,
     data: dict | None = None,
-) -> Notification:
+) -> Optional[Notification]:
+    """
+    Stage a notification and its outbox entry in the caller's transaction
+    (nothing is committed here). Once the caller commits, the notification
+    relay publishes it; if the transaction rolls back, neither exists.
+    Returns None when there is no template for the type/status.
+    """
     # get template
-    template = NOTIFICATION_TEMPLATES[type]
-    if isinstance(template, dict) and "status" in context:
-        template = template[context["status"]]
-
-    title = template["title"]
-    message = template["message"].format(**context)
+    try:
+        title, message = render_notification(type, context)
+    except KeyError as e:
+        print(f"⚠️ No {type.value} notification template for {e}, skipping")
+        return None
 
     notification = Notification(
         user_id=user_id,
@@ -28,19 +72,74 @@ async def create_notification(
         data=data,
     )
     db.add(notification)
-    await db.commit()
-    await db.refresh(notification)
+    db.add(NotificationOutbox(notification=notification))
+    _wake_relay_after_commit(db)
+    return notification
 
 
-    #puuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuuush to sse manager
-    await NotificationSSEManager().push(user_id, {
-        "id": str(notification.id),
-        "type": notification.type.value,
-        "title": notification.title,
-        "message": notification.message,
-        "data": notification.data,
-        "is_read": notification.is_read,
-        "created_at": notification.created_at.isoformat(),
-    })
-
+async def create_notification(
+    db: AsyncSession,
+    user_id: UUID,
+    type: NotificationType,
+    context: dict,
+    data: dict | None = None,
+) -> Optional[Notification]:
+    """Create a notification on its own; it is published through the outbox"""
+    notification = add_notification(db, user_id, type, context, data)
+    if notification is not None:
+        await db.commit()
+        await db.refresh(notification)
     return notification
+
+
+async def create_notifications_bulk(
+    db: AsyncSession,
+    recipients: Iterable[UUID],
+    type: NotificationType,
+    context: dict,
+    data: dict | None = None,
+) -> List[Notification]:
+    """
+    Stage the same notification for many users, with their outbox entries, in
+    the caller's transaction (nothing is committed here). Each batch is one
+    multi-row INSERT ... RETURNING plus one multi-row outbox INSERT; the relay
+    publishes them once the caller commits.
+    """
+    title, message = render_notification(type, context)
+    recipients = list(dict.fromkeys(recipients))
+
+    created: List[Notification] = []
+    for start in range(0, len(recipients), NOTIFICATION_BULK_BATCH_SIZE):
+        batch = recipients[start:start + NOTIFICATION_BULK_BATCH_SIZE]
+        now = datetime.utcnow()
+        rows = [
+            {
+                "id": uuid4(),
+                "user_id": user_id,
+                "type": type,
+                "title": title,
+                "message": message,
+                "data": data,
+                "is_read": False,
+                "created_at": now,
+            }
+            for user_id in batch
+        ]
+
+        result = await db.scalars(insert(Notification).returning(Notification), rows)
+        created.extend(result.all())
+
+        await db.execute(insert(NotificationOutbox), [
+            {
+                "id": uuid4(),
+                "notification_id": row["id"],
+                "attempts": 0,
+                "available_at": now,
+                "created_at": now,
+            }
+            for row in rows
+        ])
+
+    if created:
+        _wake_relay_after_commit(db)
+    return created
@@ -1,14 +1,58 @@
 from collections import defaultdict
 import asyncio
 import json
-from uuid import UUID
-from typing import Dict
-from src.redis import redis, pubsub_redis
+import re
+from uuid import UUID, uuid4
+from typing import Dict, Iterable, List, Optional, Tuple
+from src.redis import redis
+from src.subscriber import SupervisedSubscriber
+
+# sse_connected:{user_id} counts the user's open streams on all workers; it expires
+# if heartbeats stop (e.g. a worker died without disconnecting its streams)
+SSE_PRESENCE_TTL = 3600
+
+# Drops the presence key once the user's last stream closes
+_SSE_DISCONNECT_SCRIPT = """
+local remaining = redis.call('DECR', KEYS[1])
+if remaining <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return remaining
+"""
+
+# Replay log per user: notification_stream:{user_id}, a Redis Stream whose entry ids
+# are the SSE event ids (monotonic per user), trimmed to exactly the last 50 entries
+NOTIFICATION_STREAM_MAXLEN = 50
+NOTIFICATION_STREAM_TTL = 86400  # 24 hours
+
+# Notifications buffered per open stream; larger than the replay window, so a
+# replay always fits
+SSE_QUEUE_SIZE = 100
+
+# Appends to the replay log and publishes {"stream_id", "notification"} so live
+# streams send the same event id a replay would
+_SSE_PUBLISH_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', ARGV[2], '*', 'data', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('PUBLISH', KEYS[2], '{"stream_id":"' .. id .. '","notification":' .. ARGV[1] .. '}')
+return id
+"""
+
+
+def _stream_key(user_id: UUID) -> str:
+    return f"notification_stream:{user_id}"
+
+
+def _id_tuple(stream_id: str) -> Tuple[int, int]:
+    ms, seq = stream_id.split("-")
+    return int(ms), int(seq)
+
 
 class NotificationSSEManager:
     def __init__(self):
-        # In-memory connections for this worker
-        self.connections: Dict[UUID, asyncio.Queue] = {}
+        # In-memory connections for this worker: {user_id: {connection_id: queue}},
+        # one queue per open stream (browser tab)
+        self.connections: Dict[UUID, Dict[str, asyncio.Queue]] = {}
         
         # Track active subscribers
         self.active_users: set[UUID] = set()
@@ -16,125 +60,167 @@ class NotificationSSEManager:
         # Redis pub/sub channel name
         self.channel_prefix = "notification:"
         
-        # Background task for listening to Redis
-        self._listener_task = None
+        # Supervised pub/sub subscription (reconnects with backoff, exposes health)
+        self.subscriber = SupervisedSubscriber(
+            "notification",
+            self._handle_notification,
+            patterns={"notification:*"}  # Pattern subscribe to all user channels
+        )
+        
+        self._disconnect_script = redis.register_script(_SSE_DISCONNECT_SCRIPT)
+        self._publish_script = redis.register_script(_SSE_PUBLISH_SCRIPT)
 
     async def start(self):
         """Start the Redis listener task when the app starts"""
-        if self._listener_task is None:
-            self._listener_task = asyncio.create_task(self._redis_listener())
-            print("✅ Redis notification listener started")
+        await self.subscriber.start()
+        print("✅ Redis notification listener started")
 
     async def stop(self):
         """Stop the Redis listener task when the app shuts down"""
-        if self._listener_task:
-            self._listener_task.cancel()
+        await self.subscriber.stop()
+        print("🛑 Redis notification listener stopped")
+
+    async def _handle_notification(self, channel: str, data: str):
+        """Push a notification published on any worker to every stream of the user on this worker"""
+        # Extract user_id from channel name: "notification:user_id"
+        user_id = UUID(channel.split(":", 1)[1])
+        
+        # If this worker has streams for this user, push the notification to each of them
+        queues = self.connections.get(user_id)
+        if queues:
             try:
-                await self._listener_task
-            except asyncio.CancelledError:
-                pass
-            print("🛑 Redis notification listener stopped")
-
-    async def _redis_listener(self):
-        """Background task that listens to Redis pub/sub for all users"""
-        try:
-            # Subscribe to notification channels
-            pubsub = pubsub_redis.pubsub()
-            await pubsub.psubscribe("notification:*")  # Pattern subscribe to all user channels
-            
-            print("🎧 Listening to Redis pub/sub for notifications...")
-            
-            async for message in pubsub.listen():
-                if message["type"] == "pmessage":
-                    # Extract user_id from channel name: "notification:user_id"
-                    channel = message["channel"]
-                    user_id = UUID(channel.split(":", 1)[1])
-                    
-                    # If this worker has a connection for this user, push notification
-                    if user_id in self.connections:
-                        try:
-                            data = json.loads(message["data"])
-                            await self.connections[user_id].put(data)
-                            print(f"📨 Pushed notification to user {user_id} on this worker")
-                        except Exception as e:
-                            print(f"❌ Error pushing notification: {e}")
-        except asyncio.CancelledError:
-            print("Listener task cancelled")
-            raise
-        except Exception as e:
-            print(f"❌ Redis listener error: {e}")
-            # Restart listener after error
-            await asyncio.sleep(5)
-            await self._redis_listener()
-
-    async def connect(self, user_id: UUID) -> asyncio.Queue:
-        """Called when a user connects to the SSE endpoint"""
-        queue = asyncio.Queue(maxsize=100)  # Limit queue size
-        self.connections[user_id] = queue
+                message = json.loads(data)
+                event = (message["stream_id"], message["notification"])
+                for connection_id, queue in list(queues.items()):
+                    try:
+                        queue.put_nowait(event)
+                    except asyncio.QueueFull:
+                        # Don't let one stuck tab hold up the listener
+                        print(f"⚠️ SSE queue full for user {user_id} ({connection_id}), dropping notification")
+                print(f"📨 Pushed notification to {len(queues)} streams of user {user_id} on this worker")
+            except Exception as e:
+                print(f"❌ Error pushing notification: {e}")
+
+    async def connect(self, user_id: UUID, last_event_id: Optional[str] = None) -> Tuple[str, asyncio.Queue]:
+        """
+        Called when a user opens an SSE stream; returns (connection_id, queue).
+        The queue yields (event_id, notification). With `last_event_id` only the
+        notifications after it are replayed, otherwise the whole replay window.
+        """
+        connection_id = uuid4().hex
+        queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        self.connections.setdefault(user_id, {})[connection_id] = queue
         self.active_users.add(user_id)
         
-        # Mark user as connected in Redis (for presence tracking)
-        await redis.setex(f"sse_connected:{user_id}", 3600, "1")  # Expire in 1 hour
+        # Count the stream in Redis (for presence tracking across workers and tabs)
+        key = f"sse_connected:{user_id}"
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, SSE_PRESENCE_TTL)
+            await pipe.execute()
         
-        print(f"✅ User {user_id} connected to SSE (Total connections: {len(self.connections)})")
+        print(f"✅ User {user_id} connected to SSE ({len(self.connections[user_id])} streams, {self.connection_count()} on this worker)")
         
-        # Send any cached notifications from Redis
-        await self._send_cached_notifications(user_id, queue)
+        # Send what the client missed from the replay log
+        await self._replay(user_id, queue, last_event_id)
         
-        return queue
+        return connection_id, queue
 
-    async def disconnect(self, user_id: UUID):
-        """Called when a user disconnects from SSE"""
-        if user_id in self.connections:
-            del self.connections[user_id]
+    async def disconnect(self, user_id: UUID, connection_id: str):
+        """Called when one of the user's SSE streams closes"""
+        queues = self.connections.get(user_id)
+        if queues is None or queues.pop(connection_id, None) is None:
+            return
         
-        if user_id in self.active_users:
-            self.active_users.remove(user_id)
+        if not queues:
+            del self.connections[user_id]
+            self.active_users.discard(user_id)
         
-        # Remove presence tracking
-        await redis.delete(f"sse_connected:{user_id}")
+        # Presence is removed when the user's last stream (on any worker) closes
+        await self._disconnect_script(keys=[f"sse_connected:{user_id}"])
         
-        print(f"🔌 User {user_id} disconnected from SSE (Total connections: {len(self.connections)})")
+        print(f"🔌 User {user_id} disconnected from SSE ({self.connection_count()} streams on this worker)")
+
+    async def heartbeat(self, user_id: UUID):
+        """Keep the presence key of a long-lived stream from expiring"""
+        await redis.expire(f"sse_connected:{user_id}", SSE_PRESENCE_TTL)
+
+    def connection_count(self) -> int:
+        """Open streams on this worker"""
+        return sum(len(queues) for queues in self.connections.values())
 
     async def push(self, user_id: UUID, data: dict):
         """
         Push notification to a user via Redis pub/sub.
         This works across all workers!
         """
-        channel = f"{self.channel_prefix}{user_id}"
-        
-        # Publish to Redis - all workers will receive this
-        await redis.publish(channel, json.dumps(data))
-        
-        # Also cache the notification in Redis for 24 hours
-        await self._cache_notification(user_id, data)
-        
-        print(f"📢 Published notification to Redis channel: {channel}")
+        await self.push_many([(user_id, data)])
 
-    async def _cache_notification(self, user_id: UUID, data: dict):
-        """Cache notifications in Redis for 24 hours"""
-        cache_key = f"notification_cache:{user_id}"
-        
-        # Store as a list with max 50 notifications
-        await redis.lpush(cache_key, json.dumps(data))
-        await redis.ltrim(cache_key, 0, 49)  # Keep only last 50
-        await redis.expire(cache_key, 86400)  # 24 hours
+    async def push_many(self, items: Iterable[Tuple[UUID, dict]]):
+        """
+        Publish and cache many notifications in one pipelined transaction
+        (one round trip for the whole batch)
+        """
+        items = list(items)
+        if not items:
+            return
+        
+        async with redis.pipeline(transaction=True) as pipe:
+            for user_id, data in items:
+                # Append to the user's replay log (24 hours) and publish - all workers will receive this
+                await self._publish_script(
+                    keys=[_stream_key(user_id), f"{self.channel_prefix}{user_id}"],
+                    args=[json.dumps(data), NOTIFICATION_STREAM_MAXLEN, NOTIFICATION_STREAM_TTL],
+                    client=pipe
+                )
+            await pipe.execute()
+        
+        print(f"📢 Published {len(items)} notifications to Redis")
 
-    async def _send_cached_notifications(self, user_id: UUID, queue: asyncio.Queue):
-        """Send cached notifications when user reconnects"""
-        cache_key = f"notification_cache:{user_id}"
-        
-        # Get cached notifications (newest first)
-        cached = await redis.lrange(cache_key, 0, -1)
-        
-        if cached:
-            print(f"📦 Sending {len(cached)} cached notifications to user {user_id}")
-            for notification_json in reversed(cached):  # Send oldest first
-                try:
-                    data = json.loads(notification_json)
-                    await queue.put(data)
-                except Exception as e:
-                    print(f"❌ Error sending cached notification: {e}")
+    async def _replay(self, user_id: UUID, queue: asyncio.Queue, last_event_id: Optional[str]):
+        """
+        Queue the notifications after `last_event_id` (all of the window without
+        one), newest NOTIFICATION_STREAM_MAXLEN at most
+        """
+        if last_event_id and not re.fullmatch(r"\d+-\d+", last_event_id):
+            last_event_id = None
+        
+        # Read from the tail, so a bound can only ever cut the oldest entries
+        entries = await redis.xrevrange(
+            _stream_key(user_id),
+            max="+",
+            min=f"({last_event_id}" if last_event_id else "-",
+            count=NOTIFICATION_STREAM_MAXLEN
+        )
+        if not entries:
+            return
+        entries.reverse()
+        
+        # Live notifications that arrived during the read are either in the replay
+        # too (skip them) or newer (queue them after it)
+        live = []
+        while not queue.empty():
+            live.append(queue.get_nowait())
+        
+        last_replayed = _id_tuple(entries[-1][0])
+        events = [(entry_id, json.loads(fields["data"])) for entry_id, fields in entries]
+        events += [event for event in live if _id_tuple(event[0]) > last_replayed]
+        # Keep the newest if live traffic filled the queue meanwhile
+        for event in events[-queue.maxsize:]:
+            queue.put_nowait(event)
+        
+        print(f"📦 Replayed {len(entries)} notifications to user {user_id}")
+
+    async def forget(self, user_id: UUID, notification_id: UUID):
+        """Remove a deleted notification from the user's replay log"""
+        key = _stream_key(user_id)
+        entries = await redis.xrange(key)
+        stale: List[str] = [
+            entry_id for entry_id, fields in entries
+            if json.loads(fields["data"]).get("id") == str(notification_id)
+        ]
+        if stale:
+            await redis.xdel(key, *stale)
 
     async def is_user_connected(self, user_id: UUID) -> bool:
         """Check if user is connected to SSE on any worker"""
@@ -0,0 +1,186 @@
+# Supervised Redis pub/sub subscriber shared by the chat and notification managers
+
+from os import getenv
+from typing import Awaitable, Callable, Optional, Set
+import asyncio
+import time
+
+from src.redis import pubsub_redis
+
+SUBSCRIBER_QUEUE_SIZE = int(getenv("SUBSCRIBER_QUEUE_SIZE", "10000"))
+SUBSCRIBER_MIN_BACKOFF = float(getenv("SUBSCRIBER_MIN_BACKOFF", "0.5"))
+SUBSCRIBER_MAX_BACKOFF = float(getenv("SUBSCRIBER_MAX_BACKOFF", "30"))
+
+
+class SupervisedSubscriber:
+    """
+    Long-running pub/sub subscription that survives Redis failures.
+
+    - Reconnects in a loop with exponential backoff (no recursion) and restores
+      every tracked channel/pattern, including ones added while disconnected.
+    - Reading and handling are decoupled by a bounded queue: a slow handler
+      can't stall the connection. When the queue is full new messages are
+      dropped and counted.
+    - health() reports connection state, lag and counters.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[str, str], Awaitable[None]],
+        channels: Optional[Set[str]] = None,
+        patterns: Optional[Set[str]] = None,
+        queue_size: int = SUBSCRIBER_QUEUE_SIZE
+    ):
+        self.name = name
+        self.handler = handler
+        self.channels: Set[str] = set(channels or ())
+        self.patterns: Set[str] = set(patterns or ())
+
+        self._queue: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=queue_size)
+        self._pubsub = None
+        self._reader_task = None
+        self._dispatch_task = None
+
+        # Health and metrics
+        self.connected = False
+        self.received = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.handler_errors = 0
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+        self.last_message_at: Optional[float] = None
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    async def start(self):
+        """Start reading and dispatching"""
+        if self._reader_task is None:
+            self._reader_task = asyncio.create_task(self._read_loop())
+            self._dispatch_task = asyncio.create_task(self._dispatch_loop())
+
+    async def stop(self):
+        """Stop both tasks and close the connection"""
+        for task in (self._reader_task, self._dispatch_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._reader_task = self._dispatch_task = None
+        await self._close()
+
+    async def subscribe(self, *channels: str):
+        """Track channels and subscribe now if connected (otherwise on reconnect)"""
+        self.channels.update(channels)
+        await self._apply("subscribe", channels)
+
+    async def unsubscribe(self, *channels: str):
+        self.channels.difference_update(channels)
+        await self._apply("unsubscribe", channels)
+
+    async def psubscribe(self, *patterns: str):
+        self.patterns.update(patterns)
+        await self._apply("psubscribe", patterns)
+
+    async def punsubscribe(self, *patterns: str):
+        self.patterns.difference_update(patterns)
+        await self._apply("punsubscribe", patterns)
+
+    async def _apply(self, command: str, names):
+        if not names or not self.connected or self._pubsub is None:
+            return
+        try:
+            await getattr(self._pubsub, command)(*names)
+        except Exception as e:
+            # The read loop will notice the broken connection and resubscribe
+            print(f"⚠️ [{self.name}] {command} failed, will retry on reconnect: {e}")
+
+    async def _close(self):
+        self.connected = False
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.aclose()
+            except Exception:
+                pass
+            self._pubsub = None
+
+    async def _read_loop(self):
+        backoff = SUBSCRIBER_MIN_BACKOFF
+        while True:
+            try:
+                pubsub = pubsub_redis.pubsub()
+                self._pubsub = pubsub
+                channels, patterns = set(self.channels), set(self.patterns)
+                if channels:
+                    await pubsub.subscribe(*channels)
+                if patterns:
+                    await pubsub.psubscribe(*patterns)
+                self.connected = True
+                backoff = SUBSCRIBER_MIN_BACKOFF
+
+                # Channels/patterns changed while we were (re)subscribing were only
+                # tracked (_apply skips while disconnected): catch up now
+                await self._apply("subscribe", self.channels - channels)
+                await self._apply("unsubscribe", channels - self.channels)
+                await self._apply("psubscribe", self.patterns - patterns)
+                await self._apply("punsubscribe", patterns - self.patterns)
+                print(f"🎧 [{self.name}] Subscribed to {len(self.channels)} channels, {len(self.patterns)} patterns")
+
+                async for message in pubsub.listen():
+                    if message["type"] not in ("message", "pmessage"):
+                        continue
+                    self.received += 1
+                    self.last_message_at = time.time()
+                    try:
+                        self._queue.put_nowait((message["channel"], message["data"], time.monotonic()))
+                    except asyncio.QueueFull:
+                        self.dropped += 1
+                        if self.dropped % 1000 == 1:
+                            print(f"⚠️ [{self.name}] Dispatch queue full, dropped {self.dropped} messages so far")
+
+                raise ConnectionError("pub/sub stream ended")
+
+            except asyncio.CancelledError:
+                print(f"[{self.name}] Subscriber task cancelled")
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                self.last_error = str(e)
+                print(f"❌ [{self.name}] Redis subscriber error: {e} (reconnecting in {backoff:.1f}s)")
+                await self._close()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, SUBSCRIBER_MAX_BACKOFF)
+
+    async def _dispatch_loop(self):
+        while True:
+            channel, data, enqueued_at = await self._queue.get()
+            self.last_lag = time.monotonic() - enqueued_at
+            self.max_lag = max(self.max_lag, self.last_lag)
+            try:
+                await self.handler(channel, data)
+                self.dispatched += 1
+            except Exception as e:
+                self.handler_errors += 1
+                print(f"❌ [{self.name}] Handler error on {channel}: {e}")
+
+    def health(self) -> dict:
+        """Snapshot for the health endpoint"""
+        return {
+            "name": self.name,
+            "connected": self.connected,
+            "channels": len(self.channels),
+            "patterns": len(self.patterns),
+            "queue_depth": self._queue.qsize(),
+            "lag_seconds": round(self.last_lag, 4),
+            "max_lag_seconds": round(self.max_lag, 4),
+            "received": self.received,
+            "dispatched": self.dispatched,
+            "dropped": self.dropped,
+            "handler_errors": self.handler_errors,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+            "last_message_at": self.last_message_at
+        }
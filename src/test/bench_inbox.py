@@ -0,0 +1,86 @@
+"""
+Inbox latency benchmark for get_user_conversations.
+
+Seeds N conversations (default 1,000,000) inside a transaction, runs the inbox
+query for a sample of users, prints latency percentiles and the query plan, then
+rolls everything back. Nothing is left in the database.
+
+    DATABASE_URL=... uv run python -m src.test.bench_inbox --conversations 1000000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import engine
+from src.chat.services import get_user_conversations
+
+
+async def run(conversations: int, users: int, samples: int):
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+        try:
+            print(f"🌱 Seeding {conversations:,} conversations across {users:,} users...")
+            started = time.perf_counter()
+            # Each conversation pairs two users drawn from a fixed pool, like DIRECT chats.
+            # last_message_id stays NULL: it references message.id and the inbox query
+            # only orders by last_message_at
+            await conn.execute(text("""
+                WITH pool AS (
+                    SELECT array_agg(gen_random_uuid()) AS ids FROM generate_series(1, :users)
+                )
+                INSERT INTO conversations
+                    (id, type, participant_ids, unread_counts, last_message_id, last_message_at, created_at, updated_at)
+                SELECT gen_random_uuid(), 'DIRECT',
+                       ARRAY[pool.ids[1 + (random() * (:users - 1))::int],
+                             pool.ids[1 + (random() * (:users - 1))::int]],
+                       '{}'::jsonb,
+                       NULL,
+                       now() - random() * interval '365 days',
+                       now(), now()
+                FROM generate_series(1, :conversations), pool
+            """), {"users": users, "conversations": conversations})
+            await conn.execute(text("ANALYZE conversations"))
+            print(f"✅ Seeded in {time.perf_counter() - started:.1f}s")
+
+            result = await conn.execute(text(
+                "SELECT participant_ids[1] FROM conversations TABLESAMPLE SYSTEM (1) LIMIT :n"
+            ), {"n": samples})
+            sample_users = [row[0] for row in result.all()]
+
+            db = AsyncSession(bind=conn)
+            timings = []
+            for user_id in sample_users:
+                started = time.perf_counter()
+                await get_user_conversations(UUID(str(user_id)), db)
+                timings.append((time.perf_counter() - started) * 1000)
+
+            timings.sort()
+            print(f"📊 Inbox latency over {len(timings)} users: "
+                  f"p50={statistics.median(timings):.2f}ms "
+                  f"p95={timings[int(len(timings) * 0.95) - 1]:.2f}ms "
+                  f"max={timings[-1]:.2f}ms")
+
+            plan = await conn.execute(text("""
+                EXPLAIN (ANALYZE, BUFFERS)
+                SELECT * FROM conversations
+                WHERE participant_ids @> ARRAY[CAST(:user_id AS uuid)]
+                ORDER BY last_message_at DESC
+            """), {"user_id": str(sample_users[0])})
+            print("\n".join(row[0] for row in plan.all()))
+        finally:
+            await trans.rollback()
+            print("🧹 Rolled back seeded data")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.conversations, args.users, args.samples))
@@ -0,0 +1,121 @@
+"""
+Overflow policy of the per-socket chat outbox, and stream replay through it.
+
+Run with pytest, or directly: python -m src.test.test_outbox
+"""
+import asyncio
+from uuid import uuid4
+
+from src.chat import connection
+from src.chat.outbox import SocketOutbox
+
+
+class FakeWebSocket:
+    """Records frames; each send takes `delay` seconds (a slow client)"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.sent = []
+        self.closed_with = None
+
+    async def send_text(self, frame):
+        await asyncio.sleep(self.delay)
+        self.sent.append(frame)
+
+    async def send_bytes(self, frame):
+        await self.send_text(frame)
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+class FakeStreamRedis:
+    """XRANGE over one in-memory stream, enough for ConnectionManager.replay"""
+
+    def __init__(self, count: int):
+        self.entries = [(f"{i}-0", {"data": f'{{"type": "message", "n": {i}}}'}) for i in range(1, count + 1)]
+
+    async def xrange(self, key, min="-", max="+", count=None):
+        after = int(min.lstrip("(").split("-")[0]) if min.startswith("(") else 0
+        entries = [entry for entry in self.entries if int(entry[0].split("-")[0]) > after]
+        return entries[:count] if count else entries
+
+
+async def _noop(outbox):
+    pass
+
+
+def _outbox(policy: str, size: int = 4) -> SocketOutbox:
+    # Writer not started: frames stay queued
+    return SocketOutbox(FakeWebSocket(), _noop, max_size=size, overflow_policy=policy)
+
+
+def test_drop_ephemeral_sheds_typing_first():
+    async def run():
+        outbox = _outbox("drop_ephemeral")
+        assert outbox.offer({"type": "typing"})
+        for n in range(3):
+            assert outbox.offer({"type": "message", "n": n})
+
+        # Full: a new typing frame is dropped, a message evicts the queued typing frame
+        assert outbox.offer({"type": "typing"})
+        assert outbox.offer({"type": "message", "n": 3})
+        assert outbox.dropped == 2
+        assert [frame["type"] for frame, _ in outbox._frames] == ["message"] * 4
+
+        # Full of frames that must not be lost: the socket has to go
+        assert not outbox.offer({"type": "message", "n": 4})
+
+    asyncio.run(run())
+
+
+def test_ephemeral_flag_applies_to_encoded_frames():
+    async def run():
+        outbox = _outbox("drop_ephemeral", size=1)
+        assert outbox.offer('{"type": "message"}')
+        assert outbox.offer('{"type": "status_update"}', ephemeral=True)
+        assert not outbox.offer('{"type": "message"}')
+
+    asyncio.run(run())
+
+
+def test_disconnect_policy():
+    async def run():
+        outbox = _outbox("disconnect", size=2)
+        assert outbox.offer({"type": "message"})
+        assert outbox.offer({"type": "typing"})
+        assert not outbox.offer({"type": "typing"})
+
+    asyncio.run(run())
+
+
+def test_replay_far_behind_client_is_not_evicted():
+    async def run():
+        manager = connection.ConnectionManager()
+        original_redis = connection.redis
+        connection.redis = FakeStreamRedis(count=1000)
+        try:
+            user_id = uuid4()
+            websocket = FakeWebSocket(delay=0.0005)
+            manager.active_connections[user_id] = {websocket}
+            manager._open_outbox(user_id, websocket)
+
+            replayed = await manager.replay(user_id, websocket, "0-0")
+            await manager._outboxes[websocket].wait_drained()
+
+            assert replayed == 1000
+            assert websocket.closed_with is None
+            assert len(websocket.sent) == 1000
+            assert '"n": 1000' in websocket.sent[-1] or '"n":1000' in websocket.sent[-1]
+            await manager._outboxes[websocket].close()
+        finally:
+            connection.redis = original_redis
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")